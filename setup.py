@@ -17,6 +17,7 @@ REQUIREMENTS: dict = {
         "Pillow",
         "requests",
         "piexif",  # Carry over and edit EXIF information
+        "numpy",  # Luminance metering in low light
 
         "uwsgi",
         "Flask"
@@ -26,6 +27,7 @@ REQUIREMENTS: dict = {
         'Pillow',
         'requests',
         'piexif',
+        'numpy',
         
         'pytest',
         'pytest-coverage',
@@ -36,6 +38,7 @@ REQUIREMENTS: dict = {
         'Pillow',
         'requests',
         'piexif',
+        'numpy',
         
         'pytest',
         'pytest-coverage',
@@ -74,7 +77,7 @@ setup(
     },
     entry_points={
         'console_scripts': [
-            'z-webcam=zanzocam.webcam.main:main',
+            'z-webcam=zanzocam.webcam.main:cli',
             'z-ui=zanzocam.web_ui.endpoints:main',
         ],
     },
@@ -0,0 +1,104 @@
+"""
+Measures how long adding the overlays to a picture takes and how much
+memory it needs, at the readout size of each sensor mode of the supported
+cameras, comparing the compositing module with the way pictures were
+composed before (a full RGBA copy of the picture and an RGBA canvas).
+Run it on the Raspberry Pi itself:
+
+    python tests/benchmarks/benchmark_compositing.py [--borders]
+
+Each measure runs in its own process, so that the peak memory of one size
+doesn't hide the next. Decoding, overlays rendering, compositing and JPEG
+encoding are all measured, like in `Camera._process_picture()`.
+"""
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+import numpy
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from zanzocam.constants import CAMERA_DEFAULTS
+from zanzocam.webcam import compositing
+from zanzocam.webcam.overlays import Overlay
+from zanzocam.webcam.camera import SENSOR_MODES
+
+
+def legacy_composite(photo, overlays, background_color, keep_alpha=False):
+    """
+    How the overlays were added before the compositing module
+    """
+    border_top, border_bottom, layout = compositing.plan_layout(photo.width, photo.height, overlays)
+    photo = photo.convert("RGBA")
+    image = Image.new("RGBA", (photo.width, photo.height + border_top + border_bottom), color=background_color)
+    image.paste(photo, (0, border_top))
+    for overlay, x, y in layout:
+        image.paste(overlay.rendered_image, (x, y), mask=overlay.rendered_image)
+    return image if keep_alpha else image.convert("RGB")
+
+
+def measure(path, output_path, borders, legacy, results):
+    """
+    Adds the overlays to the picture and puts the measures in `results`
+    """
+    start = time.perf_counter()
+    photo = Image.open(str(path))
+    photo.load()
+    overlays = [
+        Overlay("top_center", {"type": "text", "text": "ZanzoCam - %%DATE %%TIME",
+                               "over_the_picture": not borders},
+                photo.width, photo.height, None, None),
+        Overlay("bottom_right", {"type": "text", "text": "Benchmark", "over_the_picture": True},
+                photo.width, photo.height, None, None),
+    ]
+    composite = legacy_composite if legacy else compositing.composite
+    image = composite(photo, overlays, CAMERA_DEFAULTS["background_color"])
+    image.save(str(output_path), format="JPEG", quality=90)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+
+
+def run(path, output_path, borders, legacy):
+    """
+    Measures in a new process
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(path, output_path, borders, legacy, results))
+    process.start()
+    measures = results.get()
+    process.join()
+    return measures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the overlays compositing.")
+    parser.add_argument("--borders", action="store_true",
+                        help="put the top overlay out of the picture, which needs a larger canvas")
+    args = parser.parse_args()
+
+    sizes = sorted({size for modes in SENSOR_MODES.values() for size, _ in modes.values()})
+    print(f"Compositing {'with' if args.borders else 'without'} borders.")
+    print(f"{'resolution':>12} {'before (s)':>11} {'after (s)':>10} "
+          f"{'before RSS (MB)':>16} {'after RSS (MB)':>15}")
+    for width, height in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            path = Path(folder) / "picture.jpg"
+            noise = numpy.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=numpy.uint8)
+            Image.fromarray(noise).save(str(path), quality=90)
+            del noise
+
+            legacy_time, legacy_rss = run(path, Path(folder) / "legacy.jpg", args.borders, legacy=True)
+            new_time, new_rss = run(path, Path(folder) / "new.jpg", args.borders, legacy=False)
+        print(f"{width:>7}x{height:<4} {legacy_time:>11.2f} {new_time:>10.2f} "
+              f"{legacy_rss / 2**20:>16.1f} {new_rss / 2**20:>15.1f}")
+
+
+if "__main__" == __name__:
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures how long the merge of an exposure bracketing takes and how much
+memory it needs, at the readout size of each sensor mode of the supported
+cameras. Run it on the Raspberry Pi itself:
+
+    python tests/benchmarks/benchmark_merging.py [--frames 3] [--tile-rows 64]
+
+Each size runs in its own process, so that the peak memory of one size
+doesn't hide the next. `peak RSS` is the peak memory of the whole process
+(Python and the decoded pictures included), `peak numpy` the peak of the
+arrays allocated during the merge.
+"""
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+from pathlib import Path
+
+import numpy
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from zanzocam.constants import MERGE_TILE_ROWS
+from zanzocam.webcam import merging
+from zanzocam.webcam.camera import SENSOR_MODES
+
+
+def make_bracketing(folder, width, height, frames):
+    """
+    Saves `frames` JPEGs of a synthetic scene, from underexposed to overexposed
+    """
+    rows = numpy.linspace(0, 1, height, dtype=numpy.float32)[:, numpy.newaxis]
+    columns = numpy.linspace(0, 1, width, dtype=numpy.float32)[numpy.newaxis, :]
+    scene = (rows * 0.7 + columns * 0.3)[:, :, numpy.newaxis] * numpy.array([200, 220, 255], dtype=numpy.float32)
+    paths = []
+    for index, stop in enumerate(numpy.linspace(-2, 2, frames)):
+        picture = numpy.clip(scene * 2 ** stop, 0, 255).astype(numpy.uint8)
+        paths.append(Path(folder) / f"bracket_{index}.jpg")
+        Image.fromarray(picture).save(str(paths[-1]), quality=90)
+    return paths
+
+
+def measure(paths, output_path, tile_rows, results):
+    """
+    Merges the bracketing and puts the measures in `results`
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    merging.fuse_exposures(paths, output_path, tile_rows=tile_rows)
+    elapsed = time.perf_counter() - start
+    _, peak_numpy = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, peak_numpy))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the exposure bracketing merge.")
+    parser.add_argument("--frames", type=int, default=3, help="pictures in the bracketing (default: 3)")
+    parser.add_argument("--tile-rows", type=int, default=MERGE_TILE_ROWS,
+                        help=f"rows merged at once (default: {MERGE_TILE_ROWS})")
+    args = parser.parse_args()
+
+    sizes = sorted({size for modes in SENSOR_MODES.values() for size, _ in modes.values()})
+    print(f"Merging {args.frames} pictures, {args.tile_rows} rows at a time.")
+    print(f"{'resolution':>12} {'time (s)':>10} {'peak RSS (MB)':>14} {'peak numpy (MB)':>16}")
+    for width, height in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            paths = make_bracketing(folder, width, height, args.frames)
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=measure, args=(paths, Path(folder) / "merged.jpg", args.tile_rows, results))
+            process.start()
+            elapsed, peak_rss, peak_numpy = results.get()
+            process.join()
+        print(f"{width:>7}x{height:<4} {elapsed:>10.2f} {peak_rss / 2**20:>14.1f} {peak_numpy / 2**20:>16.1f}")
+
+
+if "__main__" == __name__:
+    main()
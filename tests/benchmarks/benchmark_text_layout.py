@@ -0,0 +1,107 @@
+"""
+Measures how long wrapping and measuring the text of an overlay takes,
+with long captions made of many lines, like weather bulletins, comparing
+the text_layout module with the way text was wrapped before (measuring
+the whole line at every word). Run it on the Raspberry Pi itself:
+
+    python tests/benchmarks/benchmark_text_layout.py [--font-size 25] [--repeat 5]
+
+The captions are wrapped at the width of the pictures of each sensor mode
+of the supported cameras. Both layouts must give the same lines: the
+benchmark stops if they don't. The widths of the words stay cached between
+the repetitions, like they do between the runs of the daemon.
+"""
+import sys
+import math
+import time
+import random
+import argparse
+import warnings
+from pathlib import Path
+
+from PIL import ImageFont
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from zanzocam.constants import FONT_PATH
+from zanzocam.webcam import text_layout
+from zanzocam.webcam.camera import SENSOR_MODES
+
+
+STATIONS = ["Passo del Tonale", "Cima Presena", "Ponte di Legno", "Vermiglio", "Pejo Fonti"]
+SKY = ["clear sky", "partly cloudy", "overcast", "light snow", "fog banks in the valleys"]
+
+
+def legacy_layout(font, text, max_width):
+    """
+    How the text was wrapped and measured before the text_layout module
+    """
+    lines = []
+    for line in text.split("\n"):
+        if font.getsize(line)[0] <= max_width:
+            lines.append(line)
+            continue
+        new_line = ""
+        for word in line.split(" "):
+            if font.getsize(new_line + word)[0] <= max_width:
+                new_line = new_line + word + " "
+            else:
+                lines.append(new_line)
+                new_line = word + " "
+        if new_line != "":
+            lines.append(new_line)
+    text_width = max([font.getsize(line)[0] for line in lines])
+    ascent, descent = font.getmetrics()
+    return lines, text_width, math.ceil(len(lines) * ascent * 1.03) + descent
+
+
+def bulletin(rng, lines):
+    """
+    A weather bulletin with the given number of lines
+    """
+    return "\n".join(
+        f"{rng.choice(STATIONS)}: {rng.choice(SKY)}, temperature {rng.uniform(-15, 25):.1f}°C, "
+        f"wind {rng.choice(['N', 'NE', 'WNW', 'S'])} at {rng.randint(0, 60)} km/h with gusts up to "
+        f"{rng.randint(20, 90)} km/h, humidity {rng.randint(20, 100)}%, fresh snow {rng.randint(0, 40)} cm, "
+        f"avalanche danger {rng.randint(1, 5)} out of 5, visibility {rng.randint(1, 30)} km."
+        for _ in range(lines))
+
+
+def timed(layout, font, text, width, repeat):
+    """
+    Best time of `repeat` layouts, and the layout itself
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = layout(font, text, width)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the text layout of the overlays.")
+    parser.add_argument("--font-size", type=int, default=25, help="size of the font (default: 25)")
+    parser.add_argument("--repeat", type=int, default=5, help="layouts per measure, the best is kept (default: 5)")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", DeprecationWarning)  # ImageFont.getsize
+
+    font = ImageFont.truetype(FONT_PATH, args.font_size)
+    widths = sorted({size[0] for modes in SENSOR_MODES.values() for size, _ in modes.values()})
+
+    print(f"Font size {args.font_size}, best of {args.repeat}.")
+    print(f"{'width':>6} {'lines':>6} {'before (ms)':>12} {'after (ms)':>11} {'speedup':>8}")
+    for width in widths:
+        for lines in [1, 10, 50]:
+            text = bulletin(random.Random(lines), lines)
+            legacy_time, legacy_result = timed(legacy_layout, font, text, width, args.repeat)
+            new_time, new_result = timed(text_layout.layout_text, font, text, width, args.repeat)
+            if legacy_result != new_result:
+                sys.exit(f"The layouts differ at width {width} with {lines} lines.")
+            print(f"{width:>6} {lines:>6} {legacy_time * 1000:>12.1f} {new_time * 1000:>11.1f} "
+                  f"{legacy_time / new_time:>7.1f}x")
+
+
+if "__main__" == __name__:
+    main()
@@ -5,6 +5,7 @@ import json
 import time
 import pytest
 import logging
+import numpy
 
 from PIL import Image
 from textwrap import dedent
@@ -15,7 +16,8 @@ from pathlib import Path, PosixPath
 from inspect import getmembers, isfunction, isclass, ismethod
 
 from zanzocam import constants
-from zanzocam.webcam import main, system, server, camera, overlays, configuration, utils
+from zanzocam.webcam import main, system, server, camera, overlays, configuration, utils, daemon, startup_report, metrics, spool, exposure, render_cache
+from zanzocam.webcam.server import http_server, ftp_server, download_index  # Imported lazily by Server
 from zanzocam.webcam.utils import log
 
 
@@ -31,9 +33,16 @@ def point_to_tmpdir(monkeypatch, tmpdir):
         server.server,
         server.http_server,
         server.ftp_server,
+        server.download_index,
         camera,
         overlays,
-        configuration
+        configuration,
+        daemon,
+        startup_report,
+        metrics,
+        spool,
+        exposure,
+        render_cache
     ]
     os.mkdir(tmpdir / "data")
     os.mkdir(tmpdir / "web_ui")
@@ -75,6 +84,9 @@ def point_to_tmpdir(monkeypatch, tmpdir):
 
     monkeypatch.setattr(system, "CRONJOB_FILE", tmpdir / "zanzocam")
 
+    # Overlays rendered by a previous test must not leak into the next one
+    render_cache.clear_memory_cache()
+
 
 def _patch_path(value: Union[Path, str], base_path: str, test_path: str) -> Union[Path, str]:
     new_value = str(value).replace(base_path, test_path)
@@ -116,6 +128,10 @@ class MockSystem:
         log("[TEST] applying system settings - mocked")
         return True
 
+    @staticmethod
+    def crontab_up_to_date(time_settings):
+        return True
+
     @staticmethod
     def log_general_status() -> bool:
         log("[TEST] Status report - mocked")
@@ -157,6 +173,14 @@ class MockServer:
         log("[TEST] uploading picture - mocked")
         return True
 
+    def spool_picture(self, *a, **k):
+        log("[TEST] spooling picture - mocked")
+        return True
+
+    def drain_spool(self, *a, **k):
+        log("[TEST] draining spool - mocked")
+        return True
+
     def update_configuration(self, *a, **k):
         return configuration.Configuration.create_from_dictionary({
             "server": {"new-test-config": "present"}
@@ -176,6 +200,9 @@ class MockCamera:
         log("[TEST] taking picture - mocked")
         return True
 
+    def is_burst(self, *a, **k):
+        return False
+
     def cleanup_image_files(self, *a, **k):
         log("[TEST] cleanup image files - mocked")
         return True
@@ -253,11 +280,12 @@ class MockCredentials:
 
 class MockGetRequest:
 
-    def __init__(self, data=None, status=200, file_stream=None):
+    def __init__(self, data=None, status=200, file_stream=None, headers=None):
         self.data = data
         self.raw = file_stream
         self.status_code = status
         self.reason = "TEST REASON"
+        self.headers = headers or {}
 
     def json(self):
         if self.data:
@@ -328,7 +356,26 @@ MockFramerateRange = namedtuple('PiFramerateRange', 'low high')
 
 
 class MockPiCamera:
+    #: Set it to simulate the automatic exposure and white balance converging
+    #:  in this many seconds after the settings change (see the `fake_clock` 
+    #:  fixture). If None, gains and exposure are not reported at all.
+    convergence_time = None
+
+    #: Like the real camera, gains and exposure read 0 for this many seconds
+    #:  after the camera is opened, even when `convergence_time` is set.
+    startup_time = 0.3
+
+    #: The values the automatic exposure and white balance converge to
+    converged_values = {
+        "analog_gain": Fraction(4, 1),
+        "digital_gain": Fraction(3, 2),
+        "awb_gains": (Fraction(9, 5), Fraction(7, 5)),
+    }
+
     def __init__(self, sensor_mode=None, framerate_range=None, *a, **k):
+        self._opened_at = camera.monotonic()
+        self._settings_changed_at = camera.monotonic()
+        self._awb_gains = None
         self.sensor_mode = sensor_mode
         if framerate_range:
             self.framerate_range = MockFramerateRange(*framerate_range)
@@ -347,8 +394,76 @@ class MockPiCamera:
     def __getattr__(self, *a, **k):
         return
 
-    def capture(self, path, *a, **k):
-        Image.new("RGB", (64, 48), color="#FF0000").save(path)
+    def __setattr__(self, name, value):
+        # Changing these settings makes the camera converge again
+        if name in ["iso", "shutter_speed", "framerate_range", "exposure_mode", "awb_mode"]:
+            object.__setattr__(self, "_settings_changed_at", camera.monotonic())
+        object.__setattr__(self, name, value)
+
+    def _converging(self, value):
+        """ Moves from half the value to the value in `convergence_time` seconds """
+        if self.convergence_time is None:
+            return None
+        if camera.monotonic() - self._opened_at < self.startup_time:
+            return 0
+        progress = (camera.monotonic() - self._settings_changed_at) / self.convergence_time
+        return value * Fraction(min(1, 0.5 + progress / 2)).limit_denominator(1000)
+
+    @property
+    def analog_gain(self):
+        return self._converging(self.converged_values["analog_gain"])
+
+    @property
+    def digital_gain(self):
+        return self._converging(self.converged_values["digital_gain"])
+
+    @property
+    def exposure_speed(self):
+        if self.convergence_time is None:
+            return None
+        return self.shutter_speed or int(self._converging(20000))
+
+    @property
+    def awb_gains(self):
+        if self._awb_gains:
+            return self._awb_gains
+        if self.convergence_time is None:
+            return None
+        return tuple(self._converging(gain) for gain in self.converged_values["awb_gains"])
+
+    @awb_gains.setter
+    def awb_gains(self, gains):
+        self._awb_gains = gains
+
+    def capture(self, output, format=None, resize=None, *a, **k):
+        if not resize and isinstance(output, numpy.ndarray):
+            resize = (output.shape[1], output.shape[0])
+        picture = Image.new("RGB", resize or (64, 48), color="#FF0000")
+        if isinstance(output, (str, Path)):
+            picture.save(output)
+        else:
+            output[:] = numpy.asarray(picture)
+
+    def capture_continuous(self, output, *a, **k):
+        while True:
+            self.capture(output)
+            yield output
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """
+        Makes sleep() in camera.py return immediately and advance 
+        the clock of camera.py instead. Returns the list of the sleeps.
+    """
+    clock = [1000.0]
+    sleeps = []
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+    monkeypatch.setattr(camera, "sleep", fake_sleep)
+    monkeypatch.setattr(camera, "monotonic", lambda: clock[0])
+    return sleeps
 
 
 @pytest.fixture(autouse=True)
@@ -1,4 +1,5 @@
 import os
+import pytest
 from unittest import mock
 from fractions import Fraction
 from PIL import Image, ImageChops
@@ -105,6 +106,41 @@ def test_prepare_camera_object_too_tall(logs):
         assert picam.resolution[1] == picam.MAX_RESOLUTION.height
 
 
+def test_plan_sensor_mode():
+    plan = webcam.camera.plan_sensor_mode
+    low_light = webcam.camera.LOW_LIGHT_FRAMERATE_RANGE[0]
+    # v2: the binned mode fits pictures up to 1640x1232, at any framerate
+    assert plan("imx219", 1640, 1232, low_light) == 4
+    assert plan("imx219", 1641, 1232, low_light) == 3
+    assert plan("imx219", 3280, 2464, low_light) == 3
+    # v1: the binned modes can't take long exposures
+    assert plan("ov5647", 640, 480, constants.DAYLIGHT_MIN_FRAMERATE) == 4
+    assert plan("ov5647", 640, 480, low_light) == 3
+    # HQ
+    assert plan("imx477", 1920, 1080, low_light) == 2
+    # Unknown cameras and sizes
+    assert plan(None, 100, 100, low_light) == 3
+    assert plan("imx219", 5000, 5000, low_light) == 3
+
+
+def test_prepare_camera_object_plans_sensor_mode(monkeypatch, logs):
+    monkeypatch.setattr(PiCamera, "revision", "imx219", raising=False)
+    camera = Camera({'image': {'width': 1280, 'height': 960}})
+    with camera._prepare_camera_object() as picam:
+        assert picam.sensor_mode == 4
+        assert picam.resolution == (1280, 960)
+    assert in_logs(logs, "Using sensor mode 4")
+
+    camera = Camera({'image': {'width': 1280, 'height': 960, 'sensor_mode': 3}})
+    with camera._prepare_camera_object() as picam:
+        assert picam.sensor_mode == 3
+
+    camera = Camera({'image': {'width': 1280, 'height': 960, 'sensor_mode': 'wrong'}})
+    with camera._prepare_camera_object() as picam:
+        assert picam.sensor_mode == 4
+    assert in_logs(logs, "Invalid sensor mode: 'wrong'")
+
+
 def test_camera_capture(tmpdir, logs):
     camera = Camera({'image': {}})
     camera.temp_photo_path = tmpdir / "temp_photo.jpg"
@@ -131,6 +167,42 @@ def test_take_picture(monkeypatch, logs):
     assert "Processing picture" in logs[1]
 
 
+def test_is_burst(logs):
+    assert not Camera({'image': {}}).is_burst()
+    assert Camera({'image': {'burst_frames': 3}}).is_burst()
+    assert not Camera({'image': {'burst_frames': 'many'}}).is_burst()
+    assert in_logs(logs, "Invalid number of pictures for the burst")
+
+
+def test_take_burst(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {'burst_frames': 3, 'burst_interval': 10}})
+    monkeypatch.setattr(webcam.camera.Camera, '_process_picture',
+                        lambda self: os.replace(self.temp_photo_path, self.processed_image_path))
+    frames = []
+    processing = []
+    assert camera.take_burst(lambda path, timestamp: frames.append(path),
+                             before_processing=lambda: processing.append(True)) == 3
+    assert frames == [constants.DATA_PATH / f".burst_{shot}.jpg" for shot in [1, 2, 3]]
+    assert all(os.path.exists(frame) for frame in frames)
+    assert processing == [True]
+    # The pictures are shot on schedule: the warm-up sleeps come first
+    assert fake_clock[-2:] == [10, 10]
+    assert in_logs(logs, "Burst completed: 3 pictures shot")
+
+
+def test_take_burst_stops_before_the_end_of_the_run(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {'burst_frames': 10, 'burst_interval': 10}})
+    monkeypatch.setattr(webcam.camera.Camera, '_process_picture',
+                        lambda self: os.replace(self.temp_photo_path, self.processed_image_path))
+    monkeypatch.setattr(webcam.camera, 'time_left', 
+                        lambda *a: 60 - (webcam.camera.monotonic() - 1000))
+    frames = []
+    shot = camera.take_burst(lambda path, timestamp: frames.append(path))
+    assert shot == len(frames)
+    assert 1 < shot < 10
+    assert in_logs(logs, "Not enough time left in this run for more pictures")
+
+
 def test_shoot_picture_no_low_light_check(tmpdir, logs):
     camera = Camera({'image': {}})
     camera.temp_photo_path = tmpdir / "temp_photo.jpg"
@@ -215,6 +287,39 @@ def test_shoot_picture_low_light_luminance_with_settle(monkeypatch, tmpdir, logs
     assert "Final luminance" in logs[7]
 
 
+def test_shoot_picture_low_light_opens_camera_once(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {'let_awb_settle_in_dark': True}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+
+    opened_cameras = []
+    prepare_camera_object = webcam.camera.Camera._prepare_camera_object
+    def counting_prepare_camera_object(self, *a, **k):
+        opened_cameras.append(prepare_camera_object(self, *a, **k))
+        return opened_cameras[-1]
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_prepare_camera_object',
+                        counting_prepare_camera_object)
+
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE - 10)
+    search_cameras = []
+    def mock_low_light_search(self, luminance, camera=None, picture_taken=True):
+        search_cameras.append(camera)
+        return (constants.MINIMUM_DAYLIGHT_LUMINANCE, 10**6, 800, 1)
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_low_light_search',
+                        mock_low_light_search)
+
+    camera._shoot_picture()
+    assert len(opened_cameras) == 1
+    assert search_cameras == opened_cameras
+    assert opened_cameras[0].shutter_speed == 10**6
+    assert opened_cameras[0].iso == 800
+    assert opened_cameras[0].exposure_mode == "off"
+    assert len([line for line in logs if "Camera warm-up" in line]) == 1
+
+
 def test_low_light_search_twilight_three_attempts(monkeypatch, tmpdir, logs):
     camera = Camera({'image': {}})
     camera.temp_photo_path = tmpdir / "temp_photo.jpg"
@@ -224,7 +329,7 @@ def test_low_light_search_twilight_three_attempts(monkeypatch, tmpdir, logs):
                         lambda *a, **k: None)
 
     monkeypatch.setattr(webcam.camera.Camera, 
-                        '_luminance_from_path', 
+                        '_meter_luminance', 
                         mock.Mock(side_effect=[
                             constants.MINIMUM_DAYLIGHT_LUMINANCE + 10,
                             constants.MINIMUM_DAYLIGHT_LUMINANCE - 10,
@@ -244,6 +349,54 @@ def test_low_light_search_twilight_three_attempts(monkeypatch, tmpdir, logs):
     assert "OK! Luminance achieved" in logs[5]
 
 
+def test_low_light_search_reuses_open_camera(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    
+    monkeypatch.setattr(webcam.camera.Camera,
+                        "_camera_capture",
+                        lambda *a, **k: None)
+
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_meter_luminance', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE)
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_compute_target_luminance',
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE)
+
+    with camera._prepare_camera_object() as picam:
+        _, _, iso, _ = camera._low_light_search(constants.MINIMUM_DAYLIGHT_LUMINANCE - 10, picam)
+
+        assert tuple(picam.framerate_range) == webcam.camera.LOW_LIGHT_FRAMERATE_RANGE
+        assert iso == constants.INITIAL_LOW_LIGHT_ISO
+
+    assert len(logs) == 4
+    assert "Low light detected" in logs[0]
+    assert "Trying to get a brighter image" in logs[1]
+    assert "Reconfiguring the camera for low light" in logs[2]
+    assert "OK! Luminance achieved" in logs[3]
+
+
+def test_low_light_search_starts_from_exposure_history(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    webcam.exposure.record_exposure(3 * 10**6, 800, constants.MINIMUM_DAYLIGHT_LUMINANCE, 5)
+    
+    monkeypatch.setattr(webcam.camera.Camera,
+                        "_camera_capture",
+                        lambda *a, **k: None)
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_meter_luminance', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE)
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_compute_target_luminance',
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE)
+
+    _, shutter_speed, iso, attempts = camera._low_light_search(constants.NO_LUMINANCE_THRESHOLD - 1)
+    assert (shutter_speed, iso, attempts) == (3 * 10**6, 800, 1)
+    assert in_logs(logs, "Starting from the exposure found in the previous runs")
+
+
 def test_low_light_search_initial_picture_very_dark(monkeypatch, tmpdir, logs):
     camera = Camera({'image': {}})
     camera.temp_photo_path = tmpdir / "temp_photo.jpg"
@@ -253,7 +406,7 @@ def test_low_light_search_initial_picture_very_dark(monkeypatch, tmpdir, logs):
                         lambda *a, **k: None)
 
     monkeypatch.setattr(webcam.camera.Camera, 
-                        '_luminance_from_path', 
+                        '_meter_luminance', 
                         lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE)
 
     monkeypatch.setattr(webcam.camera.Camera,
@@ -278,7 +431,7 @@ def test_low_light_search_one_attempt_returns_a_black_frame(monkeypatch, tmpdir,
                         lambda *a, **k: None)
 
     monkeypatch.setattr(webcam.camera.Camera, 
-                        '_luminance_from_path', 
+                        '_meter_luminance', 
                         mock.Mock(side_effect=[
                             0.0,
                             constants.MINIMUM_DAYLIGHT_LUMINANCE,
@@ -306,7 +459,7 @@ def test_low_light_attempts_are_limited(monkeypatch, tmpdir, logs):
                         lambda *a, **k: None)
 
     monkeypatch.setattr(webcam.camera.Camera, 
-                        '_luminance_from_path', 
+                        '_meter_luminance', 
                         lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE - 10)
 
     monkeypatch.setattr(webcam.camera.Camera,
@@ -331,7 +484,7 @@ def test_low_light_shutter_speed_and_ISO_are_limited(monkeypatch, tmpdir, logs):
                         lambda *a, **k: None)
 
     monkeypatch.setattr(webcam.camera.Camera, 
-                        '_luminance_from_path', 
+                        '_meter_luminance', 
                         lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE - 10)
 
     # This makes _low_light_equation return a crazy high number
@@ -352,6 +505,219 @@ def test_low_light_shutter_speed_and_ISO_are_limited(monkeypatch, tmpdir, logs):
     assert "ISO is at 800 and shutter speed is at max" in logs[9]
     
 
+def gamma_sensor(brightness):
+    """ Meters the luminance of a gamma encoded sensor in a scene of the given brightness """
+    return lambda self, camera: min(255, brightness * (camera.shutter_speed * camera.iso) ** (1/2.2))
+
+
+def test_shoot_picture_uses_the_configured_low_light_algorithm(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {'low_light_algorithm': 'secant'}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE - 10)
+    secant_search = mock.Mock(return_value=(constants.MINIMUM_DAYLIGHT_LUMINANCE, 1, 1, 1))
+    monkeypatch.setattr(webcam.camera.Camera, '_secant_search', secant_search)
+
+    camera._shoot_picture()
+    assert secant_search.call_count == 1
+
+    camera.low_light_algorithm = "wrong"
+    monkeypatch.setattr(webcam.camera.Camera, '_low_light_search', secant_search)
+    camera._shoot_picture()
+    assert secant_search.call_count == 2
+    assert in_logs(logs, "Unknown low light algorithm: 'wrong'")
+
+
+def test_secant_search_converges_faster(monkeypatch, fake_clock, tmpdir, logs):
+    monkeypatch.setattr(webcam.camera.Camera, "_camera_capture", lambda *a, **k: None)
+    monkeypatch.setattr(webcam.exposure, "predict_exposure", lambda *a, **k: None)
+    for brightness in [0.002, 0.01, 0.05]:
+        monkeypatch.setattr(webcam.camera.Camera, '_meter_luminance', gamma_sensor(brightness))
+        initial_luminance = brightness * (constants.MIN_SHUTTER_SPEED * 100) ** (1/2.2)
+        target_luminance = Camera._compute_target_luminance(initial_luminance)
+
+        _, _, _, proportional_attempts = Camera({'image': {}})._low_light_search(initial_luminance)
+        luminance, _, _, attempts = Camera({'image': {}})._secant_search(initial_luminance)
+        assert abs(luminance - target_luminance) <= constants.TARGET_LUMINOSITY_MARGIN
+        assert attempts <= 2
+        assert attempts < proportional_attempts
+
+
+def test_secant_search_black_and_saturated_pictures(monkeypatch, fake_clock, tmpdir, logs):
+    monkeypatch.setattr(webcam.camera.Camera, "_camera_capture", lambda *a, **k: None)
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_compute_target_luminance',
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE)
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_meter_luminance', 
+                        mock.Mock(side_effect=[
+                            0.0,
+                            255,
+                            constants.MINIMUM_DAYLIGHT_LUMINANCE,
+                        ]))
+
+    luminance, _, _, attempts = Camera({'image': {}})._secant_search(10)
+    assert (luminance, attempts) == (constants.MINIMUM_DAYLIGHT_LUMINANCE, 3)
+    assert in_logs(logs, "# 1: black picture")
+    assert in_logs(logs, "# 2: saturated picture")
+
+
+def test_secant_search_stops_at_max_exposure(monkeypatch, fake_clock, tmpdir, logs):
+    capture = mock.Mock()
+    monkeypatch.setattr(webcam.camera.Camera, "_camera_capture", capture)
+    monkeypatch.setattr(webcam.camera.Camera, '_meter_luminance', gamma_sensor(10**-5))
+
+    _, shutter_speed, iso, attempts = Camera({'image': {}})._secant_search(0.1)
+    assert (shutter_speed, iso) == (constants.MAX_SHUTTER_SPEED, constants.MAX_LOW_LIGHT_ISO)
+    assert attempts < 9
+    assert capture.call_count == 1
+    assert in_logs(logs, "The exposure can't be increased further")
+    assert webcam.exposure.predict_exposure() == (constants.MAX_SHUTTER_SPEED, constants.MAX_LOW_LIGHT_ISO)
+
+
+def test_split_exposure():
+    iso = constants.INITIAL_LOW_LIGHT_ISO
+    assert Camera._split_exposure(10**6 * iso) == (10**6, iso)
+    assert Camera._split_exposure(constants.MAX_SHUTTER_SPEED * iso * 1.5) == \
+        (int(constants.MAX_SHUTTER_SPEED * 0.75), iso * 2)
+    assert Camera._split_exposure(constants.MAX_SHUTTER_SPEED * iso * 100) == \
+        (constants.MAX_SHUTTER_SPEED, constants.MAX_LOW_LIGHT_ISO)
+
+
+def test_shoot_picture_records_awb_gains_with_enough_light(monkeypatch, fake_clock, tmpdir, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 1)
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE + 10)
+    camera._shoot_picture()
+    assert webcam.exposure.predict_awb_gains() == pytest.approx(
+        tuple(float(gain) for gain in PiCamera.converged_values["awb_gains"]))
+
+
+def test_shoot_picture_records_awb_gains_after_a_full_warm_up(monkeypatch, fake_clock, tmpdir, logs):
+    # The readings start at zero and don't settle within the warm-up
+    monkeypatch.setattr(PiCamera, "convergence_time", 2 * constants.CAMERA_WARM_UP_TIME)
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE + 10)
+    camera._shoot_picture()
+    assert in_logs(logs, "did not settle")
+    assert webcam.exposure.predict_awb_gains()
+
+
+def test_shoot_picture_does_not_record_zero_awb_gains(monkeypatch, fake_clock, tmpdir, logs):
+    # The camera never reports its values within the warm-up
+    monkeypatch.setattr(PiCamera, "convergence_time", 1)
+    monkeypatch.setattr(PiCamera, "startup_time", 2 * constants.CAMERA_WARM_UP_TIME)
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE + 10)
+    camera._shoot_picture()
+    assert webcam.exposure.predict_awb_gains() is None
+
+
+def test_shoot_picture_does_not_record_awb_gains_in_the_dark(monkeypatch, fake_clock, tmpdir, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 1)
+    camera = Camera({'image': {'use_low_light_algorithm': True}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_NIGHT_LUMINANCE - 10)
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_low_light_search',
+                        lambda *a, **k: (constants.MINIMUM_DAYLIGHT_LUMINANCE, 1, 1, 1))
+    camera._shoot_picture()
+    assert webcam.exposure.predict_awb_gains() is None
+
+
+def test_shoot_picture_low_light_uses_cached_awb_gains(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {'let_awb_settle_in_dark': True}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.exposure, "predict_awb_gains", lambda *a, **k: (1.5, 1.25))
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE - 10)
+    search_cameras = []
+    def mock_low_light_search(self, luminance, camera=None, picture_taken=True):
+        search_cameras.append((camera.awb_mode, camera.awb_gains))
+        return (constants.MINIMUM_DAYLIGHT_LUMINANCE, 10**6, 800, 1)
+    monkeypatch.setattr(webcam.camera.Camera, '_low_light_search', mock_low_light_search)
+
+    camera._shoot_picture()
+    # The low light search already shoots with the cached white balance
+    assert search_cameras == [("off", (1.5, 1.25))]
+    assert in_logs(logs, "Using the white balance of the previous runs at this time")
+    assert not in_logs(logs, "Adjusting white balance")
+    assert sum(fake_clock) <= constants.CAMERA_WARM_UP_TIME
+
+
+def test_wait_until_settled_no_gains_reported(fake_clock, logs):
+    camera = Camera({'image': {}})
+    with camera._prepare_camera_object() as picam:
+        assert camera._wait_until_settled(picam, 5) == 5
+    assert sum(fake_clock) == 5
+    assert all(interval <= constants.CONVERGENCE_POLL_INTERVAL for interval in fake_clock)
+    assert len(logs) == 0
+
+
+def test_wait_until_settled_polls_until_values_are_reported(monkeypatch, fake_clock, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 1)
+    camera = Camera({'image': {}})
+    with camera._prepare_camera_object() as picam:
+        assert picam.analog_gain == 0
+        waited = camera._wait_until_settled(picam, 5)
+    assert waited < 5
+    # While the camera reads 0 the polls keep going, instead of waiting it all at once
+    assert fake_clock[0] == constants.CONVERGENCE_POLL_INTERVAL
+    assert len(logs) == 0
+
+
+def test_wait_until_settled_converges_early(monkeypatch, fake_clock, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 2)
+    camera = Camera({'image': {}})
+    with camera._prepare_camera_object() as picam:
+        waited = camera._wait_until_settled(picam, 5)
+    assert 2 <= waited < 5
+    assert len(logs) == 0
+
+
+def test_wait_until_settled_never_converges(monkeypatch, fake_clock, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 10)
+    camera = Camera({'image': {}})
+    with camera._prepare_camera_object() as picam:
+        assert camera._wait_until_settled(picam, 5) == 5
+    assert in_logs(logs, "did not settle in 5.0s")
+
+
+def test_wait_until_settled_polls_once_per_frame(monkeypatch, fake_clock, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 10)
+    camera = Camera({'image': {}})
+    with camera._prepare_camera_object() as picam:
+        picam.shutter_speed = 4 * 10**6
+        waited = camera._wait_until_settled(picam, 40)
+    assert waited < 40
+    # Once the camera reports its values, after the first polls
+    reported = fake_clock.index(4)
+    assert reported > 0
+    assert all(interval == 4 for interval in fake_clock[reported:])
+
+
+def test_shoot_picture_warm_up_ends_when_settled(monkeypatch, fake_clock, tmpdir, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 1)
+    camera = Camera({'image': {'use_low_light_algorithm': False}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    camera._shoot_picture()
+    assert sum(fake_clock) < constants.CAMERA_WARM_UP_TIME
+    assert "Camera warm-up" in logs[0]
+
+
 def test_compute_target_luminance_daylight(logs):
     camera = Camera({'image': {}})
     lum = constants.MINIMUM_DAYLIGHT_LUMINANCE + 10
@@ -397,6 +763,69 @@ def test_luminance_from_path_black_pic(tmpdir, logs):
     assert len(logs) == 0
 
 
+def test_picture_luminance_metering_modes(tmpdir, logs):
+    # A dark picture with a bright lamp in a quarter of it
+    picture = Image.new("RGB", (400, 300), color="#141414")
+    picture.paste((255, 255, 255), (0, 0, 200, 150))
+    picture.save(str(tmpdir / 'pic.jpg'))
+
+    camera = Camera({'image': {}})
+    assert camera._picture_luminance(tmpdir / 'pic.jpg') == camera._luminance_from_path(tmpdir / 'pic.jpg')
+    assert camera._picture_luminance(tmpdir / 'pic.jpg') > constants.MINIMUM_DAYLIGHT_LUMINANCE
+
+    camera = Camera({'image': {'metering_mode': 'median'}})
+    assert camera._picture_luminance(tmpdir / 'pic.jpg') < constants.MINIMUM_DAYLIGHT_LUMINANCE
+
+    camera = Camera({'image': {'metering_mode': 'region', 'metering_region': [0.5, 0.5, 1, 1]}})
+    assert camera._picture_luminance(tmpdir / 'pic.jpg') < constants.MINIMUM_DAYLIGHT_LUMINANCE
+    assert len(logs) == 0
+
+
+def test_picture_luminance_invalid_metering_mode(tmpdir, logs):
+    Image.new("RGB", (40, 30), color="#808080").save(str(tmpdir / 'pic.png'))
+    camera = Camera({'image': {'metering_mode': 'region'}})
+    assert camera._picture_luminance(tmpdir / 'pic.png') == camera._luminance_from_path(tmpdir / 'pic.png')
+    assert camera.metering_mode == "average"
+    assert in_logs(logs, "Invalid metering settings")
+
+
+def test_meter_luminance_in_memory(tmpdir, logs):
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    with camera._prepare_camera_object() as picam:
+        luminance = camera._meter_luminance(picam)
+        buffer = camera._metering_buffer
+        assert camera._meter_luminance(picam) == luminance
+        assert camera._metering_buffer is buffer
+
+    assert buffer.shape == (constants.METERING_RESOLUTION[1], constants.METERING_RESOLUTION[0], 3)
+    assert not os.path.exists(camera.temp_photo_path)
+    Image.new("RGB", (10, 10), color="#FF0000").save(str(tmpdir / 'pic.png'))
+    assert luminance == camera._luminance_from_path(tmpdir / 'pic.png')
+    assert len(logs) == 0
+
+
+def test_low_light_search_takes_one_full_picture(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    captures = mock.Mock()
+    monkeypatch.setattr(webcam.camera.Camera, "_camera_capture", captures)
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_meter_luminance', 
+                        mock.Mock(side_effect=[
+                            constants.MINIMUM_DAYLIGHT_LUMINANCE + 10,
+                            constants.MINIMUM_DAYLIGHT_LUMINANCE - 10,
+                            constants.MINIMUM_DAYLIGHT_LUMINANCE,
+                        ]))
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_compute_target_luminance',
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE)
+
+    *_, attempts = camera._low_light_search(constants.MINIMUM_DAYLIGHT_LUMINANCE - 10)
+    assert attempts == 3
+    assert captures.call_count == 1
+
+
 def test_process_picture_cant_open_picture(tmpdir, logs):
     camera = Camera({'image': {}})
     camera.temp_photo_path = tmpdir / "temp_photo.jpg"
@@ -1111,3 +1540,192 @@ def test_cleanup_image_files_no_files(tmpdir, logs):
     assert not os.path.exists(camera.processed_image_path)
     assert len(logs) == 1
     assert in_logs(logs, "Cleaning up image files")
+
+
+def test_shoot_picture_low_light_no_time_for_settle(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {'let_awb_settle_in_dark': True}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE - 10)
+    monkeypatch.setattr(webcam.camera.Camera,
+                        '_low_light_search',
+                        lambda *a, **k: (constants.MINIMUM_DAYLIGHT_LUMINANCE, 10**6, 1, 1))
+    monkeypatch.setattr(webcam.camera, "time_left", lambda *a, **k: 5)
+
+    camera._shoot_picture()
+    assert len(logs) == 4
+    assert "Not enough time left in this run for the AWB adjusted picture" in logs[3]
+
+
+def test_low_light_search_stops_at_deadline(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+
+    monkeypatch.setattr(webcam.camera.Camera,
+                        "_camera_capture",
+                        lambda *a, **k: None)
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_meter_luminance', 
+                        lambda *a, **k: 1)
+    # Enough time for the first picture only
+    remaining_time = mock.Mock(side_effect=[100, 0])
+    monkeypatch.setattr(webcam.camera, "time_left", remaining_time)
+
+    luminance, _, _, attempts = camera._low_light_search(1)
+    assert luminance == 1
+    assert attempts == 2
+    assert in_logs(logs, "Not enough time left in this run for another picture")
+
+
+def test_shoot_picture_merges_the_bracketing(monkeypatch, fake_clock, tmpdir, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 1)
+    camera = Camera({'image': {'bracketing': [2, -2, 0]}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE + 10)
+    shutter_speeds = []
+    capture = PiCamera.capture
+    def record_shutter_speed(self, output, *a, **k):
+        shutter_speeds.append(self.shutter_speed)
+        capture(self, output, *a, **k)
+    monkeypatch.setattr(PiCamera, "capture", record_shutter_speed)
+
+    camera._shoot_picture()
+    # The first picture is the automatic one, the longest exposure is limited by the framerate
+    assert shutter_speeds == [None, 5000, 20000, 33333]
+    assert in_logs(logs, "Exposures merged")
+    assert os.path.exists(camera.temp_photo_path)
+    assert not [name for name in os.listdir(constants.DATA_PATH) if name.startswith(".bracket_")]
+
+
+def test_shoot_picture_invalid_bracketing(monkeypatch, fake_clock, tmpdir, logs):
+    monkeypatch.setattr(PiCamera, "convergence_time", 1)
+    camera = Camera({'image': {'bracketing': [0], 'use_low_light_algorithm': False}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    camera._shoot_picture()
+    assert in_logs(logs, "Invalid bracketing")
+    assert not in_logs(logs, "Exposures merged")
+    assert os.path.exists(camera.temp_photo_path)
+
+
+def test_secant_search_stacks_long_exposures(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {'width': 100, 'height': 70, 'stacking_frames': 4}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, '_meter_luminance', gamma_sensor(10**-5))
+    captures = []
+    capture = PiCamera.capture
+    def record_capture(self, output, *a, **k):
+        captures.append(k.get("use_video_port", False))
+        capture(self, output, *a, **k)
+    monkeypatch.setattr(PiCamera, "capture", record_capture)
+
+    camera._secant_search(0.1)
+    # Only video port captures: no still capture of the final picture
+    assert captures == [True] * 4
+    assert in_logs(logs, "Picture taken (4 pictures stacked)")
+    with Image.open(str(camera.temp_photo_path)) as stacked:
+        assert stacked.size == (100, 70)
+        red, green, blue = stacked.getpixel((50, 35))
+        assert red > 250 and green < 5 and blue < 5
+
+
+def test_stack_frames_stops_before_the_end_of_the_run(monkeypatch, fake_clock, tmpdir, logs):
+    camera = Camera({'image': {'stacking_frames': 4}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    with webcam.camera.load_picamera()() as picamera:
+        picamera.shutter_speed = 5 * 10**6
+        picamera.iso = 100
+        monkeypatch.setattr(webcam.camera, 'time_left', mock.Mock(side_effect=[100, 20, 5]))
+        assert camera._stack_frames(picamera, 4) == 2
+    assert in_logs(logs, "stacking 2 pictures instead of 4")
+    assert os.path.exists(camera.temp_photo_path)
+
+
+def test_low_light_capture_skips_stacking_short_exposures(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {'stacking_frames': 4}})
+    stack = mock.Mock()
+    capture = mock.Mock()
+    monkeypatch.setattr(webcam.camera.Camera, '_stack_frames', stack)
+    monkeypatch.setattr(webcam.camera.Camera, '_camera_capture', capture)
+    picamera = mock.Mock(shutter_speed=constants.STACKING_MIN_SHUTTER_SPEED // 2)
+    camera._low_light_capture(picamera)
+    assert not stack.called
+    assert capture.called
+
+    picamera.shutter_speed = constants.STACKING_MIN_SHUTTER_SPEED
+    camera.stacking_frames = 100
+    camera._low_light_capture(picamera)
+    assert stack.call_args[0][1] == constants.STACKING_MAX_FRAMES
+    assert in_logs(logs, f"Can't stack more than {constants.STACKING_MAX_FRAMES} pictures")
+
+
+def test_shoot_picture_by_day_skips_the_luminance_check(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {'latitude': 46, 'longitude': 11}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.solar, "solar_elevation", lambda *a: 45)
+    luminance = mock.Mock()
+    monkeypatch.setattr(webcam.camera.Camera, '_luminance_from_path', luminance)
+    camera._shoot_picture()
+    assert in_logs(logs, "45.0 degrees above the horizon: day")
+    assert in_logs(logs, "Picture taken")
+    assert not luminance.called
+
+
+def test_shoot_picture_at_night_goes_straight_to_the_low_light_algorithm(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {'latitude': 46, 'longitude': 11}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.solar, "solar_elevation", lambda *a: -30)
+    capture = mock.Mock()
+    monkeypatch.setattr(webcam.camera.Camera, '_camera_capture', capture)
+    search = mock.Mock(return_value=(constants.MINIMUM_NIGHT_LUMINANCE, 10**6, 800, 1))
+    monkeypatch.setattr(webcam.camera.Camera, '_low_light_search', search)
+    monkeypatch.setattr(webcam.camera.Camera, '_luminance_from_path', lambda *a, **k: 30)
+
+    camera._shoot_picture()
+    assert in_logs(logs, "30.0 degrees below the horizon: night")
+    assert not in_logs(logs, "Camera warm-up")
+    assert not capture.called
+    assert search.call_args[0][0] == 0
+
+
+@pytest.mark.parametrize("algorithm", ["proportional", "secant"])
+def test_shoot_picture_at_night_out_of_time_still_takes_the_picture(algorithm, monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {'latitude': 46, 'longitude': 11, 'low_light_algorithm': algorithm}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.solar, "solar_elevation", lambda *a: -30)
+    capture = mock.Mock()
+    monkeypatch.setattr(webcam.camera.Camera, '_camera_capture', capture)
+    monkeypatch.setattr(webcam.camera.Camera, '_luminance_from_path', lambda *a, **k: 30)
+    monkeypatch.setattr(webcam.camera, "time_left", lambda *a: 0)
+
+    camera._shoot_picture()
+    assert in_logs(logs, "Taking the final picture with the best exposure found so far")
+    assert not in_logs(logs, "Keeping the picture taken in automatic mode")
+    assert capture.call_count == 1
+    assert capture.call_args[0][0].shutter_speed > 0
+
+
+def test_shoot_picture_at_twilight_checks_the_luminance(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {'latitude': 46, 'longitude': 11}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.solar, "solar_elevation", lambda *a: -3)
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE + 10)
+    camera._shoot_picture()
+    assert in_logs(logs, "twilight")
+    assert in_logs(logs, "Daylight luminance detected")
+
+
+def test_shoot_picture_invalid_position(monkeypatch, tmpdir, logs):
+    camera = Camera({'image': {'latitude': 'north', 'longitude': 11}})
+    camera.temp_photo_path = tmpdir / "temp_photo.jpg"
+    monkeypatch.setattr(webcam.camera.Camera, 
+                        '_luminance_from_path', 
+                        lambda *a, **k: constants.MINIMUM_DAYLIGHT_LUMINANCE + 10)
+    camera._shoot_picture()
+    assert in_logs(logs, "Invalid position of the camera")
+    assert in_logs(logs, "Daylight luminance detected")
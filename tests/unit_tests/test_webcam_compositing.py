@@ -0,0 +1,75 @@
+from PIL import Image, ImageChops
+
+from zanzocam.webcam import compositing
+from zanzocam.webcam.overlays import Overlay
+
+from tests.conftest import in_logs
+
+
+def image_overlay(tmpdir, position, size=(10, 10), color="#FFFFFF99", over_the_picture=True):
+    path = tmpdir / f"{position}.png"
+    Image.new("RGBA", size, color=color).save(str(path))
+    return Overlay(position, {'type': 'image', 'path': path, 'padding': 0,
+                              'over_the_picture': over_the_picture}, 100, 100, None, None)
+
+
+def legacy_composite(photo, overlays, background_color):
+    """ How the picture was composed before: a full RGBA copy and an RGBA canvas """
+    border_top, border_bottom, layout = compositing.plan_layout(photo.width, photo.height, overlays)
+    photo = photo.convert("RGBA")
+    image = Image.new("RGBA", (photo.width, photo.height + border_top + border_bottom), color=background_color)
+    image.paste(photo, (0, border_top))
+    for overlay, x, y in layout:
+        image.paste(overlay.rendered_image, (x, y), mask=overlay.rendered_image)
+    return image.convert("RGB")
+
+
+def test_plan_layout(tmpdir, logs):
+    overlays = [
+        image_overlay(tmpdir, "top_left", size=(10, 7), over_the_picture=False),
+        image_overlay(tmpdir, "top_right", size=(10, 5), over_the_picture=False),
+        image_overlay(tmpdir, "bottom_center", size=(10, 3), over_the_picture=True),
+    ]
+    border_top, border_bottom, layout = compositing.plan_layout(100, 100, overlays)
+    assert (border_top, border_bottom) == (7, 0)
+    assert [(x, y) for _, x, y in layout] == [(0, 0), (90, 0), (45, 104)]
+    assert not in_logs(logs, "WARNING")
+
+
+def test_plan_layout_warns_about_overlays_too_large(tmpdir, logs):
+    overlays = [image_overlay(tmpdir, "top_center", size=(120, 10))]
+    compositing.plan_layout(100, 100, overlays)
+    assert in_logs(logs, "exceeds the margin of the image itself on the right")
+    assert in_logs(logs, "exceeds the margin of the image itself on the left")
+
+
+def test_composite_blends_in_place_without_borders(tmpdir):
+    photo = Image.new("RGB", (100, 100), color="#336699")
+    expected = legacy_composite(photo.copy(), [image_overlay(tmpdir, "bottom_right")], (0, 0, 0, 0))
+    result = compositing.composite(photo, [image_overlay(tmpdir, "bottom_right")], (0, 0, 0, 0))
+    assert result is photo
+    assert not ImageChops.difference(result, expected).getbbox()
+
+
+def test_composite_with_borders_matches_the_legacy_result(tmpdir):
+    photo = Image.new("RGB", (100, 100), color="#336699")
+    overlays = [
+        image_overlay(tmpdir, "top_left", size=(30, 8), color="#FF000080", over_the_picture=False),
+        image_overlay(tmpdir, "bottom_center", size=(120, 6), color="#00FF00CC"),
+    ]
+    expected = legacy_composite(photo, overlays, (10, 20, 30, 0))
+    result = compositing.composite(photo, overlays, (10, 20, 30, 0))
+    assert result.mode == "RGB"
+    assert result.size == (100, 108)
+    assert not ImageChops.difference(result, expected).getbbox()
+
+
+def test_composite_keeps_transparent_borders(tmpdir):
+    photo = Image.new("RGB", (100, 100), color="#336699")
+    overlays = [image_overlay(tmpdir, "top_left", size=(30, 8), color="#FF000080", over_the_picture=False)]
+    result = compositing.composite(photo, overlays, (0, 0, 0, 0), keep_alpha=True)
+    assert result.mode == "RGBA"
+    # Transparent border, overlay over the transparent border, opaque photo
+    assert result.getpixel((50, 4)) == (0, 0, 0, 0)
+    assert result.getpixel((10, 4)) == overlays[0].rendered_image.getpixel((10, 4))
+    assert result.getpixel((50, 50)) == (0x33, 0x66, 0x99, 255)
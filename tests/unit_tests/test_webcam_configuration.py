@@ -349,6 +349,27 @@ def test_backup_success(tmpdir, logs):
     assert len(logs) == 0
 
 
+def test_backup_is_current(tmpdir, logs):
+    config = Configuration.create_from_dictionary({"time": {"frequency": 5}})
+    assert not config.backup_is_current()
+    config.backup()
+    assert config.backup_is_current()
+    config.time = {"frequency": 10}
+    assert not config.backup_is_current()
+    assert len(logs) == 0
+
+
+def test_changed_sections(tmpdir):
+    """
+        Configuration can tell which sections differ from the server's
+    """
+    config = Configuration.create_from_dictionary({
+        "server": {"protocol": "FTP"}, "time": {"frequency": "5"}, "image": None})
+    assert config.changed_sections({"server": {"protocol": "FTP"}, "time": {"frequency": 5}}) == []
+    assert config.changed_sections({"server": {"protocol": "FTP"}, "time": {"frequency": "10"}}) == ["time"]
+    assert config.changed_sections({"time": {"frequency": 5}, "overlays": {}}) == ["overlays", "server"]
+
+
 def test_backup_fail(tmpdir, logs):
     """
         Configuration can handle a failure during the backup process
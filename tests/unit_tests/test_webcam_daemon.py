@@ -0,0 +1,261 @@
+import json
+from datetime import datetime
+
+import zanzocam.webcam as webcam
+import zanzocam.constants as constants
+from zanzocam.webcam import daemon
+
+from tests.conftest import in_logs
+
+
+def test_parse_cron_field():
+    assert daemon._parse_cron_field("*", (0, 59)) == set(range(60))
+    assert daemon._parse_cron_field("5", (0, 59)) == {5}
+    assert daemon._parse_cron_field("1,3,5", (0, 59)) == {1, 3, 5}
+    assert daemon._parse_cron_field("10-20", (0, 59)) == set(range(10, 21))
+    assert daemon._parse_cron_field("*/15", (0, 59)) == {0, 15, 30, 45}
+    assert daemon._parse_cron_field("1-9/2", (0, 59)) == {1, 3, 5, 7, 9}
+
+
+def test_parse_cron_field_within_bounds():
+    # Days and months start from 1
+    assert daemon._parse_cron_field("*/5", (1, 31)) == {1, 6, 11, 16, 21, 26, 31}
+    assert daemon._parse_cron_field("*/2", (1, 12)) == {1, 3, 5, 7, 9, 11}
+    # Steps from a number stop at the end of the field
+    assert daemon._parse_cron_field("20/2", (0, 23)) == {20, 22}
+
+
+def test_parse_cron_field_names():
+    assert daemon._parse_cron_field("mon-fri", (0, 7), daemon._CRON_WEEKDAYS) == {1, 2, 3, 4, 5}
+    assert daemon._parse_cron_field("SUN,sat", (0, 7), daemon._CRON_WEEKDAYS) == {0, 6}
+    assert daemon._parse_cron_field("jan-mar,dec", (1, 12), daemon._CRON_MONTHS) == {1, 2, 3, 12}
+
+
+def test_parse_cron_field_malformed():
+    for field, bounds in [("mon", (0, 59)), ("60", (0, 59)), ("0", (1, 31)),
+                          ("*/0", (0, 59)), ("1-2-3", (0, 59)), ("", (0, 59))]:
+        try:
+            daemon._parse_cron_field(field, bounds)
+            assert False, f"'{field}' was accepted"
+        except ValueError:
+            pass
+
+
+def test_next_trigger_stepped_days_and_months(logs):
+    # Every other month from January, on days 1, 11, 21 and 31
+    cron_strings = ["0 10 */10 */2 *"]
+    now = datetime(2021, 1, 31, 12, 0)
+    assert daemon.next_trigger(cron_strings, now) == datetime(2021, 3, 1, 10, 0)
+
+
+def test_next_trigger_sunday_as_7(logs):
+    # 2021-01-01 is a Friday: next Sunday is the 3rd
+    cron_strings = ["0 10 * * 7"]
+    now = datetime(2021, 1, 1, 12, 0)
+    assert daemon.next_trigger(cron_strings, now) == datetime(2021, 1, 3, 10, 0)
+
+
+def test_next_trigger_same_day(logs):
+    cron_strings = ["0 10 * * *", "30 10 * * *", "0 11 * * *"]
+    now = datetime(2021, 1, 1, 10, 15, 30)
+    assert daemon.next_trigger(cron_strings, now) == datetime(2021, 1, 1, 10, 30)
+    assert len(logs) == 0
+
+
+def test_next_trigger_skips_current_minute(logs):
+    cron_strings = ["30 10 * * *", "0 11 * * *"]
+    now = datetime(2021, 1, 1, 10, 30, 0)
+    assert daemon.next_trigger(cron_strings, now) == datetime(2021, 1, 1, 11, 0)
+
+
+def test_next_trigger_next_day(logs):
+    cron_strings = ["0 10 * * *"]
+    now = datetime(2021, 1, 1, 22, 0)
+    assert daemon.next_trigger(cron_strings, now) == datetime(2021, 1, 2, 10, 0)
+
+
+def test_next_trigger_manual_crontab(logs):
+    # 2021-01-01 is a Friday: next Monday is the 4th
+    cron_strings = ["*/20 8-9 * * 1"]
+    now = datetime(2021, 1, 1, 12, 0)
+    assert daemon.next_trigger(cron_strings, now) == datetime(2021, 1, 4, 8, 0)
+
+
+def test_next_trigger_malformed_lines(logs):
+    assert daemon.next_trigger(["not a crontab"], datetime(2021, 1, 1)) is None
+    assert in_logs(logs, "Malformed crontab line ignored")
+
+
+def test_next_trigger_weekday_names(logs):
+    # 2021-01-02 is a Saturday: next weekday is Monday the 4th
+    now = datetime(2021, 1, 2, 12, 0)
+    assert daemon.next_trigger(["0 10 * * mon-fri"], now) == datetime(2021, 1, 4, 10, 0)
+    assert daemon.next_trigger(["0 10 * feb *"], now) == datetime(2021, 2, 1, 10, 0)
+
+
+def test_next_trigger_macros(logs):
+    now = datetime(2021, 1, 2, 12, 30)
+    assert daemon.next_trigger(["@hourly"], now) == datetime(2021, 1, 2, 13, 0)
+    assert daemon.next_trigger(["@daily"], now) == datetime(2021, 1, 3, 0, 0)
+    # 2021-01-03 is a Sunday
+    assert daemon.next_trigger(["@weekly"], now) == datetime(2021, 1, 3, 0, 0)
+    assert daemon.next_trigger(["@monthly"], now) == datetime(2021, 2, 1, 0, 0)
+    assert daemon.next_trigger(["@YEARLY"], now) == datetime(2022, 1, 1, 0, 0)
+    assert len(logs) == 0
+
+
+def test_next_trigger_reboot_and_unknown_macros(logs):
+    now = datetime(2021, 1, 2, 12, 30)
+    assert daemon.next_trigger(["@reboot"], now) is None
+    assert in_logs(logs, "The daemon can't wait for '@reboot'")
+    assert daemon.next_trigger(["@often", "0 13 * * *"], now) == datetime(2021, 1, 2, 13, 0)
+    assert in_logs(logs, "Malformed crontab line ignored: '@often'")
+
+
+def test_next_trigger_invalid_values(logs):
+    now = datetime(2021, 1, 2, 12, 30)
+    assert daemon.next_trigger(["0 10 * * someday", "0 13 * * *"], now) == datetime(2021, 1, 2, 13, 0)
+    assert in_logs(logs, "Malformed crontab line ignored: '0 10 * * someday'")
+
+
+def test_next_trigger_day_of_month_or_weekday(logs):
+    # Both restricted: either the 15th or a Monday, like cron does.
+    # 2021-01-02 is a Saturday: the 4th is a Monday
+    now = datetime(2021, 1, 2, 12, 0)
+    assert daemon.next_trigger(["0 10 15 * mon"], now) == datetime(2021, 1, 4, 10, 0)
+    now = datetime(2021, 1, 12, 12, 0)
+    assert daemon.next_trigger(["0 10 15 * mon"], now) == datetime(2021, 1, 15, 10, 0)
+    # Only one restricted: that one alone decides
+    assert daemon.next_trigger(["0 10 */1 * mon"], now) == datetime(2021, 1, 18, 10, 0)
+    assert daemon.next_trigger(["0 10 15 * *"], now) == datetime(2021, 1, 15, 10, 0)
+
+
+def test_next_trigger_from_prepare_crontab_string(logs):
+    cron_strings = webcam.system.prepare_crontab_string({
+        "start_activity": "08:00",
+        "stop_activity": "18:00",
+        "frequency": "45"
+    })
+    now = datetime(2021, 1, 1, 8, 50)
+    assert daemon.next_trigger(cron_strings, now) == datetime(2021, 1, 1, 9, 30)
+
+
+def test_acquire_daemon_lock_only_once(logs):
+    lock = daemon.acquire_daemon_lock()
+    assert lock
+    assert daemon.acquire_daemon_lock() is None
+    lock.close()
+    second_lock = daemon.acquire_daemon_lock()
+    assert second_lock
+    second_lock.close()
+
+
+def test_run_daemon_already_running(logs):
+    lock = daemon.acquire_daemon_lock()
+    daemon.run_daemon(lambda: 1/0)
+    lock.close()
+    assert in_logs(logs, "Another ZanzoCam daemon is already running")
+
+
+def test_run_daemon_already_running_skips_on_start(logs):
+    lock = daemon.acquire_daemon_lock()
+    started = []
+    daemon.run_daemon(lambda: 1/0, on_start=lambda: started.append(1))
+    lock.close()
+    assert not started
+
+
+def test_run_daemon_on_start_after_lock(logs):
+    started = []
+    def on_start():
+        # The lock is already held by the daemon when on_start runs
+        started.append(daemon.acquire_daemon_lock())
+    daemon.run_daemon(lambda: 1/0, on_start=on_start)
+    assert started == [None]
+
+
+def test_daemon_running_elsewhere(logs):
+    assert not daemon.daemon_running_elsewhere()
+    lock = daemon.acquire_daemon_lock()
+    assert daemon.daemon_running_elsewhere()
+    lock.close()
+    assert not daemon.daemon_running_elsewhere()
+
+
+def test_daemon_running_elsewhere_not_in_the_daemon(monkeypatch, logs):
+    with open(constants.CONFIGURATION_FILE, 'w') as c:
+        c.write('{"time": {"frequency": "10", "daemon": "true"}}')
+    monkeypatch.setattr(daemon, "sleep_until", lambda *a, **k: None)
+
+    seen = []
+    def run():
+        seen.append(daemon.daemon_running_elsewhere())
+        with open(constants.CONFIGURATION_FILE, 'w') as c:
+            c.write('{"time": {"frequency": "10", "daemon": "false"}}')
+
+    daemon.run_daemon(run)
+    assert seen == [False]
+
+
+def test_run_daemon_next_trigger_fails(monkeypatch, logs):
+    with open(constants.CONFIGURATION_FILE, 'w') as c:
+        c.write('{"time": {"frequency": "10", "daemon": "true"}}')
+    monkeypatch.setattr(daemon, "next_trigger", lambda *a, **k: 1/0)
+    daemon.run_daemon(lambda: 1/0)
+    assert in_logs(logs, "Could not find out when the next picture is due")
+    assert in_logs(logs, "no trigger time found in the configuration")
+
+
+def test_run_daemon_no_configuration(logs):
+    daemon.run_daemon(lambda: 1/0)
+    assert in_logs(logs, "the daemon cannot run without a configuration")
+
+
+def test_run_daemon_disabled(logs):
+    with open(constants.CONFIGURATION_FILE, 'w') as c:
+        c.write('{"time": {"frequency": "10"}}')
+    daemon.run_daemon(lambda: 1/0)
+    assert in_logs(logs, "The daemon mode is disabled in the configuration")
+
+
+def test_run_daemon_runs_until_disabled(monkeypatch, logs):
+    with open(constants.CONFIGURATION_FILE, 'w') as c:
+        c.write('{"time": {"frequency": "10", "daemon": "true"}}')
+    monkeypatch.setattr(daemon, "sleep_until", lambda *a, **k: None)
+
+    runs = []
+    def run():
+        runs.append(1)
+        if len(runs) == 1:
+            raise ValueError("test failure")
+        with open(constants.CONFIGURATION_FILE, 'w') as c:
+            c.write('{"time": {"frequency": "10", "daemon": "false"}}')
+
+    daemon.run_daemon(run)
+    assert len(runs) == 2
+    assert in_logs(logs, "Next picture at")
+    assert in_logs(logs, "The daemon will keep running")
+    assert in_logs(logs, "The daemon mode is disabled in the configuration")
+    # The lock is released on exit
+    lock = daemon.acquire_daemon_lock()
+    assert lock
+    lock.close()
+
+
+def test_run_duration_limit(logs):
+    time_settings = {"frequency": "10", "start_activity": "08:00", "stop_activity": "18:00"}
+    now = datetime(2021, 1, 1, 10, 0, 30)
+    # Next run at 10:10
+    assert daemon.run_duration_limit(time_settings, now) == 570 - constants.RUN_DEADLINE_MARGIN
+
+
+def test_run_duration_limit_no_run_soon(logs):
+    time_settings = {"frequency": "60", "start_activity": "08:00", "stop_activity": "09:00"}
+    now = datetime(2021, 1, 1, 10, 0)
+    assert daemon.run_duration_limit(time_settings, now) == constants.RUN_MAX_DURATION
+
+
+def test_run_duration_limit_next_run_imminent(logs):
+    time_settings = {"frequency": "1"}
+    now = datetime(2021, 1, 1, 10, 0, 55)
+    assert daemon.run_duration_limit(time_settings, now) == 0
@@ -0,0 +1,106 @@
+import json
+import pytest
+import datetime
+
+import zanzocam.constants as constants
+from zanzocam.webcam import exposure
+
+from tests.conftest import in_logs
+
+
+def test_history_key_by_month_and_time_slot():
+    assert exposure.history_key(datetime.datetime(2021, 1, 1, 0, 0)) == "01-000"
+    assert exposure.history_key(datetime.datetime(2021, 1, 1, 20, 14)) == \
+        exposure.history_key(datetime.datetime(2021, 1, 31, 20, 1))
+    assert exposure.history_key(datetime.datetime(2021, 1, 1, 20, 14)) != \
+        exposure.history_key(datetime.datetime(2021, 1, 1, 20, 15))
+    assert exposure.history_key(datetime.datetime(2021, 1, 1, 20, 14)) != \
+        exposure.history_key(datetime.datetime(2021, 2, 1, 20, 14))
+
+
+def test_predict_exposure_no_history(logs):
+    assert exposure.predict_exposure() is None
+    assert len(logs) == 0
+
+
+def test_record_and_predict_exposure(logs):
+    now = datetime.datetime(2021, 1, 1, 20, 0)
+    assert exposure.record_exposure(10**6, 800, 32.123, 4, now=now)
+    assert exposure.predict_exposure(now + datetime.timedelta(minutes=10)) == (10**6, 800)
+    assert exposure.predict_exposure(now + datetime.timedelta(days=1)) == (10**6, 800)
+    assert exposure.predict_exposure(now + datetime.timedelta(hours=1)) is None
+
+    with open(constants.EXPOSURE_HISTORY_FILE, "r") as history_file:
+        history = json.load(history_file)
+    assert history == {exposure.history_key(now): {
+        "shutter_speed": 10**6,
+        "iso": 800,
+        "luminance": 32.12,
+        "attempts": 4,
+        "date": "2021-01-01_20:00:00"
+    }}
+    assert len(logs) == 0
+
+
+def test_record_exposure_replaces_entry(logs):
+    now = datetime.datetime(2021, 1, 1, 20, 0)
+    exposure.record_exposure(10**6, 800, 30, 4, now=now)
+    exposure.record_exposure(2 * 10**6, 400, 30, 1, now=now + datetime.timedelta(days=1))
+    assert exposure.predict_exposure(now + datetime.timedelta(days=2)) == (2 * 10**6, 400)
+
+
+def test_stale_entries_expire(logs):
+    old = datetime.datetime(2021, 1, 1, 20, 0)
+    now = old + datetime.timedelta(seconds=constants.EXPOSURE_HISTORY_MAX_AGE + 60)
+    exposure.record_exposure(10**6, 800, 30, 4, now=old)
+    assert exposure.predict_exposure(now) is None
+
+    exposure.record_exposure(10**6, 800, 30, 4, now=now + datetime.timedelta(hours=1))
+    with open(constants.EXPOSURE_HISTORY_FILE, "r") as history_file:
+        assert list(json.load(history_file).keys()) == [
+            exposure.history_key(now + datetime.timedelta(hours=1))]
+
+
+def test_corrupted_history_is_ignored(logs):
+    with open(constants.EXPOSURE_HISTORY_FILE, "w") as history_file:
+        history_file.write("not json")
+    assert exposure.predict_exposure() is None
+    assert in_logs(logs, "Could not read the exposure history")
+    assert exposure.record_exposure(10**6, 800, 30, 4)
+    assert exposure.predict_exposure() == (10**6, 800)
+
+
+def test_predict_awb_gains_no_history(logs):
+    assert exposure.predict_awb_gains() is None
+    assert len(logs) == 0
+
+
+def test_record_and_predict_awb_gains(logs):
+    now = datetime.datetime(2021, 1, 1, 18, 0)
+    assert exposure.record_awb_gains((1.8, 1.4), now=now)
+    # A single entry is used at any time of the day
+    assert exposure.predict_awb_gains(now) == (1.8, 1.4)
+    assert exposure.predict_awb_gains(now + datetime.timedelta(hours=6)) == (1.8, 1.4)
+    assert len(logs) == 0
+
+
+def test_predict_awb_gains_interpolates_over_the_night(logs):
+    evening = datetime.datetime(2021, 1, 1, 17, 52, 30)  # Center of the 17:45 slot
+    morning = datetime.datetime(2021, 1, 2, 7, 52, 30)   # Center of the 07:45 slot
+    exposure.record_awb_gains((2.0, 1.0), now=evening)
+    exposure.record_awb_gains((1.0, 2.0), now=morning)
+
+    midnight = datetime.datetime(2021, 1, 2, 0, 52, 30)
+    assert exposure.predict_awb_gains(midnight) == pytest.approx((1.5, 1.5))
+    assert exposure.predict_awb_gains(evening + datetime.timedelta(hours=1, minutes=45)) == \
+        pytest.approx((1.875, 1.125))
+    assert exposure.predict_awb_gains(morning) == pytest.approx((1.0, 2.0))
+    # During the day, between morning and evening
+    assert exposure.predict_awb_gains(morning + datetime.timedelta(hours=5)) == pytest.approx((1.5, 1.5))
+
+
+def test_stale_awb_gains_expire(logs):
+    old = datetime.datetime(2021, 1, 1, 18, 0)
+    exposure.record_awb_gains((1.8, 1.4), now=old)
+    now = old + datetime.timedelta(seconds=constants.EXPOSURE_HISTORY_MAX_AGE + 60)
+    assert exposure.predict_awb_gains(now) is None
@@ -1,4 +1,6 @@
+import os
 from unittest import mock
+from datetime import datetime, timedelta
 from freezegun import freeze_time
 
 import zanzocam.webcam as webcam
@@ -20,6 +22,16 @@ def test_main_no_initial_config_no_backup(mock_modules_apart_config, logs):
     assert in_logs(logs, "Exiting") 
     assert in_logs(logs, "Execution completed with errors")
 
+def test_main_does_not_wipe_the_daemon_logs(mock_modules_apart_config, logs):
+    os.makedirs(webcam.main.CAMERA_LOGS, exist_ok=True)
+    with open(webcam.main.CAMERA_LOG, 'w') as l:
+        l.write("Logs of the running daemon\n")
+    lock = webcam.daemon.acquire_daemon_lock()
+    main()
+    lock.close()
+    with open(webcam.main.CAMERA_LOG, 'r') as l:
+        assert l.read().startswith("Logs of the running daemon")
+
 def test_main_no_initial_config_bad_backup(mock_modules_apart_config, logs):
     with open(str(constants.CONFIGURATION_FILE) + ".bak", 'w') as c:
         c.write('Not JSON!')
@@ -84,6 +96,20 @@ def test_main_in_active_hours(mock_modules, monkeypatch, logs):
     assert in_logs(logs, "Execution completed successfully")
 
 
+def test_main_saves_metrics(mock_modules, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"something": "present"}')
+
+    main()
+    assert in_logs(logs, "Phases: status")
+    runs = webcam.metrics.load_runs()
+    assert len(runs) == 1
+    assert runs[0]["ok"]
+    phases = [span[0] for span in runs[0]["spans"]]
+    for phase in ["status", "configuration", "overlays download", "camera", "upload"]:
+        assert phase in phases
+
+
 def test_main_error_creating_server_servererror(mock_modules_apart_config, monkeypatch, logs):
     with open(str(constants.CONFIGURATION_FILE) + ".bak", 'w') as c:
             c.write('{"old-test-stuff": "present"}')
@@ -194,6 +220,31 @@ def test_main_error_uploading_picture(mock_modules_apart_config, monkeypatch, lo
     assert in_logs(logs, "Execution completed with errors")
 
 
+def test_main_error_uploading_picture_spools_it(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"old-test-config": "present"}}')
+
+    monkeypatch.setattr(
+        webcam.main.Server, 
+        'upload_picture',
+        lambda *a, **k: 1/0
+    )
+    main()
+    assert in_logs(logs, "spooling picture - mocked")
+    assert not in_logs(logs, "draining spool - mocked")
+    assert in_logs(logs, "Execution completed with errors")
+
+
+def test_main_drains_spool_after_upload(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"old-test-config": "present"}}')
+
+    main()
+    assert not in_logs(logs, "spooling picture - mocked")
+    assert in_logs(logs, "draining spool - mocked")
+    assert in_logs(logs, "Execution completed successfully")
+
+
 def test_main_fail_cleanup_image_files(mock_modules_apart_config, monkeypatch, logs):
     with open(str(constants.CONFIGURATION_FILE), 'w') as c:
         c.write('{"server": {"old-test-config": "present"}}')
@@ -215,3 +266,185 @@ def test_main_fail_cleanup_image_files(mock_modules_apart_config, monkeypatch, l
     assert not in_logs(logs, "old_test_config")
     assert in_logs(logs, "new_test_config")
     assert in_logs(logs, "Execution completed with errors")
+
+
+def test_main_picture_uses_new_overlays(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"old-test-config": "present"}}')
+
+    monkeypatch.setattr(
+        webcam.main.Server,
+        'update_configuration',
+        lambda *a, **k: Configuration.create_from_dictionary({
+            "server": {"new-test-config": "present"},
+            "overlays": {"top_left": {"type": "text", "text": "new"}}
+        })
+    )
+    processed_with = {}
+    def take_picture(self, before_processing=None):
+        before_processing()
+        processed_with["overlays"] = self.overlays
+    monkeypatch.setattr(webcam.main.Camera, "take_picture", take_picture)
+
+    main()
+    assert processed_with["overlays"] == {"top_left": {"type": "text", "text": "new"}}
+    assert in_logs(logs, "new_test_config")
+    assert in_logs(logs, "Execution completed successfully")
+
+
+def test_main_error_in_background_configuration_update(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE) + ".bak", 'w') as c:
+        c.write('{"old-test-stuff": "present"}')
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"new-test-stuff": "present"}}')
+
+    def raise_servererror(*a, **k):
+        raise ServerError('test error')
+    monkeypatch.setattr(webcam.main.Server, 'download_overlay_images', raise_servererror)
+
+    main()
+    assert in_logs(logs, "taking picture - mocked")
+    assert in_logs(logs, "An error occurred communicating with the server")
+    assert in_logs(logs, "Restoring the old configuration file")
+    assert not in_logs(logs, "uploading picture - mocked")
+    assert in_logs(logs, "Execution completed with errors")
+
+
+def test_main_sets_run_deadline(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"test-config": "present"}, "time": {"frequency": "10"}}')
+
+    monkeypatch.setattr(webcam.main, "run_duration_limit", lambda *a, **k: 120)
+    time_left_during_run = []
+    def take_picture(self, before_processing=None):
+        time_left_during_run.append(webcam.utils.time_left())
+    monkeypatch.setattr(webcam.main.Camera, "take_picture", take_picture)
+
+    main()
+    assert 110 < time_left_during_run[0] <= 120
+    assert webcam.utils.time_left() is None
+
+
+def test_main_uploads_every_picture_of_a_burst(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"test-config": "present"}}')
+
+    monkeypatch.setattr(webcam.main.Camera, "is_burst", lambda *a, **k: True, raising=False)
+    def take_burst(self, on_frame, before_processing=None):
+        before_processing()
+        for shot in range(3):
+            on_frame(f"burst_{shot}.jpg", "timestamp")
+        return 3
+    monkeypatch.setattr(webcam.main.Camera, "take_burst", take_burst, raising=False)
+    uploaded = []
+    monkeypatch.setattr(webcam.main.Server, "upload_picture",
+                        lambda self, path, *a, **k: uploaded.append((path, k["timestamp"])))
+
+    main()
+    assert uploaded == [("burst_0.jpg", "timestamp"), 
+                        ("burst_1.jpg", "timestamp"), 
+                        ("burst_2.jpg", "timestamp")]
+    assert in_logs(logs, "draining spool - mocked")
+    assert in_logs(logs, "Execution completed successfully")
+
+
+def test_main_spools_the_burst_pictures_that_fail_to_upload(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"test-config": "present"}}')
+
+    monkeypatch.setattr(webcam.main.Camera, "is_burst", lambda *a, **k: True, raising=False)
+    def take_burst(self, on_frame, before_processing=None):
+        for shot in range(2):
+            on_frame(f"burst_{shot}.jpg", "timestamp")
+        return 2
+    monkeypatch.setattr(webcam.main.Camera, "take_burst", take_burst, raising=False)
+    monkeypatch.setattr(webcam.main.Server, 'upload_picture', lambda *a, **k: 1/0)
+
+    main()
+    assert in_logs(logs, "A picture of the burst could not be uploaded")
+    assert in_logs(logs, "spooling picture - mocked")
+    assert in_logs(logs, "Execution completed with errors")
+
+
+def test_main_burst_with_no_server(mock_modules_apart_config, monkeypatch, logs):
+    """
+        If the server can't be reached, the burst is shot only once
+    """
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"test-config": "present"}}')
+
+    monkeypatch.setattr(webcam.main.Camera, "is_burst", lambda *a, **k: True, raising=False)
+    bursts = []
+    def take_burst(self, on_frame, before_processing=None):
+        bursts.append(True)
+        for shot in range(3):
+            on_frame(f"burst_{shot}.jpg", "timestamp")
+        return 3
+    monkeypatch.setattr(webcam.main.Camera, "take_burst", take_burst, raising=False)
+    def init_fails(*a, **k):
+        raise ServerError('test error')
+    monkeypatch.setattr(webcam.main.Server, '__init__', init_fails)
+
+    main()
+    assert len(bursts) == 1
+    assert in_logs(logs, "A picture of the burst can't be uploaded: the server is not available")
+    assert not in_logs(logs, "Picture stored in the spool")
+    assert not in_logs(logs, "The camera could not take the picture")
+    assert in_logs(logs, "Execution completed with errors")
+
+
+def test_main_burst_with_no_server_spools_the_pictures(mock_modules_apart_config, monkeypatch, tmpdir, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"test-config": "present"}}')
+
+    monkeypatch.setattr(webcam.main.Camera, "is_burst", lambda *a, **k: True, raising=False)
+    monkeypatch.setattr(webcam.main.Camera, "name", "zanzocam", raising=False)
+    monkeypatch.setattr(webcam.main.Camera, "extension", "jpg", raising=False)
+    def take_burst(self, on_frame, before_processing=None):
+        for shot in range(3):
+            frame_path = tmpdir / f"burst_{shot}.jpg"
+            frame_path.write("picture")
+            on_frame(frame_path, datetime.now() - timedelta(seconds=shot))
+        return 3
+    monkeypatch.setattr(webcam.main.Camera, "take_burst", take_burst, raising=False)
+    def init_fails(*a, **k):
+        raise ServerError('test error')
+    monkeypatch.setattr(webcam.main.Server, '__init__', init_fails)
+
+    main()
+    assert len(webcam.spool.list_spooled_pictures()) == 3
+    assert not (tmpdir / "burst_0.jpg").exists()
+
+
+def test_main_system_settings_fail(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"test-config": "present"}}')
+
+    monkeypatch.setattr(
+        webcam.main.Server, 
+        'update_configuration',
+        lambda *a, **k: Configuration.create_from_dictionary(
+            {"server": {"test-config": "present"}, "time": {"frequency": "10"}}))
+    monkeypatch.setattr(webcam.main.system, 'apply_system_settings', lambda *a, **k: False)
+
+    main()
+    assert in_logs(logs, "uploading picture - mocked")
+    assert in_logs(logs, "Execution completed with errors")
+
+
+def test_main_system_settings_reapplied_if_crontab_outdated(mock_modules_apart_config, monkeypatch, logs):
+    with open(str(constants.CONFIGURATION_FILE), 'w') as c:
+        c.write('{"server": {"test-config": "present"}, "time": {"frequency": "10"}}')
+    monkeypatch.setattr(
+        webcam.main.Server, 
+        'update_configuration',
+        lambda *a, **k: Configuration.create_from_dictionary(
+            {"server": {"test-config": "present"}, "time": {"frequency": "10"}}))
+
+    main()
+    assert not in_logs(logs, "applying system settings - mocked")
+
+    # For example, the last update of the crontab failed
+    monkeypatch.setattr(webcam.main.system, 'crontab_up_to_date', lambda *a, **k: False)
+    main()
+    assert in_logs(logs, "applying system settings - mocked")
@@ -0,0 +1,61 @@
+import numpy
+import pytest
+from PIL import Image
+
+from zanzocam.webcam import merging
+
+
+def gradient(gain, width=64, height=40):
+    """ A horizontal grey gradient, exposed with the given gain """
+    row = numpy.linspace(0, 255, width, dtype=numpy.float32) * gain
+    frame = numpy.clip(numpy.tile(row, (height, 1)), 0, 255).astype(numpy.uint8)
+    return numpy.repeat(frame[:, :, numpy.newaxis], 3, axis=2)
+
+
+def save_bracketing(tmpdir, gains=(0.25, 1, 4)):
+    paths = []
+    for index, gain in enumerate(gains):
+        paths.append(tmpdir / f"bracket_{index}.png")
+        Image.fromarray(gradient(gain)).save(str(paths[-1]))
+    return paths
+
+
+def test_fuse_tile_identical_exposures():
+    frame = gradient(1)
+    assert numpy.array_equal(merging.fuse_tile([frame, frame, frame]), frame)
+
+
+def test_fuse_tile_prefers_well_exposed_pixels():
+    dark, bright = gradient(0.25), gradient(4)
+    fused = merging.fuse_tile([dark, bright]).astype(int)
+    # The shadows come from the bright picture, the highlights from the dark one
+    assert fused[20, 4, 0] > dark[20, 4, 0] + 5
+    assert fused[20, -4, 0] < bright[20, -4, 0] - 5
+
+
+def test_fuse_exposures_tiles_do_not_change_the_result(tmpdir):
+    paths = save_bracketing(tmpdir)
+    merging.fuse_exposures(paths, tmpdir / "whole.png", tile_rows=1000)
+    merging.fuse_exposures(paths, tmpdir / "tiled.png", tile_rows=7)
+    whole = numpy.asarray(Image.open(str(tmpdir / "whole.png"))).astype(int)
+    tiled = numpy.asarray(Image.open(str(tmpdir / "tiled.png"))).astype(int)
+    assert numpy.abs(whole - tiled).max() <= 1
+
+
+def test_fuse_exposures_keeps_the_exif(tmpdir):
+    paths = save_bracketing(tmpdir)
+    exif = Image.Exif()
+    exif[0x010f] = "reference picture"  # Make
+    Image.fromarray(gradient(1)).save(str(tmpdir / "reference.jpg"), exif=exif.tobytes())
+    merging.fuse_exposures(paths, tmpdir / "merged.jpg", exif_path=tmpdir / "reference.jpg")
+    with Image.open(str(tmpdir / "merged.jpg")) as merged:
+        assert merged.getexif()[0x010f] == "reference picture"
+
+
+def test_fuse_exposures_invalid_pictures(tmpdir):
+    paths = save_bracketing(tmpdir)
+    with pytest.raises(ValueError):
+        merging.fuse_exposures(paths[:1], tmpdir / "merged.png")
+    Image.fromarray(gradient(1, width=32)).save(str(paths[0]))
+    with pytest.raises(ValueError):
+        merging.fuse_exposures(paths, tmpdir / "merged.png")
@@ -0,0 +1,67 @@
+import numpy
+import pytest
+from PIL import Image
+
+import zanzocam.constants as constants
+from zanzocam.webcam import metering
+from zanzocam.webcam.camera import Camera
+
+
+def lamp_frame():
+    """ A dark scene (luminance 20) with a saturated lamp in the top left corner """
+    frame = numpy.full((96, 128, 3), 20, dtype=numpy.uint8)
+    frame[:24, :32] = 255
+    return frame
+
+
+def test_frame_statistics_uniform_frame(tmpdir):
+    frame = numpy.zeros((96, 128, 3), dtype=numpy.uint8)
+    frame[:, :] = (200, 100, 50)
+    Image.fromarray(frame).save(str(tmpdir / "pic.png"))
+    statistics = metering.frame_statistics(frame)
+
+    assert statistics["luminance"] == pytest.approx(Camera._luminance_from_path(tmpdir / "pic.png"))
+    assert statistics["histogram"].sum() == 96 * 128
+    assert statistics["histogram"][int(statistics["luminance"])] == 96 * 128
+    assert set(statistics["percentiles"].values()) == {int(statistics["luminance"])}
+    assert statistics["clipped"] == 0
+
+
+def test_frame_statistics_percentiles_and_clipped():
+    statistics = metering.frame_statistics(lamp_frame())
+    assert statistics["clipped"] == pytest.approx(1 / 16)
+    assert statistics["percentiles"][5] == 20
+    assert statistics["percentiles"][50] == 20
+    assert statistics["percentiles"][95] == 255
+
+
+def test_frame_statistics_modes():
+    frame = lamp_frame()
+    average = metering.frame_statistics(frame, "average")["luminance"]
+    centre = metering.frame_statistics(frame, "centre")["luminance"]
+    median = metering.frame_statistics(frame, "median")["luminance"]
+    region = metering.frame_statistics(frame, "region", [0.5, 0.5, 1, 1])["luminance"]
+    lamp = metering.frame_statistics(frame, "region", [0, 0, 0.25, 0.25])["luminance"]
+
+    assert median == pytest.approx(20, abs=1)
+    assert region == pytest.approx(20, abs=1)
+    assert lamp == pytest.approx(255, abs=1)
+    assert median < centre < average
+
+
+@pytest.mark.parametrize("mode, region", [
+    ("spot", None),
+    ("region", None),
+    ("region", [0.5, 0.5, 0.2, 1]),
+    ("region", [0, 0, 2, 1]),
+])
+def test_frame_statistics_invalid_settings(mode, region):
+    with pytest.raises(ValueError):
+        metering.frame_statistics(lamp_frame(), mode, region)
+
+
+def test_load_frame_scales_down(tmpdir):
+    Image.new("RGB", (1024, 768), color="#808080").save(str(tmpdir / "pic.jpg"))
+    frame = metering.load_frame(tmpdir / "pic.jpg")
+    assert frame.shape == (constants.METERING_RESOLUTION[1], constants.METERING_RESOLUTION[0], 3)
+    assert metering.frame_statistics(frame)["luminance"] == pytest.approx(128, abs=2)
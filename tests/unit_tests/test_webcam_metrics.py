@@ -0,0 +1,141 @@
+import json
+import threading
+from unittest import mock
+
+import zanzocam.constants as constants
+from zanzocam.webcam import metrics
+
+from tests.conftest import in_logs
+
+
+def test_span_records_phase(logs):
+    metrics.start_run()
+    with metrics.span("phase"):
+        sum(range(10000))
+    spans = metrics.get_spans()
+    assert len(spans) == 1
+    assert spans[0]["name"] == "phase"
+    assert spans[0]["wall_ms"] >= 0
+    assert spans[0]["cpu_ms"] >= 0
+    assert spans[0]["peak_rss_growth_kb"] >= 0
+    assert spans[0]["thread"] == 0
+
+
+def test_span_records_the_growth_of_the_peak_rss(monkeypatch, logs):
+    usage = mock.Mock(side_effect=[mock.Mock(ru_maxrss=value) for value in [1000, 1500, 1500, 1500]])
+    monkeypatch.setattr(metrics.resource, "getrusage", usage)
+    metrics.start_run()
+    with metrics.span("hungry"):
+        pass
+    with metrics.span("frugal"):
+        pass
+    spans = {span["name"]: span for span in metrics.get_spans()}
+    assert spans["hungry"]["peak_rss_growth_kb"] == 500
+    assert spans["frugal"]["peak_rss_growth_kb"] == 0
+
+
+def test_span_nested_and_on_exception(logs):
+    metrics.start_run()
+    try:
+        with metrics.span("outer"):
+            with metrics.span("inner"):
+                raise ValueError("test")
+    except ValueError:
+        pass
+    spans = {span["name"]: span for span in metrics.get_spans()}
+    assert set(spans.keys()) == {"outer", "inner"}
+    assert spans["outer"]["start_ms"] <= spans["inner"]["start_ms"]
+    assert spans["outer"]["wall_ms"] >= spans["inner"]["wall_ms"]
+
+
+def test_span_from_other_threads(logs):
+    metrics.start_run()
+    def record():
+        with metrics.span("background"):
+            pass
+    thread = threading.Thread(target=record)
+    thread.start()
+    thread.join()
+    with metrics.span("foreground"):
+        pass
+    spans = {span["name"]: span for span in metrics.get_spans()}
+    assert spans["background"]["thread"] == 1
+    assert spans["foreground"]["thread"] == 0
+
+
+def test_start_run_discards_old_spans(logs):
+    metrics.start_run()
+    with metrics.span("old"):
+        pass
+    metrics.start_run()
+    assert metrics.get_spans() == []
+
+
+def test_log_summary(logs):
+    metrics.start_run()
+    with metrics.span("status"):
+        pass
+    with metrics.span("upload"):
+        pass
+    metrics.log_summary()
+    assert in_logs(logs, "Phases: status 0.00s, upload 0.00s")
+
+
+def test_save_run_appends_json_lines(logs):
+    for ok in [True, False]:
+        metrics.start_run()
+        with metrics.span("phase"):
+            pass
+        metrics.save_run(ok)
+
+    with open(constants.METRICS_FILE, 'r') as metrics_file:
+        lines = metrics_file.readlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])["ok"]
+    assert not json.loads(lines[1])["ok"]
+    assert json.loads(lines[1])["spans"][0][0] == "phase"
+    assert len(logs) == 0
+
+
+def test_save_run_drops_oldest_runs(monkeypatch, logs):
+    monkeypatch.setattr(metrics, "METRICS_FILE_MAX_SIZE", 1000)
+    for _ in range(50):
+        metrics.start_run()
+        with metrics.span("phase"):
+            pass
+        metrics.save_run(True)
+
+    with open(constants.METRICS_FILE, 'r') as metrics_file:
+        lines = metrics_file.readlines()
+    assert 0 < len(lines) < 50
+    assert len(metrics.load_runs()) == len(lines)
+
+
+def test_export_chrome_trace(tmpdir, logs):
+    metrics.start_run()
+    with metrics.span("outer"):
+        with metrics.span("inner"):
+            pass
+    metrics.save_run(True)
+
+    assert metrics.export_chrome_trace(tmpdir / "trace.json")
+    with open(tmpdir / "trace.json", 'r') as trace_file:
+        trace = json.load(trace_file)
+    events = trace["traceEvents"]
+    assert [event["name"] for event in events] == ["inner", "outer"]
+    assert all(event["ph"] == "X" for event in events)
+    assert "cpu_ms" in events[0]["args"]
+    assert trace["otherData"]["ok"]
+    assert in_logs(logs, "exported to")
+
+
+def test_export_chrome_trace_no_metrics(tmpdir, logs):
+    assert not metrics.export_chrome_trace(tmpdir / "trace.json")
+    assert in_logs(logs, "No metrics found")
+
+
+def test_export_chrome_trace_missing_run(tmpdir, logs):
+    metrics.start_run()
+    metrics.save_run(True)
+    assert not metrics.export_chrome_trace(tmpdir / "trace.json", run_index=5)
+    assert in_logs(logs, "Run 5 not found")
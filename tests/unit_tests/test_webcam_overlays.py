@@ -0,0 +1,107 @@
+import time
+import threading
+
+import pytest
+from PIL import Image
+
+from zanzocam.webcam import overlays
+
+from tests.conftest import in_logs
+
+
+class ConcurrencyProbe:
+    """ Stands in for Overlay and records how many are built at once """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.threads = set()
+
+    def __call__(self, position, data, *args):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.threads.add(threading.get_ident())
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        if data.get("fail"):
+            raise ValueError("test")
+        overlay = type("FakeOverlay", (), {})()
+        overlay.position = position
+        overlay.rendered_image = None if data.get("empty") else Image.new("RGBA", (1, 1))
+        return overlay
+
+
+@pytest.fixture
+def probe(monkeypatch):
+    probe = ConcurrencyProbe()
+    monkeypatch.setattr(overlays, "Overlay", probe)
+    monkeypatch.setattr(overlays.os, "cpu_count", lambda: 4)
+    monkeypatch.setattr(overlays, "available_memory", lambda: 2 * 1024**3)
+    return probe
+
+
+POSITIONS = ["top_left", "top_center", "top_right", "bottom_left", "bottom_center", "bottom_right"]
+
+
+def test_render_overlays_in_parallel_keeps_the_order(probe):
+    rendered = overlays.render_overlays({position: {"type": "text"} for position in POSITIONS},
+                                        100, 100, None, None)
+    assert [overlay.position for overlay in rendered] == POSITIONS
+    assert probe.max_running > 1
+
+
+def test_render_overlays_skips_failed_and_empty(probe, logs):
+    data = {"top_left": {"fail": True}, "top_center": {"empty": True}, "top_right": {}}
+    rendered = overlays.render_overlays(data, 100, 100, None, None)
+    assert [overlay.position for overlay in rendered] == ["top_right"]
+    assert in_logs(logs, "Something happened processing the overlay top_left")
+
+
+def test_render_overlays_serially_on_single_core(probe, monkeypatch):
+    monkeypatch.setattr(overlays.os, "cpu_count", lambda: 1)
+    rendered = overlays.render_overlays({position: {} for position in POSITIONS}, 100, 100, None, None)
+    assert len(rendered) == len(POSITIONS)
+    assert probe.threads == {threading.get_ident()}
+
+
+def test_render_overlays_serially_if_memory_unknown(probe, monkeypatch):
+    monkeypatch.setattr(overlays, "available_memory", lambda: None)
+    overlays.render_overlays({position: {} for position in POSITIONS}, 100, 100, None, None)
+    assert probe.threads == {threading.get_ident()}
+
+
+def test_render_overlays_within_the_memory_budget(probe, monkeypatch, tmpdir):
+    # Each image needs about 8 MB to be rendered, only one fits in the budget
+    for position in POSITIONS:
+        Image.new("RGBA", (1000, 1000)).save(str(tmpdir / f"{position}.png"))
+    monkeypatch.setattr(overlays, "available_memory", lambda: 20 * 1024**2)
+    data = {position: {"type": "image", "path": tmpdir / f"{position}.png"} for position in POSITIONS}
+
+    rendered = overlays.render_overlays(data, 100, 100, None, None)
+    assert [overlay.position for overlay in rendered] == POSITIONS
+    assert probe.max_running == 1
+
+
+def test_estimate_memory(tmpdir):
+    Image.new("RGB", (100, 50)).save(str(tmpdir / "overlay.png"))
+    estimate = overlays.estimate_memory({"type": "image", "path": tmpdir / "overlay.png", "padding": 0}, 1000)
+    assert estimate == 100 * 50 * 8 + 100 * 50 * 4 * 2
+
+    resized = overlays.estimate_memory({"type": "image", "path": tmpdir / "overlay.png",
+                                        "padding": 0, "width": 10, "height": 5}, 1000)
+    assert resized == 100 * 50 * 8 + 10 * 5 * 4 * 2
+
+    assert overlays.estimate_memory({"type": "image", "path": tmpdir / "missing.png"}, 1000) == 0
+    assert (overlays.estimate_memory({"type": "text", "text": "a\nb"}, 1000) >
+            overlays.estimate_memory({"type": "text", "text": "a"}, 1000))
+
+
+def test_fonts_are_not_shared_between_threads():
+    fonts = []
+    thread = threading.Thread(target=lambda: fonts.append(overlays.load_font(20)))
+    thread.start()
+    thread.join()
+    assert overlays.load_font(20) is overlays.load_font(20)
+    assert overlays.load_font(20) is not fonts[0]
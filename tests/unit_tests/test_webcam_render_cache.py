@@ -0,0 +1,122 @@
+import os
+
+from PIL import Image
+
+from zanzocam.constants import *
+from zanzocam.webcam import render_cache, overlays
+from zanzocam.webcam.overlays import Overlay
+
+from tests.conftest import in_logs
+
+
+def test_cache_key_changes_with_the_content(tmpdir):
+    source = tmpdir / "overlay.png"
+    Image.new("RGBA", (10, 10), color="red").save(str(source))
+
+    key = render_cache.cache_key({"type": "image", "path": "overlay.png"}, 100, source=source)
+    assert key == render_cache.cache_key({"path": "overlay.png", "type": "image"}, 100, source=source)
+    assert key != render_cache.cache_key({"type": "image", "path": "overlay.png", "padding": 3}, 100, source=source)
+    assert key != render_cache.cache_key({"type": "image", "path": "overlay.png"}, 200, source=source)
+
+    Image.new("RGBA", (10, 10), color="blue").save(str(source))
+    assert key != render_cache.cache_key({"type": "image", "path": "overlay.png"}, 100, source=source)
+
+
+def test_cache_key_missing_source(tmpdir, logs):
+    assert not render_cache.cache_key({"type": "image"}, 100, source=tmpdir / "missing.png")
+    assert in_logs(logs, "Could not compute the key")
+
+
+def test_get_from_memory_and_disk():
+    image = Image.new("RGBA", (10, 10), color="#FF000080")
+    render_cache.put("key", image)
+    assert os.path.exists(render_cache.RENDER_CACHE_PATH / "key.png")
+
+    cached = render_cache.get("key")
+    assert cached is not image
+    assert cached.tobytes() == image.tobytes()
+
+    render_cache.clear_memory_cache()
+    cached = render_cache.get("key")
+    assert cached.tobytes() == image.tobytes()
+
+    assert not render_cache.get("other key")
+    assert not render_cache.get(None)
+
+
+def test_get_returns_copies():
+    render_cache.put("key", Image.new("RGBA", (10, 10), color="white"))
+    render_cache.get("key").paste((0, 0, 0, 255), (0, 0, 10, 10))
+    assert render_cache.get("key").getpixel((0, 0)) == (255, 255, 255, 255)
+
+
+def test_memory_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(render_cache, "RENDER_CACHE_MEMORY_ITEMS", 2)
+    for key in ["a", "b", "c"]:
+        render_cache.put(key, Image.new("RGBA", (1, 1)))
+    assert list(render_cache._memory_cache.keys()) == ["b", "c"]
+
+
+def test_least_recently_used_are_evicted(monkeypatch, logs):
+    for index, key in enumerate(["old", "used", "new"]):
+        render_cache.put(key, Image.new("RGBA", (50, 50), color="white"))
+        os.utime(render_cache.RENDER_CACHE_PATH / f"{key}.png", (1000 + index, 1000 + index))
+    # Reading "used" from disk makes it the most recently used
+    render_cache.clear_memory_cache()
+    render_cache.get("used")
+
+    size = os.path.getsize(render_cache.RENDER_CACHE_PATH / "new.png")
+    monkeypatch.setattr(render_cache, "RENDER_CACHE_MAX_SIZE", size * 2)
+    render_cache.enforce_cache_limits()
+
+    assert sorted(os.listdir(render_cache.RENDER_CACHE_PATH)) == ["new.png", "used.png"]
+    assert in_logs(logs, "removed old.png")
+
+
+def test_static_text_overlay_is_cached(monkeypatch):
+    overlay = Overlay("top_left", {"type": "text", "text": "Hello"}, 500, 500, None, None)
+    assert len(os.listdir(render_cache.RENDER_CACHE_PATH)) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The text should not be rendered again")
+    monkeypatch.setattr(overlays.ImageDraw, "Draw", fail)
+
+    cached = Overlay("top_left", {"type": "text", "text": "Hello"}, 500, 500, None, None)
+    assert cached.rendered_image.tobytes() == overlay.rendered_image.tobytes()
+
+
+def test_dynamic_text_overlay_matches_uncached_render():
+    data = {"type": "text", "text": "ZanzoCam\n%%DATE %%TIME\nLast line", "font_color": "#FF0000"}
+    overlay = Overlay("top_left", data, 500, 500, None, None)
+    assert overlay.rendered_image
+    # Only the static lines are cached
+    assert len(os.listdir(render_cache.RENDER_CACHE_PATH)) == 1
+
+    # The overlay keeps the text it rendered, with the date and time
+    assert "%%DATE" not in overlay.text
+
+    # The second time the static lines come from the cache
+    again = Overlay("top_left", data, 500, 500, None, None)
+    assert len(os.listdir(render_cache.RENDER_CACHE_PATH)) == 1
+
+    # An overlay with the same text and no dynamic lines is drawn in a single pass
+    expected = Overlay("top_left", dict(data, text=overlay.text), 500, 500, None, None)
+    assert overlay.rendered_image.tobytes() == expected.rendered_image.tobytes()
+    assert again.rendered_image.tobytes() == expected.rendered_image.tobytes()
+
+
+def test_image_overlay_is_cached(tmpdir):
+    path = tmpdir / "overlay.png"
+    Image.new("RGBA", (10, 20), color="#00FF00FF").save(str(path))
+    overlay = Overlay("top_left", {"type": "image", "path": path, "width": 5}, 100, 100, None, None)
+    assert overlay.rendered_image.size == (5 + 2*OVERLAY_DEFAULTS["padding"], 10 + 2*OVERLAY_DEFAULTS["padding"])
+
+    render_cache.clear_memory_cache()
+    cached = Overlay("top_left", {"type": "image", "path": path, "width": 5}, 100, 100, None, None)
+    assert cached.rendered_image.tobytes() == overlay.rendered_image.tobytes()
+
+    # A new image with the same name is rendered again
+    Image.new("RGBA", (10, 20), color="#0000FFFF").save(str(path))
+    changed = Overlay("top_left", {"type": "image", "path": path, "width": 5}, 100, 100, None, None)
+    assert changed.rendered_image.tobytes() != overlay.rendered_image.tobytes()
+    assert len(os.listdir(render_cache.RENDER_CACHE_PATH)) == 2
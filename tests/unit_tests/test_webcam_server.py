@@ -1,5 +1,7 @@
 import os
 import pytest
+import datetime
+from freezegun import freeze_time
 from tests.conftest import in_logs
 
 import zanzocam.webcam as webcam
@@ -8,6 +10,7 @@ from zanzocam.webcam.utils import log
 from zanzocam.webcam.configuration import Configuration
 from zanzocam.webcam.server.server import Server
 from zanzocam.webcam.server.ftp_server import FtpServer
+from zanzocam.webcam.server import download_index
 
 
 class MockServerImplementation:
@@ -18,10 +21,11 @@ class MockServerImplementation:
     def __getattr__(self, *a, **k):
         return lambda *a, **k: None
         
-    def download_new_configuration(self):
+    def download_new_configuration(self, cached=None):
+        self.configuration_validators = {'etag': 'new'}
         return {'config': 'new'}
 
-    def download_overlay_image(self, image):
+    def download_overlay_image(self, image, cached=None):
         log(f"[TEST] Downloading overlay image '{image}' - mocked")
 
     def send_logs(self, path):
@@ -33,8 +37,8 @@ class MockServerImplementation:
 
 @pytest.fixture(autouse=True)
 def mock_server_implementations(monkeypatch, tmp_path):
-    monkeypatch.setattr(webcam.server.server, 'HttpServer', MockServerImplementation)
-    monkeypatch.setattr(webcam.server.server, 'FtpServer', MockServerImplementation)
+    monkeypatch.setattr(webcam.server.http_server, 'HttpServer', MockServerImplementation)
+    monkeypatch.setattr(webcam.server.ftp_server, 'FtpServer', MockServerImplementation)
     monkeypatch.setattr(webcam.server.server, "CONFIGURATION_FILE", tmp_path / "data" / "configuration.json")
     monkeypatch.setattr(webcam.configuration, "CONFIGURATION_FILE", tmp_path / "data" / "configuration.json")
 
@@ -133,6 +137,82 @@ def test_update_config_works(tmp_path, logs):
     assert "".join(old_conf_content.split()) == '{"config":"old"}'
 
 
+def test_update_config_unchanged(monkeypatch, logs):
+    """
+        If the new configuration is the same as the old one, the
+        configuration file is not written again and the old
+        Configuration object is returned.
+    """
+    with open(webcam.server.server.CONFIGURATION_FILE, 'w') as c:
+        c.write('{"config": "new"}')
+    old_config = Configuration()
+    server = Server({'protocol': 'http', 'url': 'test'})
+
+    assert server.update_configuration(old_config) is old_config
+    assert not in_logs(logs, "ERROR")
+    assert in_logs(logs, "The configuration is the same as the one in use")
+    assert old_config.backup_is_current()
+
+    os.utime(webcam.server.server.CONFIGURATION_FILE, (0, 0))
+    os.utime(str(webcam.server.server.CONFIGURATION_FILE) + ".bak", (0, 0))
+    os.utime(constants.CONFIGURATION_INDEX_FILE, (0, 0))
+
+    # The second time nothing is written at all
+    assert server.update_configuration(old_config) is old_config
+    assert os.path.getmtime(webcam.server.server.CONFIGURATION_FILE) == 0
+    assert os.path.getmtime(str(webcam.server.server.CONFIGURATION_FILE) + ".bak") == 0
+    assert os.path.getmtime(constants.CONFIGURATION_INDEX_FILE) == 0
+
+
+def test_update_config_not_modified(monkeypatch, logs):
+    """
+        The server is told about the configuration in use, and if it
+        replies that it didn't change, the old configuration is kept.
+    """
+    received = []
+    def download_mocked(self, cached=None):
+        received.append(cached)
+        if cached:
+            return None
+        self.configuration_validators = {'etag': 'test'}
+        return {'config': 'new'}
+
+    monkeypatch.setattr(MockServerImplementation, 'download_new_configuration', download_mocked)
+    with open(webcam.server.server.CONFIGURATION_FILE, 'w') as c:
+        c.write('{"config": "old"}')
+    server = Server({'protocol': 'http', 'url': 'test'})
+
+    new_config = server.update_configuration(Configuration())
+    assert received == [None]
+    assert new_config.config == "new"
+
+    assert server.update_configuration(new_config) is new_config
+    assert received[1]['etag'] == 'test'
+    assert in_logs(logs, "The configuration did not change on the server")
+
+    # If the local copy changed, the configuration is downloaded again
+    with open(webcam.server.server.CONFIGURATION_FILE, 'w') as c:
+        c.write('{"config": "local"}')
+    server.update_configuration(Configuration())
+    assert received[2] is None
+
+
+def test_update_config_from_backup(logs):
+    """
+        If the configuration in use was loaded from the backup, the new one
+        is written even if it's the same.
+    """
+    backup_path = str(webcam.server.server.CONFIGURATION_FILE) + ".bak"
+    with open(backup_path, 'w') as c:
+        c.write('{"config": "new"}')
+    old_config = Configuration(path=backup_path)
+
+    server = Server({'protocol': 'http', 'url': 'test'})
+    new_config = server.update_configuration(old_config)
+    assert new_config is not old_config
+    assert os.path.exists(webcam.server.server.CONFIGURATION_FILE)
+
+
 def test_download_overlay_images_works_with_empty_list(logs):
     server = Server({'protocol': 'http'})
     server.download_overlay_images([]) 
@@ -147,13 +227,13 @@ def test_download_overlay_images_works_with_list(logs):
 
 
 def test_download_overlay_images_fail(monkeypatch, logs):
-    def download_mocked(self, image):
+    def download_mocked(self, image, cached=None):
         if image == "2.jpg":
             raise Exception("Test exception")
         log(f"[TEST] Downloading overlay image '{image}'"),
         
     monkeypatch.setattr(
-        webcam.server.server.HttpServer, 
+        webcam.server.http_server.HttpServer, 
         'download_overlay_image',
         download_mocked
     )
@@ -166,6 +246,45 @@ def test_download_overlay_images_fail(monkeypatch, logs):
     assert in_logs(logs, f"[TEST] Downloading overlay image '3.jpg'")
 
 
+def test_download_overlay_images_skips_unchanged(monkeypatch, logs):
+    received = {}
+    def download_mocked(self, image, cached=None):
+        received[image] = cached
+        if cached:
+            return cached
+        with open(constants.IMAGE_OVERLAYS_PATH / image, "w") as overlay:
+            overlay.write(f"content of {image}")
+        return {"etag": f"etag of {image}"}
+
+    monkeypatch.setattr(MockServerImplementation, 'download_overlay_image', download_mocked)
+    server = Server({'protocol': 'http'})
+
+    server.download_overlay_images(['1.jpg', '2.jpg'])
+    assert received == {'1.jpg': None, '2.jpg': None}
+    index = download_index.load_index()
+    assert index['1.jpg']['etag'] == "etag of 1.jpg"
+    assert index['1.jpg']['size'] == len("content of 1.jpg")
+
+    # The second time, the server is told about the local copies
+    server.download_overlay_images(['1.jpg', '2.jpg'])
+    assert received == index
+
+    # Local copies that changed are downloaded again,
+    # images not in the configuration are forgotten
+    with open(constants.IMAGE_OVERLAYS_PATH / '1.jpg', "w") as overlay:
+        overlay.write("content of 2.jpg")
+    server.download_overlay_images(['1.jpg'])
+    assert received['1.jpg'] is None
+    assert list(download_index.load_index().keys()) == ['1.jpg']
+
+
+def test_overlays_index_unreadable(logs):
+    with open(constants.OVERLAYS_INDEX_FILE, "w") as index:
+        index.write("not json")
+    assert download_index.load_index() == {}
+    assert in_logs(logs, "All its files will be downloaded again")
+
+
 def test_upload_logs_works(logs):
     os.makedirs(constants.CAMERA_LOGS)
     with open(webcam.server.server.CAMERA_LOG, 'w') as c:
@@ -195,13 +314,13 @@ def test_upload_picture_works(monkeypatch, tmpdir, logs):
     with open(tmpdir / ".temp.jpg", 'w') as c:
         pass
 
-    def upload_picture(self, image_path, image_name, image_extension):
+    def upload_picture(self, image_path, image_name, image_extension, timestamp=None):
         with open(tmpdir / 'test-pic-3.jpg', 'w') as c:
             pass
         return tmpdir / "test-pic-3.jpg"
 
     monkeypatch.setattr(
-        webcam.server.server.HttpServer, 
+        webcam.server.http_server.HttpServer, 
         'upload_picture',
         upload_picture
     )
@@ -219,13 +338,13 @@ def test_upload_picture_no_cleanup(monkeypatch, tmpdir, logs):
     with open(tmpdir / ".temp.jpg", 'w') as c:
         pass
     
-    def upload_picture(self, image_path, image_name, image_extension):
+    def upload_picture(self, image_path, image_name, image_extension, timestamp=None):
         with open(tmpdir / 'test-pic-3.jpg', 'w') as c:
             pass
         return tmpdir / "test-pic-3.jpg"
 
     monkeypatch.setattr(
-        webcam.server.server.HttpServer, 
+        webcam.server.http_server.HttpServer, 
         'upload_picture',
         upload_picture
     )
@@ -243,7 +362,7 @@ def test_upload_picture_does_not_catch_exceptions(monkeypatch, tmpdir, logs):
         pass
     
     monkeypatch.setattr(
-        webcam.server.server.HttpServer, 
+        webcam.server.http_server.HttpServer, 
         'upload_picture',
         lambda *a, **k: 1/0
     )
@@ -258,13 +377,13 @@ def test_upload_picture_does_not_catch_exceptions(monkeypatch, tmpdir, logs):
 
 def test_upload_picture_needs_correct_path(monkeypatch, tmpdir, logs):
     
-    def upload_picture(self, image_path, image_name, image_extension):
+    def upload_picture(self, image_path, image_name, image_extension, timestamp=None):
         with open(tmpdir / 'test-pic-3.jpg', 'w') as c:
             pass
         return tmpdir / "test-pic-3.jpg"
 
     monkeypatch.setattr(
-        webcam.server.server.HttpServer, 
+        webcam.server.http_server.HttpServer, 
         'upload_picture',
         upload_picture
     )
@@ -279,13 +398,13 @@ def test_upload_picture_needs_correct_path(monkeypatch, tmpdir, logs):
 
 def test_upload_picture_needs_path_name_extension(monkeypatch, tmpdir, logs):
     
-    def upload_picture(self, image_path, image_name, image_extension):
+    def upload_picture(self, image_path, image_name, image_extension, timestamp=None):
         with open(tmpdir / 'test-pic-3.jpg', 'w') as c:
             pass
         return tmpdir / "test-pic-3.jpg"
 
     monkeypatch.setattr(
-        webcam.server.server.HttpServer, 
+        webcam.server.http_server.HttpServer, 
         'upload_picture',
         upload_picture
     )
@@ -307,6 +426,104 @@ def test_upload_picture_needs_path_name_extension(monkeypatch, tmpdir, logs):
     assert not os.path.exists(tmpdir / ".temp.jpg")
 
 
+def test_spool_picture(tmpdir, logs):
+    with open(tmpdir / ".temp.jpg", 'w') as c:
+        pass
+
+    server = Server({'protocol': 'http', 'max_photos': 0})
+    assert server.spool_picture(tmpdir / ".temp.jpg", 'test-pic', 'jpg')
+
+    assert not os.path.exists(tmpdir / ".temp.jpg")
+    assert len(webcam.spool.list_spooled_pictures()) == 1
+
+
+def test_spool_picture_not_with_max_photos(tmpdir, logs):
+    with open(tmpdir / ".temp.jpg", 'w') as c:
+        pass
+
+    server = Server({'protocol': 'http', 'max_photos': 3})
+    assert not server.spool_picture(tmpdir / ".temp.jpg", 'test-pic', 'jpg')
+
+    assert in_logs(logs, "keeps only the last 3 pictures")
+    assert webcam.spool.list_spooled_pictures() == []
+
+
+def spool_pictures(tmpdir, amount):
+    for minute in range(amount):
+        with open(tmpdir / ".temp.jpg", 'w') as c:
+            pass
+        webcam.spool.spool_picture(tmpdir / ".temp.jpg", 'test-pic', 'jpg',
+            datetime.datetime(2021, 1, 1, 12, minute))
+
+
+def test_drain_spool_empty(logs):
+    server = Server({'protocol': 'http', 'max_photos': 0})
+    assert server.drain_spool()
+    assert len(logs) == 0
+
+
+@freeze_time("2021-01-01 13:00:00")
+def test_drain_spool_newest_first(monkeypatch, tmpdir, logs):
+    spool_pictures(tmpdir, 3)
+    uploaded = []
+
+    def upload_picture(self, image_path, image_name, image_extension, timestamp=None):
+        uploaded.append(timestamp)
+        return image_path
+
+    monkeypatch.setattr(MockServerImplementation, 'upload_picture', upload_picture)
+
+    server = Server({'protocol': 'http', 'max_photos': 0})
+    assert server.drain_spool()
+
+    assert uploaded == [datetime.datetime(2021, 1, 1, 12, minute) for minute in [2, 1, 0]]
+    assert webcam.spool.list_spooled_pictures() == []
+    assert in_logs(logs, "All the 3 spooled pictures were uploaded successfully")
+
+
+@freeze_time("2021-01-01 13:00:00")
+def test_drain_spool_stops_at_first_failure(monkeypatch, tmpdir, logs):
+    spool_pictures(tmpdir, 3)
+    uploaded = []
+
+    def upload_picture(self, image_path, image_name, image_extension, timestamp=None):
+        if uploaded:
+            raise ValueError("connection lost")
+        uploaded.append(timestamp)
+        return image_path
+
+    monkeypatch.setattr(MockServerImplementation, 'upload_picture', upload_picture)
+
+    server = Server({'protocol': 'http', 'max_photos': 0})
+    assert not server.drain_spool()
+
+    assert uploaded == [datetime.datetime(2021, 1, 1, 12, 2)]
+    assert len(webcam.spool.list_spooled_pictures()) == 2
+    assert in_logs(logs, "2 pictures are left for the next runs")
+
+
+@freeze_time("2021-01-01 13:00:00")
+def test_drain_spool_out_of_time(monkeypatch, tmpdir, logs):
+    spool_pictures(tmpdir, 3)
+    monkeypatch.setattr(MockServerImplementation, 'upload_picture',
+                        lambda self, image_path, *a, **k: image_path)
+
+    server = Server({'protocol': 'http', 'max_photos': 0})
+    assert not server.drain_spool(budget=-1)
+
+    assert len(webcam.spool.list_spooled_pictures()) == 3
+    assert in_logs(logs, "Time is up: 0 pictures uploaded, 3 left")
+
+
+@freeze_time("2021-01-01 13:00:00")
+def test_drain_spool_not_with_max_photos(tmpdir, logs):
+    spool_pictures(tmpdir, 1)
+
+    server = Server({'protocol': 'http', 'max_photos': 3})
+    assert not server.drain_spool()
+    assert len(webcam.spool.list_spooled_pictures()) == 1
+
+
 def test_create_server_ftp(monkeypatch, logs):
 
     class MockFTP:
@@ -315,7 +532,7 @@ def test_create_server_ftp(monkeypatch, logs):
         def prot_p(self, *a, **k):
             pass
 
-    monkeypatch.setattr(webcam.server.server, 'FtpServer', FtpServer)
+    monkeypatch.setattr(webcam.server.ftp_server, 'FtpServer', FtpServer)
     monkeypatch.setattr(webcam.server.ftp_server, "FTP", MockFTP)
     monkeypatch.setattr(webcam.server.ftp_server, "FTP_TLS", MockFTP)
     monkeypatch.setattr(webcam.server.ftp_server, "_Patched_FTP_TLS", MockFTP)
@@ -346,7 +563,7 @@ def test_create_server_http(monkeypatch, logs):
         def __init__(self, *a, **k):
             pass
 
-    monkeypatch.setattr(webcam.server.server, 'HttpServer', MockHttpServer)
+    monkeypatch.setattr(webcam.server.http_server, 'HttpServer', MockHttpServer)
     
     server = Server({'protocol': 'hTtP', 'url': 'test'})
     assert server.protocol == "HTTP"
@@ -5,6 +5,8 @@ from freezegun import freeze_time
 from PIL import Image, ImageChops
 
 
+from ftplib import error_perm
+
 import zanzocam.webcam as webcam
 import zanzocam.constants as constants
 from zanzocam.webcam.errors import ServerError
@@ -103,6 +105,28 @@ def test_download_new_configuration_succeed(monkeypatch, logs):
     assert config == {"test": "config"}
 
 
+def test_download_new_configuration_unchanged_by_mdtm(monkeypatch, logs):
+    downloads = []
+    def retrbinary(self, command, callback):
+        downloads.append(command)
+        callback(b'{"test": "config"}')
+        return "226 OK"
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'retrbinary', retrbinary)
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'voidcmd', lambda *a: "200 OK", raising=False)
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'size', lambda self, path: 18, raising=False)
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'sendcmd', 
+                        lambda self, command: "213 20230103100000", raising=False)
+
+    server = FtpServer({'hostname': 'me.it', 'username': 'me'})
+    assert server.download_new_configuration() == {"test": "config"}
+    assert server.configuration_validators == {"modify": "20230103100000", "remote_size": 18}
+
+    # The size of the local copy doesn't matter, it's reformatted
+    cached = {**server.configuration_validators, "size": 30, "sha256": "x"}
+    assert server.download_new_configuration(cached=cached) is None
+    assert downloads == ["RETR configuration/configuration.json"]
+
+
 def test_download_new_configuration_ftp_error_code(monkeypatch, logs):
     monkeypatch.setattr(
         webcam.server.ftp_server.FTP,
@@ -148,6 +172,48 @@ def test_download_overlay_image_succeed(monkeypatch, tmpdir, logs):
     assert not ImageChops.difference(overlay, downloaded).getbbox()
 
 
+def test_download_overlay_image_unchanged_by_mlsd(monkeypatch, logs):
+    listings = []
+    def mlsd(self, path, facts=None):
+        listings.append(path)
+        return iter([("a.png", {"size": "100", "modify": "20230102100000"}),
+                     ("b.png", {"size": "200", "modify": "20230102100000"})])
+    downloads = []
+    def retrbinary(self, command, callback):
+        downloads.append(command)
+        callback(b"image")
+        return "226 OK"
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'mlsd', mlsd, raising=False)
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'retrbinary', retrbinary)
+
+    server = FtpServer({'hostname': 'me.it', 'username': 'me'})
+    cached = {"size": 100, "modify": "20230102100000", "sha256": "x"}
+    assert server.download_overlay_image('a.png', cached=cached) is cached
+    assert "Overlay image not changed, not downloaded: a.png" in logs[0]
+
+    # b.png changed size: downloaded, with a single listing for both
+    entry = server.download_overlay_image('b.png', cached={"size": 150, "modify": "20230102100000"})
+    assert entry == {"modify": "20230102100000"}
+    assert downloads == ["RETR configuration/overlays/b.png"]
+    assert listings == ["configuration/overlays/"]
+
+
+def test_download_overlay_image_changed_by_mdtm(monkeypatch, logs):
+    def mlsd(self, path, facts=None):
+        raise error_perm("500 Unknown command")
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'mlsd', mlsd, raising=False)
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'voidcmd', lambda *a: "200 OK", raising=False)
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'size', lambda self, path: 100, raising=False)
+    monkeypatch.setattr(webcam.server.ftp_server.FTP, 'sendcmd', 
+                        lambda self, command: "213 20230103100000", raising=False)
+
+    server = FtpServer({'hostname': 'me.it', 'username': 'me'})
+    entry = server.download_overlay_image('test.png', cached={"size": 100, "modify": "20230102100000"})
+    assert entry == {"modify": "20230103100000"}
+    assert "New overlay image downloaded: test.png" in logs[0]
+    assert os.path.exists(constants.IMAGE_OVERLAYS_PATH/'test.png')
+
+
 def test_download_overlay_image_ftp_error_code(monkeypatch, logs):
     monkeypatch.setattr(
         webcam.server.ftp_server.FTP,
@@ -435,7 +501,8 @@ def test_upload_picture_ftp_error_code(monkeypatch, tmpdir, logs):
         assert "550 FAIL" in str(e)
 
     assert len(logs) == 0
-    assert os.path.exists(tmpdir/'test.JPEG')
+    assert os.path.exists(tmpdir/'pic.jpg')
+    assert not os.path.exists(tmpdir/'test.JPEG')
     assert not os.path.exists(tmpdir/'r_test.JPEG')
 
 
@@ -456,5 +523,6 @@ def test_upload_picture_python_error(monkeypatch, tmpdir, logs):
         server.upload_picture(tmpdir/'pic.jpg', 'test', 'JPEG')
 
     assert len(logs) == 0
-    assert os.path.exists(tmpdir/'test.JPEG')
+    assert os.path.exists(tmpdir/'pic.jpg')
+    assert not os.path.exists(tmpdir/'test.JPEG')
     assert not os.path.exists(tmpdir/'r_test.JPEG')
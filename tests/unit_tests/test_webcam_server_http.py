@@ -1,14 +1,16 @@
 import os
 import pytest
+import datetime
 from freezegun import freeze_time
 from PIL import Image, ImageChops
 
 import zanzocam.webcam as webcam
 import zanzocam.constants as constants
 from zanzocam.webcam.errors import ServerError
+from zanzocam.webcam.server.server import Server
 from zanzocam.webcam.server.http_server import HttpServer
 
-from tests.conftest import MockGetRequest, MockPostRequest
+from tests.conftest import in_logs, MockGetRequest, MockPostRequest
 
 
 @pytest.fixture(autouse=True)
@@ -57,6 +59,26 @@ def test_download_new_configuration_succeed(monkeypatch, logs):
     assert config == {"test": "data"}
 
 
+def test_download_new_configuration_not_modified(monkeypatch, logs):
+    requests_headers = []
+
+    def get(url, *a, headers=None, **k):
+        requests_headers.append(headers)
+        if headers:
+            return MockGetRequest(status=304)
+        return MockGetRequest('{"configuration": {"test": "data"}}', headers={"ETag": '"abc"'})
+    monkeypatch.setattr(webcam.server.http_server.requests, 'get', get)
+
+    server = HttpServer({'url': 'test'})
+    assert server.download_new_configuration() == {"test": "data"}
+    assert server.configuration_validators == {"etag": '"abc"', "last_modified": None}
+
+    cached = {**server.configuration_validators, "size": 1, "sha256": "x"}
+    assert server.download_new_configuration(cached=cached) is None
+    assert requests_headers == [{}, {"If-None-Match": '"abc"'}]
+    assert len(logs) == 0
+
+
 def test_download_new_configuration_request_fails(monkeypatch, logs):
     monkeypatch.setattr(
         webcam.server.http_server.requests,
@@ -120,6 +142,40 @@ def test_download_overlay_image_succeed(monkeypatch, tmpdir, logs):
     assert not ImageChops.difference(overlay, downloaded).getbbox()
 
 
+def test_download_overlay_image_returns_validators(monkeypatch, tmpdir, logs):
+    Image.new("RGBA", (10, 10)).save(str(tmpdir/'original_test.png'))
+    requests_headers = []
+
+    def get(url, *a, headers=None, **k):
+        requests_headers.append(headers)
+        return MockGetRequest(file_stream=open(tmpdir/'original_test.png', 'rb'),
+                              headers={"ETag": '"abc"', "Last-Modified": "Mon, 02 Jan 2023 10:00:00 GMT"})
+    monkeypatch.setattr(webcam.server.http_server.requests, 'get', get)
+
+    server = HttpServer({'url': 'test'})
+    entry = server.download_overlay_image('test.png')
+    assert entry == {"etag": '"abc"', "last_modified": "Mon, 02 Jan 2023 10:00:00 GMT"}
+    assert requests_headers == [{}]
+
+
+def test_download_overlay_image_not_modified(monkeypatch, tmpdir, logs):
+    Image.new("RGBA", (10, 10)).save(str(constants.IMAGE_OVERLAYS_PATH/'test.png'))
+    requests_headers = []
+
+    def get(url, *a, headers=None, **k):
+        requests_headers.append(headers)
+        return MockGetRequest(status=304)
+    monkeypatch.setattr(webcam.server.http_server.requests, 'get', get)
+
+    server = HttpServer({'url': 'test'})
+    cached = {"etag": '"abc"', "last_modified": "Mon, 02 Jan 2023 10:00:00 GMT", "size": 1, "sha256": "x"}
+    assert server.download_overlay_image('test.png', cached=cached) is cached
+    assert requests_headers == [{"If-None-Match": '"abc"', 
+                                 "If-Modified-Since": "Mon, 02 Jan 2023 10:00:00 GMT"}]
+    assert "Overlay image not changed, not downloaded: test.png" in logs[0]
+    assert Image.open(str(constants.IMAGE_OVERLAYS_PATH/'test.png')).size == (10, 10)
+
+
 def test_download_overlay_image_request_fail(monkeypatch, tmpdir, logs):
     image = Image.new("RGBA", (10, 10), color="#FFFFFF99")
     image.save(str(tmpdir/'test.png'))
@@ -445,6 +501,101 @@ def test_upload_picture_response_404(monkeypatch, tmpdir, logs):
     assert len(logs) == 0
 
 
+@freeze_time("2021-01-01 12:00:00")
+def test_upload_picture_fails_keeps_the_picture(monkeypatch, tmpdir, logs):
+    image = Image.new("RGB", (100, 100), color="#FFFFFF")
+    image.save(str(tmpdir/'test.jpg'))
+
+    monkeypatch.setattr(
+        webcam.server.http_server.requests,
+        'post',
+        lambda url, files, *a, **k: MockPostRequest(status=500)
+    )
+    server = HttpServer({'url': 'test'})
+    with pytest.raises(ServerError):
+        server.upload_picture(str(tmpdir/'test.jpg'), 'IMAGE', "JPEG")
+    assert os.path.exists(tmpdir/'test.jpg')
+    assert not os.path.exists(tmpdir/'IMAGE_2021-01-01_12:00:00.JPEG')
+
+
+@freeze_time("2021-01-01 12:00:00")
+def test_failed_upload_is_spooled_and_drained(monkeypatch, tmpdir, logs):
+    """
+        A picture that the server refuses goes to the spool,
+        and is uploaded from there once the server works again.
+    """
+    monkeypatch.setattr(webcam.server.server, "sleep", lambda *a, **k: None)
+    image = Image.new("RGB", (100, 100), color="#FFFFFF")
+    image.save(str(tmpdir/'test.jpg'))
+    posted = []
+    def post(url, files, *a, **k):
+        posted.append(os.path.basename(files['photo'].name))
+        return MockPostRequest(status=500)
+    monkeypatch.setattr(webcam.server.http_server.requests, 'post', post)
+    # The drain posts through a session: send it to the mocked post as well
+    class MockSession:
+        def post(self, *a, **k):
+            return webcam.server.http_server.requests.post(*a, **k)
+        def close(self):
+            pass
+    monkeypatch.setattr(webcam.server.http_server.requests, 'Session', MockSession)
+
+    server = Server({'protocol': 'http', 'url': 'test'})
+    with pytest.raises(ServerError):
+        server.upload_picture(tmpdir/'test.jpg', 'IMAGE', "JPEG")
+    # Every retry found the picture
+    assert len(posted) > 1
+    assert not in_logs(logs, "No picture to upload")
+    assert server.spool_picture(tmpdir/'test.jpg', 'IMAGE', "JPEG")
+    assert len(webcam.spool.list_spooled_pictures()) == 1
+
+    # The server still fails: the picture stays in the spool
+    assert not server.drain_spool()
+    assert len(webcam.spool.list_spooled_pictures()) == 1
+    assert not server.drain_spool()
+    assert len(webcam.spool.list_spooled_pictures()) == 1
+
+    # The server works again
+    monkeypatch.setattr(webcam.server.http_server.requests, 'post',
+                        lambda url, files, *a, **k: MockPostRequest(image=files, tmpdir=tmpdir))
+    assert server.drain_spool()
+    assert webcam.spool.list_spooled_pictures() == []
+    assert os.path.exists(tmpdir/'received_image.jpg')
+    assert os.listdir(constants.SPOOL_PATH) == []
+
+
+@freeze_time("2021-01-01 12:00:00")
+def test_drain_spool_reuses_one_connection(monkeypatch, tmpdir, logs):
+    sessions = []
+    class MockSession:
+        def __init__(self):
+            self.posted = []
+            self.closed = False
+            sessions.append(self)
+        def post(self, url, files, *a, **k):
+            self.posted.append(os.path.basename(files['photo'].name))
+            return MockPostRequest()
+        def close(self):
+            self.closed = True
+    monkeypatch.setattr(webcam.server.http_server.requests, 'Session', MockSession)
+    monkeypatch.setattr(webcam.server.http_server.requests, 'post', lambda *a, **k: 1/0)
+
+    # Two pictures shot within the same second, like in a burst
+    for _ in range(2):
+        image = Image.new("RGB", (100, 100), color="#FFFFFF")
+        image.save(str(tmpdir/'test.jpg'))
+        webcam.spool.spool_picture(tmpdir/'test.jpg', 'IMAGE', "JPEG",
+                                   datetime.datetime(2021, 1, 1, 11, 0))
+
+    server = Server({'protocol': 'http', 'url': 'test'})
+    assert server.drain_spool()
+    assert len(sessions) == 1
+    assert sessions[0].posted == ['IMAGE_2021-01-01_11:00:00.JPEG'] * 2
+    assert sessions[0].closed
+    assert server._server.session is None
+    assert os.listdir(constants.SPOOL_PATH) == []
+
+
 def test_upload_picture_json_error(monkeypatch, tmpdir, logs):
     image = Image.new("RGB", (100, 100), color="#FFFFFF")
     image.save(str(tmpdir/'test.jpg'))
@@ -0,0 +1,36 @@
+import pytest
+import datetime
+
+import zanzocam.constants as constants
+from zanzocam.webcam import solar
+
+
+UTC = datetime.timezone.utc
+
+
+def test_solar_elevation_at_noon():
+    # Equinox at the equator: the sun is right above
+    assert solar.solar_elevation(0, 0, datetime.datetime(2021, 3, 20, 12, 7, tzinfo=UTC)) == \
+        pytest.approx(90, abs=0.5)
+    # Summer solstice in Trento: 90 - latitude + axial tilt
+    assert solar.solar_elevation(46.07, 11.12, datetime.datetime(2021, 6, 21, 11, 15, tzinfo=UTC)) == \
+        pytest.approx(90 - 46.07 + 23.44, abs=0.5)
+
+
+def test_solar_elevation_at_sunrise_and_midnight():
+    # Sunrise in Greenwich: the centre of the sun is just below the horizon
+    assert solar.solar_elevation(51.48, 0, datetime.datetime(2021, 3, 20, 6, 3, tzinfo=UTC)) == \
+        pytest.approx(-0.27, abs=0.3)
+    assert solar.solar_elevation(46.07, 11.12, datetime.datetime(2021, 12, 21, 23, 0, tzinfo=UTC)) < -60
+
+
+def test_solar_elevation_with_timezones():
+    moment = datetime.datetime(2021, 6, 21, 11, 15, tzinfo=UTC)
+    same_moment = moment.astimezone(datetime.timezone(datetime.timedelta(hours=2)))
+    assert solar.solar_elevation(46.07, 11.12, moment) == solar.solar_elevation(46.07, 11.12, same_moment)
+
+
+def test_light_phase():
+    assert solar.light_phase(constants.SOLAR_DAY_ELEVATION + 1) == "day"
+    assert solar.light_phase(0) == "twilight"
+    assert solar.light_phase(constants.SOLAR_NIGHT_ELEVATION - 1) == "night"
@@ -0,0 +1,110 @@
+import os
+import json
+import datetime
+from freezegun import freeze_time
+
+import zanzocam.constants as constants
+from zanzocam.webcam import spool
+
+from tests.conftest import in_logs
+
+
+def make_picture(tmpdir, size=10, name="pic.jpg"):
+    with open(tmpdir / name, 'wb') as picture:
+        picture.write(b"0" * size)
+    return tmpdir / name
+
+
+@freeze_time("2021-01-01 12:30:00")
+def test_spool_picture(tmpdir, logs):
+    timestamp = datetime.datetime(2021, 1, 1, 12, 0, 0)
+    assert spool.spool_picture(make_picture(tmpdir), "test", "jpg", timestamp)
+
+    assert not os.path.exists(tmpdir / "pic.jpg")
+    spooled_path = constants.SPOOL_PATH / "test_2021-01-01_12:00:00_0.jpg"
+    assert os.path.exists(spooled_path)
+    with open(str(spooled_path) + ".json", 'r') as metadata:
+        assert json.load(metadata) == {
+            "name": "test",
+            "extension": "jpg",
+            "timestamp": "2021-01-01_12:00:00"
+        }
+    assert in_logs(logs, "it will be uploaded in the next runs")
+
+
+@freeze_time("2021-01-01 12:30:00")
+def test_spool_picture_same_second(tmpdir, logs):
+    # Like the pictures of a burst
+    timestamp = datetime.datetime(2021, 1, 1, 12, 0, 0)
+    assert spool.spool_picture(make_picture(tmpdir, size=10), "test", "jpg", timestamp)
+    assert spool.spool_picture(make_picture(tmpdir, size=20), "test", "jpg", timestamp)
+
+    entries = spool.list_spooled_pictures()
+    assert sorted(entry["size"] for entry in entries) == [10, 20]
+    assert all(entry["timestamp"] == timestamp for entry in entries)
+
+
+def test_spool_picture_missing_file(tmpdir, logs):
+    assert not spool.spool_picture(tmpdir / "missing.jpg", "test", "jpg", datetime.datetime.now())
+    assert in_logs(logs, "This picture will be lost")
+    assert spool.list_spooled_pictures() == []
+
+
+def test_list_spooled_pictures_newest_first(tmpdir, logs):
+    now = datetime.datetime.now().replace(microsecond=0)
+    for minutes in [10, 0, 5]:
+        spool.spool_picture(make_picture(tmpdir), "test", "jpg",
+                            now - datetime.timedelta(minutes=minutes))
+
+    entries = spool.list_spooled_pictures()
+    assert [entry["timestamp"] for entry in entries] == [
+        now,
+        now - datetime.timedelta(minutes=5),
+        now - datetime.timedelta(minutes=10),
+    ]
+    assert all(entry["size"] == 10 for entry in entries)
+
+
+def test_list_spooled_pictures_removes_orphans(tmpdir, logs):
+    os.makedirs(constants.SPOOL_PATH)
+    make_picture(constants.SPOOL_PATH, name="no-metadata.jpg")
+    with open(constants.SPOOL_PATH / "no-picture.jpg.json", 'w') as metadata:
+        metadata.write("{}")
+
+    assert spool.list_spooled_pictures() == []
+    assert os.listdir(constants.SPOOL_PATH) == []
+    assert in_logs(logs, "has no valid metadata")
+
+
+def test_spool_drops_old_pictures(tmpdir, logs):
+    now = datetime.datetime.now().replace(microsecond=0)
+    old = now - datetime.timedelta(seconds=constants.SPOOL_MAX_AGE + 60)
+    spool.spool_picture(make_picture(tmpdir), "test", "jpg", old)
+    spool.spool_picture(make_picture(tmpdir), "test", "jpg", now)
+
+    entries = spool.list_spooled_pictures()
+    assert len(entries) == 1
+    assert entries[0]["timestamp"] == now
+    assert in_logs(logs, "is too old")
+
+
+def test_spool_drops_oldest_pictures_when_full(monkeypatch, tmpdir, logs):
+    monkeypatch.setattr(spool, "SPOOL_MAX_SIZE", 25)
+    now = datetime.datetime.now().replace(microsecond=0)
+    for minutes in range(3):
+        spool.spool_picture(make_picture(tmpdir), "test", "jpg",
+                            now + datetime.timedelta(minutes=minutes))
+
+    entries = spool.list_spooled_pictures()
+    assert [entry["timestamp"] for entry in entries] == [
+        now + datetime.timedelta(minutes=2),
+        now + datetime.timedelta(minutes=1),
+    ]
+    assert in_logs(logs, "does not fit in the spool")
+
+
+def test_remove_spooled_picture(tmpdir, logs):
+    spool.spool_picture(make_picture(tmpdir), "test", "jpg", datetime.datetime.now())
+    entry = spool.list_spooled_pictures()[0]
+    spool.remove_spooled_picture(entry)
+    assert os.listdir(constants.SPOOL_PATH) == []
@@ -0,0 +1,68 @@
+import json
+from textwrap import dedent
+
+import zanzocam.webcam as webcam
+import zanzocam.constants as constants
+from zanzocam.webcam import startup_report
+
+from tests.conftest import in_logs
+
+
+IMPORTTIME_OUTPUT = dedent("""\
+    import time: self [us] | cumulative | imported package
+    import time:       100 |        100 |   fast_module
+    import time:      5000 |       5000 |     slow_module
+    import time:       200 |       5300 | zanzocam.webcam.main
+    """)
+
+
+def test_parse_import_times():
+    assert startup_report.parse_import_times(IMPORTTIME_OUTPUT) == {
+        "fast_module": (100, 100),
+        "slow_module": (5000, 5000),
+        "zanzocam.webcam.main": (200, 5300),
+    }
+
+
+def test_measure_import_times_real_module():
+    timings = startup_report.measure_import_times("zanzocam.constants")
+    assert "zanzocam.constants" in timings
+
+
+def test_startup_report_first_run(monkeypatch, logs):
+    monkeypatch.setattr(startup_report, "measure_import_times",
+                        lambda *a: startup_report.parse_import_times(IMPORTTIME_OUTPUT))
+    assert startup_report.startup_report()
+    assert in_logs(logs, "importing zanzocam.webcam.main takes 5.3 ms")
+    assert in_logs(logs, "slow_module")
+    assert startup_report.load_startup_report()["slow_module"] == (5000, 5000)
+
+
+def test_startup_report_regression(monkeypatch, logs):
+    with open(webcam.startup_report.STARTUP_REPORT_FILE, "w") as report:
+        json.dump({"zanzocam.webcam.main": [200, 300], "slow_module": [100, 100]}, report)
+    monkeypatch.setattr(webcam.startup_report, "STARTUP_REGRESSION_MIN_DELTA", 1000)
+    monkeypatch.setattr(startup_report, "measure_import_times",
+                        lambda *a: startup_report.parse_import_times(IMPORTTIME_OUTPUT))
+
+    assert not startup_report.startup_report()
+    assert in_logs(logs, "The startup time regressed")
+    assert in_logs(logs, "slow_module got slower")
+    # The old report is kept as reference
+    assert startup_report.load_startup_report()["slow_module"] == (100, 100)
+
+
+def test_startup_report_no_regression(monkeypatch, logs):
+    with open(webcam.startup_report.STARTUP_REPORT_FILE, "w") as report:
+        json.dump({"zanzocam.webcam.main": [200, 10000]}, report)
+    monkeypatch.setattr(startup_report, "measure_import_times",
+                        lambda *a: startup_report.parse_import_times(IMPORTTIME_OUTPUT))
+
+    assert startup_report.startup_report()
+    assert in_logs(logs, "No regression against the last report")
+    assert startup_report.load_startup_report()["zanzocam.webcam.main"] == (200, 5300)
+
+
+def test_startup_report_import_fails(monkeypatch, logs):
+    assert not startup_report.startup_report("not_a_real_module")
+    assert in_logs(logs, "Could not measure the import times")
@@ -1,10 +1,14 @@
 import os
 import sys
 import math
+import shutil
 import pytest
 import requests
 import builtins
+import subprocess
+from time import sleep, monotonic
 from unittest import mock
+from textwrap import dedent
 from freezegun import freeze_time
 from datetime import datetime, timedelta
 
@@ -15,62 +19,55 @@ from zanzocam.webcam import system
 from tests.conftest import in_logs
 
 
-def test_get_last_reboot_time_success(fake_process, logs):
+@freeze_time("2021-01-01 12:00:00")
+def test_get_last_reboot_time_success(monkeypatch, logs):
     """
         Get the last reboot time, test normal behavior
     """
-    mock_time = b"2021-01-01 00:00:00"
-    fake_process.register_subprocess(
-        ['/usr/bin/uptime', '-s'], stdout=mock_time
-    )
+    mock_open = mock.mock_open(read_data="43200.57 81234.12\n")
+    monkeypatch.setattr(builtins, 'open', mock_open)
     last_reboot_time = system.get_last_reboot_time()
-    date_format = "%Y-%m-%d %H:%M:%S"
-    expected_time = datetime.strptime(mock_time.decode('utf-8'), date_format)
-    assert last_reboot_time == expected_time
+    assert last_reboot_time == datetime(2021, 1, 1, 0, 0, 0)
     assert len(logs) == 0
 
 
-def test_get_last_reboot_time_exception(fake_process, logs):
+def test_get_last_reboot_time_exception(monkeypatch, logs):
     """
         Get the last reboot time, test exception management
     """
-    mock_time = b"2021-01-01 00:00:00"    
-    fake_process.register_subprocess(
-        ['/usr/bin/uptime', '-s'], returncode=2
-    )
+    def fail_open(*args, **kwargs):
+        raise PermissionError()
+
+    monkeypatch.setattr(builtins, 'open', fail_open)
     last_reboot_time = system.get_last_reboot_time()
     assert last_reboot_time == None
-    assert len(logs) == 1
+    assert len(logs) == 2
     assert in_logs(logs, "Could not get last reboot time information")
 
 
-@freeze_time("2021-01-01 12:00:00")
-def test_get_uptime_success(fake_process, logs):
+def test_get_uptime_success(monkeypatch, logs):
     """
         Get the uptime, test normal behavior
     """
-    mock_time = b"2021-01-01 00:00:00"
-    fake_process.register_subprocess(
-        ['/usr/bin/uptime', '-s'], stdout=mock_time
-    )
+    mock_open = mock.mock_open(read_data="43200.57 81234.12\n")
+    monkeypatch.setattr(builtins, 'open', mock_open)
     uptime = system.get_uptime()
     assert uptime == timedelta(hours=12)
+    mock_open.assert_called_once_with("/proc/uptime", "r")
     assert len(logs) == 0
 
 
-def test_get_uptime_exception(fake_process, logs):
+def test_get_uptime_exception(monkeypatch, logs):
     """
         Get the uptime, test exception management
     """
-    mock_time = b"2021-01-01 00:00:00"
-    fake_process.register_subprocess(
-        ['/usr/bin/uptime', '-s'], returncode=2
-    )
+    mock_open = mock.mock_open(read_data="not a number")
+    monkeypatch.setattr(builtins, 'open', mock_open)
     uptime = system.get_uptime()
     assert uptime == None
-    assert len(logs) == 2
+    assert len(logs) == 1
     assert in_logs(logs, "Could not get uptime information")
-    assert in_logs(logs, "Could not get last reboot time information")
+
 
 def test_run_hotspot_on_wifi_1(fake_process, logs):
     """
@@ -231,7 +228,7 @@ def test_check_internet_connectivity_success(monkeypatch, logs):
     def alright(url, timeout):
         pass
 
-    monkeypatch.setattr(webcam.system.requests, "head", alright)
+    monkeypatch.setattr(requests, "head", alright)
     assert system.check_internet_connectivity()
     assert len(logs) == 0
 
@@ -243,7 +240,7 @@ def test_check_internet_connectivity_timeout(monkeypatch, logs):
     def timeout(url, timeout):
         raise requests.ConnectionError()
 
-    monkeypatch.setattr(webcam.system.requests, "head", timeout)
+    monkeypatch.setattr(requests, "head", timeout)
     assert not system.check_internet_connectivity()
     assert len(logs) == 0
 
@@ -255,7 +252,7 @@ def test_check_internet_connectivity_exception(monkeypatch, logs):
     def generic_error(url, timeout):
         raise ValueError()
 
-    monkeypatch.setattr(webcam.system.requests, "head", generic_error)
+    monkeypatch.setattr(requests, "head", generic_error)
     assert not system.check_internet_connectivity()
     assert len(logs) == 1
     assert in_logs(logs, "Could not check if there is Internet access")
@@ -361,6 +358,91 @@ def test_report_general_status(monkeypatch):
     assert "RAM" in status.keys()
 
 
+def test_report_general_status_probes_run_concurrently(monkeypatch):
+    """
+        The probes run in parallel and the reboot time comes from the uptime.
+    """
+    def slow_probe(value):
+        def probe():
+            sleep(0.3)
+            return value
+        return probe
+
+    monkeypatch.setattr(system, "run_autohotspot", lambda: True)
+    monkeypatch.setattr(system, "get_uptime", slow_probe(timedelta(hours=1)))
+    monkeypatch.setattr(system, "get_wifi_data", slow_probe({"ssid": "test"}))
+    monkeypatch.setattr(system, "check_internet_connectivity", slow_probe(True))
+    monkeypatch.setattr(system, "get_filesystem_size", slow_probe("5.00 GB"))
+    monkeypatch.setattr(system, "get_free_space_on_disk", slow_probe("1.00 GB"))
+    monkeypatch.setattr(system, "get_ram_stats", slow_probe({"total": "1 kB"}))
+
+    start = monotonic()
+    status = system.report_general_status()
+    assert monotonic() - start < 1
+    assert status["uptime"] == timedelta(hours=1)
+    assert datetime.now() - status["last reboot"] - timedelta(hours=1) < timedelta(seconds=5)
+    assert status["hotspot status"] == "OFF (connected to WiFi)"
+    assert status["wifi data"] == {"ssid": "test"}
+    assert status["disk size"] == "5.00 GB"
+
+
+def test_run_probes_timeout(logs):
+    """
+        Probes that take too long are reported as None.
+    """
+    results = system.run_probes({
+        "fast": (lambda: "ok", 1),
+        "slow": (lambda: sleep(1) or "late", 0.1),
+    })
+    assert results == {"fast": "ok", "slow": None}
+    assert in_logs(logs, "The status probe 'slow' did not answer within 0.1 seconds")
+
+
+def test_run_probes_hung_probe_does_not_block_the_exit():
+    """
+        Probes that time out don't keep the process alive once the run is over.
+    """
+    script = dedent("""
+        from time import sleep
+        from zanzocam.webcam import system
+        system.run_probes({"hung": (lambda: sleep(60), 0.1)})
+    """)
+    # Raises TimeoutExpired if the process waits for the probe
+    subprocess.run([sys.executable, "-c", script], timeout=20, check=True,
+                   cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+
+def test_cached_status_value(logs):
+    """
+        Slow-changing values are computed once and then read from the cache.
+    """
+    calls = []
+    def probe():
+        calls.append(1)
+        return "5.00 GB"
+
+    assert system.cached_status_value("disk size", probe) == "5.00 GB"
+    assert system.cached_status_value("disk size", probe) == "5.00 GB"
+    assert len(calls) == 1
+    assert os.path.exists(constants.STATUS_CACHE_FILE)
+
+    # Expired values are computed again
+    assert system.cached_status_value("disk size", probe, ttl=0) == "5.00 GB"
+    assert len(calls) == 2
+    assert len(logs) == 0
+
+
+def test_cached_status_value_failures_are_not_cached(logs):
+    calls = []
+    def probe():
+        calls.append(1)
+        return None
+
+    assert system.cached_status_value("disk size", probe) is None
+    assert system.cached_status_value("disk size", probe) is None
+    assert len(calls) == 2
+
+
 def test_copy_system_file_success(tmpdir, logs):
     """
         Copy a system file under normal conditions
@@ -642,6 +724,41 @@ def test_update_crontab_success(tmpdir, logs):
             for hour in range(24)]
 
 
+def test_update_crontab_daemon_mode(monkeypatch, tmpdir, logs):
+    """
+        Test that in daemon mode the crontab only contains the watchdog
+    """
+    assert webcam.system.CRONJOB_FILE == tmpdir / "zanzocam"
+    with open(webcam.system.CRONJOB_FILE, 'w'):
+        pass
+    monkeypatch.setattr(webcam.system, "copy_system_file",
+                        lambda source, dest: shutil.copy(source, dest))
+    monkeypatch.setattr(webcam.system, "give_ownership_to_root", lambda *a: None)
+
+    system.update_crontab({"frequency": "10", "daemon": True})
+    assert len(logs) == 1
+    assert in_logs(logs, "Crontab updated successfully")
+    assert open(webcam.system.CRONJOB_FILE, 'r').readlines() == [
+        "# ZANZOCAM - shoot picture\n",
+        f"*/{constants.DAEMON_WATCHDOG_INTERVAL} * * * * "
+        f"{constants.SYSTEM_USER} {sys.argv[0]} --daemon\n"
+    ]
+
+
+def test_crontab_up_to_date(monkeypatch, tmpdir, logs):
+    """
+        Test that the crontab is up to date only if it matches the settings
+    """
+    assert not system.crontab_up_to_date({"frequency": "10"})
+    monkeypatch.setattr(webcam.system, "copy_system_file",
+                        lambda source, dest: shutil.copy(source, dest))
+    monkeypatch.setattr(webcam.system, "give_ownership_to_root", lambda *a: None)
+    system.update_crontab({"frequency": "10"})
+    assert system.crontab_up_to_date({"frequency": "10"})
+    assert not system.crontab_up_to_date({"frequency": "20"})
+    assert not system.crontab_up_to_date({"frequency": "10", "daemon": True})
+
+
 def test_update_crontab_prepare_strings_fails(monkeypatch, tmpdir, logs):
     """
         Test that the crontab is unchanged if there is trouble
@@ -684,8 +801,7 @@ def test_update_crontab_write_temp_file_fails(monkeypatch, tmpdir, logs):
     assert webcam.system.CRONJOB_FILE == tmpdir / "zanzocam"
     with open(webcam.system.CRONJOB_FILE, 'w') as c:
         c.write("crontab content")
-    # update_crontab uses sys.argv[0], which is always present; but not now...
-    monkeypatch.setattr(sys, 'argv', [])
+    monkeypatch.setattr(webcam.system, 'TEMP_CRONJOB', tmpdir / "missing" / "cronjob")
 
     system.update_crontab({})
     assert len(logs) == 1
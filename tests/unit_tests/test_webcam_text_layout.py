@@ -0,0 +1,92 @@
+import math
+import random
+
+import pytest
+from PIL import ImageFont
+
+from zanzocam.constants import *
+from zanzocam.webcam import text_layout
+
+
+WORDS = ("Temperature 12.5°C, wind WNW at 25 km/h, gusts AVAILABLE. Yesterday: Tomorrow, "
+         "VAWA LTAT office Wolf \"quoted\" (parens) Über Ärger 1234567890 àèìòù "
+         "Supercalifragilisticexpialidocious").split() + [""]
+
+
+def legacy_layout(font, text, max_width):
+    """ How the text was wrapped before: measuring the whole line at every word """
+    lines = []
+    for line in text.split("\n"):
+        if font.getsize(line)[0] <= max_width:
+            lines.append(line)
+            continue
+        new_line = ""
+        for word in line.split(" "):
+            if font.getsize(new_line + word)[0] <= max_width:
+                new_line = new_line + word + " "
+            else:
+                lines.append(new_line)
+                new_line = word + " "
+        if new_line != "":
+            lines.append(new_line)
+    ascent, descent = font.getmetrics()
+    return (lines, max([font.getsize(line)[0] for line in lines]),
+            math.ceil(len(lines) * ascent * 1.03) + descent)
+
+
+class CountingFont:
+    """ Counts the exact measures """
+    def __init__(self, font):
+        self.font = font
+        self.size = font.size
+        self.measured = []
+
+    def getsize(self, text):
+        self.measured.append(text)
+        return self.font.getsize(text)
+
+    def __getattr__(self, name):
+        return getattr(self.font, name)
+
+
+@pytest.mark.parametrize("font_size", [8, 16, 25, 64])
+def test_layout_is_the_same_as_measuring_every_line(font_size):
+    font = ImageFont.truetype(FONT_PATH, font_size)
+    rng = random.Random(font_size)
+    for _ in range(50):
+        text = "\n".join(" ".join(rng.choices(WORDS, k=rng.randint(0, 50)))
+                         for _ in range(rng.randint(1, 4)))
+        max_width = rng.randint(font_size * 3, font_size * 40)
+        assert text_layout.layout_text(font, text, max_width) == legacy_layout(font, text, max_width)
+
+
+def test_wrap_line():
+    font = ImageFont.truetype(FONT_PATH, 25)
+    width = font.getsize("hello world")[0]
+    lines, estimates = text_layout.wrap_line(font, "hello world hello world hello", width)
+    assert lines == ["hello world ", "hello world ", "hello "]
+    assert len(estimates) == 3
+    assert text_layout.wrap_line(font, "hello", width)[0] == ["hello"]
+
+
+def test_wrap_line_word_too_long():
+    font = ImageFont.truetype(FONT_PATH, 25)
+    lines, _ = text_layout.wrap_line(font, "Supercalifragilisticexpialidocious hello", 100)
+    assert lines == ["", "Supercalifragilisticexpialidocious ", "hello "]
+
+
+def test_words_are_measured_once():
+    font = ImageFont.truetype(FONT_PATH, 31)
+    text_layout.layout_text(font, "ZanzoCam ZanzoCam ZanzoCam ZanzoCam", 200)
+    hits = text_layout.text_length.cache_info().hits
+    text_layout.layout_text(font, "ZanzoCam ZanzoCam ZanzoCam ZanzoCam", 200)
+    assert text_layout.text_length.cache_info().hits > hits + 4
+
+
+def test_only_lines_close_to_the_limit_are_measured():
+    font = CountingFont(ImageFont.truetype(FONT_PATH, 25))
+    text = " ".join(["wind"] * 200)
+    lines, width, _ = text_layout.layout_text(font, text, 1000)
+    # Far fewer exact measures than words
+    assert len(font.measured) < len(lines) * 4
+    assert width == max(font.font.getsize(line)[0] for line in lines)
@@ -0,0 +1,158 @@
+import pytest
+import socket
+from time import sleep
+
+import zanzocam.constants as constants
+from zanzocam.webcam import utils
+from zanzocam.webcam.errors import ServerError
+from zanzocam.webcam.utils import retry, BackgroundTask
+
+from tests.conftest import in_logs
+
+
+def test_background_task_returns_value():
+    task = BackgroundTask(lambda a, b=0: a + b, 1, b=2)
+    assert task.result() == 3
+    assert task.result() == 3
+
+
+def test_background_task_runs_in_parallel():
+    events = []
+    def slow():
+        sleep(0.2)
+        events.append("task")
+    task = BackgroundTask(slow)
+    events.append("main")
+    task.result()
+    assert events == ["main", "task"]
+
+
+def test_background_task_reraises():
+    task = BackgroundTask(lambda: 1/0)
+    with pytest.raises(ZeroDivisionError):
+        task.result()
+
+
+def test_background_task_timeout():
+    task = BackgroundTask(lambda: sleep(0.5) or "late")
+    with pytest.raises(TimeoutError):
+        task.result(timeout=0.05)
+    assert task.result() == "late"
+
+
+@pytest.fixture()
+def no_sleep(monkeypatch):
+    waits = []
+    monkeypatch.setattr(utils, "sleep", lambda seconds: waits.append(seconds))
+    yield waits
+    utils.set_run_deadline(None)
+
+
+def failing(exception, failures):
+    """
+    Returns a function that raises `exception` `failures` times, then returns True.
+    """
+    calls = []
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise exception
+        return True
+    func.calls = calls
+    return func
+
+
+def test_retry_succeeds_after_failures(no_sleep, logs):
+    func = failing(ValueError("test"), 2)
+    assert retry(times=3, wait_for=10)(func)()
+    assert len(func.calls) == 3
+    assert len(no_sleep) == 2
+    assert in_logs(logs, "retrying (1/3)")
+    assert in_logs(logs, "retrying (2/3)")
+
+
+def test_retry_raises_last_exception(no_sleep, logs):
+    func = failing(ValueError("test"), 5)
+    with pytest.raises(ValueError):
+        retry(times=2, wait_for=10)(func)()
+    assert len(func.calls) == 3
+
+
+def test_retry_uses_error_class_policy(no_sleep, logs):
+    func = failing(ServerError("refused", status_code=404), 5)
+    with pytest.raises(ServerError):
+        retry(times=3, wait_for=10)(func)()
+    assert len(func.calls) == 1
+    assert no_sleep == []
+
+
+def test_retry_respects_run_deadline(no_sleep, logs):
+    utils.set_run_deadline(5)
+    func = failing(ValueError("test"), 5)
+    with pytest.raises(ValueError):
+        retry(times=3, wait_for=10)(func)()
+    assert len(func.calls) == 1
+    assert no_sleep == []
+    assert in_logs(logs, "Not retrying: the run must end within")
+
+
+def test_backoff_delay(monkeypatch):
+    monkeypatch.setattr(utils.random, "uniform", lambda low, high: high)
+    assert [utils.backoff_delay(attempt, 10) for attempt in range(1, 5)] == \
+        [10, 20, 40, constants.RETRY_MAX_WAIT]
+    monkeypatch.setattr(utils.random, "uniform", lambda low, high: low)
+    assert utils.backoff_delay(1, 10) == 10 * (1 - constants.RETRY_JITTER)
+
+
+def test_classify_error():
+    assert utils.classify_error(ValueError("test")) is None
+    assert utils.classify_error(socket.gaierror("test")) == "dns"
+    assert utils.classify_error(ServerError("test", status_code=503)) == "server"
+    assert utils.classify_error(ServerError("test", status_code=403)) == "client"
+
+    class PiCameraMMALError(Exception):
+        pass
+    assert utils.classify_error(PiCameraMMALError("Out of resources")) == "camera"
+
+
+def test_camera_errors_retried_like_other_camera_failures(no_sleep):
+    class PiCameraMMALError(Exception):
+        pass
+    attempts = []
+    @utils.retry(times=constants.CAMERA_RETRIES, wait_for=constants.WAIT_AFTER_CAMERA_FAIL)
+    def shoot(error):
+        attempts.append(1)
+        raise error
+
+    for error in [PiCameraMMALError("Out of resources"), ValueError("test")]:
+        attempts.clear()
+        with pytest.raises(type(error)):
+            shoot(error)
+        assert len(attempts) == constants.CAMERA_RETRIES + 1
+
+
+def test_classify_error_looks_at_the_causes():
+    try:
+        try:
+            raise ConnectionError("Temporary failure in name resolution")
+        except Exception:
+            raise ServerError("Something went wrong")
+    except ServerError as error:
+        assert utils.classify_error(error) == "dns"
+
+
+def test_time_left_and_request_timeout(no_sleep):
+    assert utils.time_left() is None
+    assert utils.time_left(10) == 10
+    assert utils.request_timeout(60) == 60
+
+    utils.set_run_deadline(30)
+    assert 29 < utils.time_left() <= 30
+    assert utils.time_left(10) == 10
+    assert 29 < utils.request_timeout(60) <= 30
+
+    utils.set_run_deadline(-10)
+    assert utils.request_timeout(60) == constants.MIN_REQUEST_TIMEOUT
+
+    utils.set_run_deadline(None)
+    assert utils.time_left() is None
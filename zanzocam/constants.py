@@ -36,6 +36,33 @@ CAMERA_LOG = CAMERA_LOGS / 'camera.log'
 #: Used with datetime to format the log name
 LOG_NAME_FORMAT = "logs %d-%m-%Y %H:%M:%S.log"
 
+#: Used with datetime to timestamp the pictures on the server (if max_photos = 0)
+PICTURE_DATE_FORMAT = "%Y-%m-%d_%H:%M:%S"
+
+#: Import times measured by `z-webcam --startup-report`
+STARTUP_REPORT_FILE = DATA_PATH / "startup_report.json"
+
+#: Slow-changing values of the status report, cached across runs
+STATUS_CACHE_FILE = DATA_PATH / ".status_cache.json"
+
+#: Duration of the phases of each run, one JSON line per run
+METRICS_FILE = DATA_PATH / "metrics.jsonl"
+
+#: Pictures that failed to upload, waiting to be sent in the next runs
+SPOOL_PATH = DATA_PATH / "spool"
+
+#: Exposure found by the low light search in the previous runs,
+#:  by season and time of day
+EXPOSURE_HISTORY_FILE = DATA_PATH / "exposure_history.json"
+
+#: White balance gains of the previous runs, by time of day, 
+#:  used instead of waiting for the white balance in the dark
+AWB_GAINS_FILE = DATA_PATH / "awb_gains.json"
+
+#: Overlays rendered in the previous runs, reused while their
+#:  configuration, image and font don't change
+RENDER_CACHE_PATH = DATA_PATH / "render_cache"
+
 #: Logs produced in case of issues with the server
 FAILURE_REPORT_PATH = DATA_PATH / 'failure_report.txt'
 
@@ -60,6 +87,18 @@ IMAGE_OVERLAYS_PATH = DATA_PATH / "overlays"
 #: Remote camera overlays path
 REMOTE_IMAGES_PATH = "configuration/overlays/"
 
+#: Remote configuration file path, on FTP servers
+FTP_CONFIGURATION_PATH = "configuration/configuration.json"
+
+#: What the server said about each overlay image when it was downloaded
+#:  (ETag, Last-Modified, size and modification time on FTP) and the size
+#:  and hash of the local copy, to download only the images that changed
+OVERLAYS_INDEX_FILE = DATA_PATH / "overlays_index.json"
+
+#: Same as OVERLAYS_INDEX_FILE, for the configuration file,
+#:  by server
+CONFIGURATION_INDEX_FILE = DATA_PATH / "configuration_index.json"
+
 
 # Constants & defaults
 # ####################
@@ -70,9 +109,28 @@ LOCALE = 'it_IT.utf8'
 #: Path to the default font (can be customized if you install another font)
 FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
 
-#: Time to wait in between failed shots of the camera
-#:  (to overcome colliding crontabs)
-WAIT_AFTER_CAMERA_FAIL = 30
+#: How many words the text layout remembers the width of, for all fonts
+TEXT_LAYOUT_CACHE_SIZE = 4096
+
+#: Lines whose estimated width is this close to the available width
+#:  (as a fraction of the font size, plus 2 pixels) are measured exactly,
+#:  as summing the width of single words ignores kerning and rounding
+TEXT_LAYOUT_MARGIN = 0.1
+
+#: Most overlays rendered at once, on boards with enough cores.
+#:  Single-core boards render them one at a time.
+OVERLAYS_MAX_WORKERS = 4
+
+#: Fraction of the available memory that the overlays rendered at once
+#:  can use, estimated from the size of their images and text
+OVERLAYS_MEMORY_FRACTION = 0.5
+
+#: Time to wait after the first failed shot of the camera
+#:  (to overcome colliding crontabs). Doubles at every retry.
+WAIT_AFTER_CAMERA_FAIL = 10
+
+#: How many times to retry taking the picture
+CAMERA_RETRIES = 2
 
 #: Temporary crontab path
 TEMP_CRONJOB = DATA_PATH / ".tmp-cronjob-file"
@@ -83,15 +141,97 @@ BACKUP_CRONJOB = DATA_PATH / ".crontab.bak"
 #: Path to the system crontab
 CRONJOB_FILE = "/etc/cron.d/zanzocam"
 
+#: Lock file held by the z-webcam daemon for as long as it runs
+DAEMON_LOCK_FILE = DATA_PATH / ".daemon.lock"
+
+#: How often (in minutes) cron checks that the daemon is alive,
+#:  when the daemon mode is enabled
+DAEMON_WATCHDOG_INTERVAL = 5
+
+#: Longest single sleep of the daemon (in seconds), so that clock
+#:  adjustments (NTP, RTC) are picked up before the next trigger
+DAEMON_MAX_SLEEP = 30
+
 #: Timeout for HTTP requests
 REQUEST_TIMEOUT = 60
 
+#: Shortest timeout for network requests (in seconds), even when
+#:  the run deadline is closer than that
+MIN_REQUEST_TIMEOUT = 5
+
+#: Retry policies for each class of errors (see `utils.classify_error`).
+#:  `times` is the number of retries, `wait_for` the wait before the first
+#:  retry (in seconds), which doubles at every retry.
+#:  Errors that fall in no class use the values given to `utils.retry`.
+RETRY_POLICIES = {
+    # The hostname can't be resolved: the network is likely down
+    "dns": {"times": 1, "wait_for": 20},
+    # The server is failing or overloaded (HTTP 5xx, FTP 4xx)
+    "server": {"times": 3, "wait_for": 10},
+    # The server refused the request (HTTP 4xx, FTP 5xx): retrying won't help
+    "client": {"times": 0, "wait_for": 0},
+    # The camera is busy, for example used by another process:
+    # same as any other failure of the camera
+    "camera": {"times": CAMERA_RETRIES, "wait_for": WAIT_AFTER_CAMERA_FAIL},
+}
+
+#: Longest wait between two retries (in seconds)
+RETRY_MAX_WAIT = 60
+
+#: Waits between retries are randomized between (1 - RETRY_JITTER) and 1
+#:  times their nominal value, so that cameras don't retry all together
+RETRY_JITTER = 0.5
+
+#: Longest a run can last (in seconds), if no next run is scheduled earlier
+RUN_MAX_DURATION = 30 * 60
+
+#: Time reserved at the end of a run (in seconds) to upload the logs
+#:  before the next run is due
+RUN_DEADLINE_MARGIN = 15
+
 #: URL to check to ensure Internet is reachable
 CHECK_UPLINK_URL = "http://www.google.com"
 
+#: Timeout for the Internet connectivity check (in seconds)
+CHECK_UPLINK_TIMEOUT = 5
+
+#: How long each probe of the status report can take (in seconds)
+STATUS_PROBE_TIMEOUT = 10
+
+#: How long the cached values of the status report are valid (in seconds)
+STATUS_CACHE_TTL = 24 * 60 * 60
+
 #: Path to the autohotspot script
 AUTOHOTSPOT_BINARY_PATH = "/usr/bin/autohotspot"
 
+#: How much slower (as a fraction) the startup can get before
+#:  `z-webcam --startup-report` reports a regression
+STARTUP_REGRESSION_TOLERANCE = 0.25
+
+#: Minimum slowdown of a single import (in microseconds) to be
+#:  listed in the startup regressions
+STARTUP_REGRESSION_MIN_DELTA = 20000
+
+#: Size of the metrics file (in bytes) after which the oldest runs are dropped
+METRICS_FILE_MAX_SIZE = 1024 * 1024
+
+#: Maximum size of the spool of pictures that failed to upload (in bytes).
+#:  When full, the oldest pictures are deleted.
+SPOOL_MAX_SIZE = 100 * 1024 * 1024
+
+#: Pictures older than this (in seconds) are removed from the spool
+SPOOL_MAX_AGE = 7 * 24 * 60 * 60
+
+#: Maximum size of the overlays render cache on disk (in bytes).
+#:  When full, the overlays used least recently are deleted.
+RENDER_CACHE_MAX_SIZE = 10 * 1024 * 1024
+
+#: How many rendered overlays are kept in memory, when running as a daemon
+RENDER_CACHE_MEMORY_ITEMS = 32
+
+#: How long each run can spend uploading spooled pictures (in seconds)
+SPOOL_DRAIN_BUDGET = 60
+
 #: Ecoding of the FTP server files
 FTP_CONFIG_FILE_ENCODING = 'utf-8'
 
@@ -127,10 +267,109 @@ MAX_SHUTTER_SPEED = int(9.5 * 10**6)
 #: How much tolerance to give to the low light search algorithm
 TARGET_LUMINOSITY_MARGIN = 3
 
-#: Time to allow the firmware to compute the right exposure in normal
-#:  light conditions (AWB requires more)
+#: Max ISO level for low light pictures
+MAX_LOW_LIGHT_ISO = 800
+
+#: Min exposure (shutter speed in microseconds times ISO) that
+#:  the secant low light search can try
+MIN_LOW_LIGHT_EXPOSURE = 1000 * INITIAL_LOW_LIGHT_ISO
+
+#: How the logarithm of the luminance grows with the logarithm of the 
+#:  exposure, before the first two pictures of the secant low light search
+#:  can measure it. The pictures are gamma encoded, hence about 1/2.2
+LOW_LIGHT_RESPONSE_SLOPE = 1 / 2.2
+
+#: Luminance above which a picture, or a pixel, is considered saturated
+SATURATED_LUMINANCE = 250
+
+#: How much the secant low light search multiplies (or divides) the 
+#:  exposure after a black (or saturated) picture
+LOW_LIGHT_BLIND_STEP = 8
+
+#: Width of the time of day slots of the exposure history (in minutes).
+#:  Runs in the same slot and month start the low light search from
+#:  the exposure found by the last one.
+EXPOSURE_HISTORY_SLOT = 15
+
+#: Entries of the exposure history older than this (in seconds) are dropped
+EXPOSURE_HISTORY_MAX_AGE = 30 * 24 * 60 * 60
+
+#: Max time to allow the firmware to compute the right exposure in normal
+#:  light conditions (AWB requires more). The warm-up ends earlier if 
+#:  exposure and white balance converge before.
 CAMERA_WARM_UP_TIME = 5
 
+#: How often the warm-up checks whether exposure and white balance converged
+#:  (in seconds). Long exposures are polled once per frame.
+CONVERGENCE_POLL_INTERVAL = 0.25
+
+#: How much (as a fraction) gains and exposure may change between two polls
+#:  for the camera to be considered stable
+CONVERGENCE_TOLERANCE = 0.02
+
+#: How many polls in a row must be stable to end the warm-up
+CONVERGENCE_STABLE_POLLS = 3
+
+#: Resolution of the in-memory frames used to meter the luminance in low
+#:  light. Unencoded captures are padded by the camera to multiples of
+#:  32 (width) and 16 (height): any other size would not fit the buffer.
+METERING_RESOLUTION = (128, 96)
+
+#: Weights of the red, green and blue channels in the perceived luminance
+LUMINANCE_WEIGHTS = (0.241, 0.691, 0.068)
+
+#: Percentiles of the luminance reported by the metering
+METERING_PERCENTILES = (5, 50, 95)
+
+#: Spread of the centre-weighted metering, as a fraction of the picture size
+METERING_CENTRE_SIGMA = 0.25
+
+#: Max time to allow the firmware to adapt to a new framerate range and ISO
+#:  when an open camera is reconfigured for low light: much shorter than
+#:  a full warm-up, because the sensor is already running
+CAMERA_RECONFIGURE_TIME = 2
+
+#: Lowest framerate the sensor mode must support in daylight: exposures
+#:  can be as long as 1/15 of a second, like with the full resolution mode
+DAYLIGHT_MIN_FRAMERATE = 15
+
+#: Time a picture of a burst takes to be shot, processed and handed
+#:  over for upload (in seconds): no picture is started later than
+#:  this before the end of the run
+BURST_FRAME_MARGIN = 5
+
+#: Elevation of the sun (in degrees) above which the pictures are surely
+#:  taken in daylight, if the position of the camera is known: mountains
+#:  and valleys may hide a low sun, so it's well above the horizon
+SOLAR_DAY_ELEVATION = 10
+
+#: Elevation of the sun (in degrees) below which the pictures are surely
+#:  taken at night, if the position of the camera is known (nautical dusk)
+SOLAR_NIGHT_ELEVATION = -12
+
+#: Shortest shutter speed worth replacing with a stack of pictures, if
+#:  `stacking_frames` is set (in microseconds): shorter exposures are
+#:  cheap enough to be shot in a single picture
+STACKING_MIN_SHUTTER_SPEED = 10**6
+
+#: Most pictures in a stack: each of them takes a long exposure, and
+#:  their sum is kept in 16 bits, which holds up to 257 pictures
+STACKING_MAX_FRAMES = 16
+
+#: Rows of the picture merged at once in exposure bracketing: the memory
+#:  used by the merge grows with the width of the picture times this
+MERGE_TILE_ROWS = 64
+
+#: How far from mid-grey (0.5) a pixel can be and still weight much
+#:  in the merge of an exposure bracketing
+MERGE_WELL_EXPOSED_SIGMA = 0.2
+
+#: Radius of the blur of the merge weights (in pixels)
+MERGE_WEIGHT_RADIUS = 8
+
+#: JPEG quality of the merged picture, before the overlays are added
+MERGE_JPEG_QUALITY = 95
+
 #: White balancing modes from picamera
 PICAMERA_AWB_MODES = [
     'off',
@@ -164,6 +403,16 @@ CAMERA_DEFAULTS = {
     # These two are "experimental" and mostly untested,
     # don't use them unless really necessary
     'use_low_light_algorithm': True,
+    'low_light_algorithm': 'proportional',  # or 'secant'
+    'metering_mode': 'average',  # or 'centre', 'region', 'median'
+    'metering_region': None,  # [left, top, right, bottom], from 0 to 1
+    'sensor_mode': 'auto',  # or a number, see the picamera docs
+    'burst_frames': 1,  # How many pictures to shoot in each run
+    'burst_interval': 10,  # Seconds between the pictures of a burst
+    'latitude': None,  # Position of the camera, in degrees: north
+    'longitude': None,  #  and east are positive. See `solar.light_phase()`
+    'stacking_frames': 1,  # Pictures averaged at night instead of a single long exposure
+    'bracketing': None,  # Exposures to merge, in stops from the automatic one, like [-2, 0, 2]
     'let_awb_settle_in_dark': False,
 }
 
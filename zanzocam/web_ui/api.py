@@ -2,7 +2,6 @@ from typing import Dict
 
 import os
 import shutil
-import picamera
 import subprocess
 from flask import abort, flash
 
@@ -173,6 +172,9 @@ def get_preview():
     """
     Makes a new preview with raspistill and returns the new image.
     """
+    # Imported here to avoid loading picamera in every uwsgi worker
+    import picamera
+
     with picamera.PiCamera() as camera:
         camera.resolution = (640, 480)
         camera.capture(str(PREVIEW_PICTURE))
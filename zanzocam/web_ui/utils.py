@@ -7,7 +7,6 @@ import logging
 import subprocess
 from pathlib import Path
 from textwrap import dedent
-from flask import send_from_directory
 from zanzocam.webcam.utils import log_error
 
 
@@ -167,6 +166,10 @@ def send_from_path(path: Path):
     """
     Same as Flask's send_from_directory(), but accepts a full path
     """
+    # Imported here: this module is also used by z-webcam,
+    # which doesn't need Flask and would take long to import it
+    from flask import send_from_directory
+
     path_parts = str(path).split("/")
     dir = "/".join(path_parts[:-1])
     name = path_parts[-1]
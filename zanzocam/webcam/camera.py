@@ -1,21 +1,89 @@
-from typing import Any, Dict, Tuple, Optional
+from typing import Any, Callable, Dict, List, Tuple, Optional
 
 import os
 import math
 import piexif
-from time import sleep
+import datetime
+from time import sleep, monotonic
+from contextlib import contextmanager
 from pathlib import Path
 from fractions import Fraction
 from PIL import Image, ImageStat
 
-try:
-    from picamera import PiCamera
-except ImportError:  # On the CI picamera is not installed
-    from tests.conftest import MockPiCamera as PiCamera
-
 from zanzocam.constants import *
-from zanzocam.webcam.utils import log, log_error
-from zanzocam.webcam.overlays import Overlay
+from zanzocam.webcam.utils import log, log_error, time_left
+from zanzocam.webcam.metrics import span
+from zanzocam.webcam import exposure, solar, compositing
+from zanzocam.webcam.overlays import Overlay, render_overlays
+
+
+#: The PiCamera class. It's imported on first use by `load_picamera()`,
+#:  because picamera is slow to import and not every run needs it.
+#:  The tests replace it with a mock.
+PiCamera = None
+
+#: Framerate range that allows the long exposures of the low light pictures.
+#:  The lowest framerate bounds the longest shutter speed.
+LOW_LIGHT_FRAMERATE_RANGE = (Fraction(1, 10), Fraction(15, 1))
+
+#: Sensor mode used when no cheaper one fits: full resolution.
+#:  Sensor mode 1 has a blue halo on v2!
+DEFAULT_SENSOR_MODE = 3
+
+#: The sensor modes that see the full field of view in 4:3, by camera
+#:  revision, as listed in the picamera docs: readout size and framerate range.
+#:  Modes that crop the field of view are left out, and so is mode 1 of
+#:  the v2 module (imx219), which has a blue halo anyway.
+SENSOR_MODES = {
+    "ov5647": {  # v1
+        2: ((2592, 1944), (Fraction(1, 1), Fraction(15, 1))),
+        3: ((2592, 1944), (Fraction(1, 6), Fraction(1, 1))),
+        4: ((1296, 972), (Fraction(1, 1), Fraction(42, 1))),
+        6: ((640, 480), (Fraction(421, 10), Fraction(60, 1))),
+        7: ((640, 480), (Fraction(601, 10), Fraction(90, 1))),
+    },
+    "imx219": {  # v2
+        2: ((3280, 2464), (Fraction(1, 10), Fraction(15, 1))),
+        3: ((3280, 2464), (Fraction(1, 10), Fraction(15, 1))),
+        4: ((1640, 1232), (Fraction(1, 10), Fraction(40, 1))),
+    },
+    "imx477": {  # HQ
+        2: ((2028, 1520), (Fraction(1, 10), Fraction(50, 1))),
+        3: ((4056, 3040), (Fraction(1, 200), Fraction(10, 1))),
+    },
+}
+
+
+def plan_sensor_mode(revision: Optional[str], width: int, height: int,
+                     min_framerate: Fraction) -> int:
+    """
+    Returns the sensor mode with the smallest readout that is still at least
+    `width` x `height` and can go as low as `min_framerate`, which bounds
+    the longest exposure. The camera scales the readout to the final resolution.
+    Smaller readouts (binned modes) are faster to capture and use less memory.
+
+    Returns `DEFAULT_SENSOR_MODE` for unknown revisions, or if no mode fits.
+    """
+    candidates = [
+        (size[0] * size[1], -mode, mode)
+        for mode, (size, framerate_range) in SENSOR_MODES.get(revision, {}).items()
+        if size[0] >= width and size[1] >= height and framerate_range[0] <= min_framerate
+    ]
+    if not candidates:
+        return DEFAULT_SENSOR_MODE
+    # Smallest readout first, then the highest mode (3 rather than 2 on equal sizes)
+    return min(candidates)[2]
+
+
+def load_picamera():
+    """
+    Returns the PiCamera class, importing picamera if necessary.
+    """
+    global PiCamera
+    if PiCamera is None:
+        from picamera import PiCamera as picamera_class
+        PiCamera = picamera_class
+    return PiCamera
 
 
 
@@ -51,6 +119,9 @@ class Camera:
         self.temp_photo_path = DATA_PATH / ('.temp_image.' + self.extension)
         self.processed_image_path = DATA_PATH / ('.final_image.' + self.extension)
 
+        # Reused by all the metering captures (see `_meter_luminance()`)
+        self._metering_buffer = None
+
 
     def __getattr__(self, name):
         """ 
@@ -60,14 +131,96 @@ class Camera:
         return self.defaults.get(name, None)
         
 
-    def take_picture(self) -> None:
+    def take_picture(self, before_processing: Optional[Callable[[], None]] = None) -> None:
         """
         Takes the picture and renders the elements on it.
+        If given, `before_processing` is called after the picture is shot
+        and before the overlays are rendered: use it to wait for data that
+        is still being downloaded, like the overlays.
         """
         log("Shooting picture.")
         self._shoot_picture()
+        if before_processing:
+            before_processing()
         log("Processing picture.")
-        self._process_picture()
+        with span("processing"):
+            self._process_picture()
+
+
+    def is_burst(self) -> bool:
+        """
+        Returns True if the configuration asks for a burst of pictures
+        (see `take_burst()`) rather than a single one.
+        """
+        try:
+            return int(self.burst_frames) > 1
+        except (TypeError, ValueError):
+            log(f"WARNING! Invalid number of pictures for the burst: '{self.burst_frames}'. "
+                f"Taking a single picture.")
+            return False
+
+
+    def take_burst(self, on_frame: Callable[[Path, datetime.datetime], None],
+                   before_processing: Optional[Callable[[], None]] = None) -> int:
+        """
+        Shoots `burst_frames` pictures, one every `burst_interval` seconds,
+        keeping the camera open. The pictures come from the video port, which
+        is much faster, in automatic exposure: the low light algorithm is not used.
+
+        Every picture is processed like in `take_picture()` and then given to
+        `on_frame`, with the time it was shot: the file belongs to `on_frame`.
+        `before_processing` is called once, before the first picture is processed.
+        Stops earlier if the run must end before the next picture.
+
+        Returns the number of pictures shot.
+        """
+        frames = int(self.burst_frames)
+        interval = float(self.burst_interval)
+        log(f"Shooting a burst of {frames} pictures, one every {interval}s.")
+
+        shot = 0
+        with self._prepare_camera_object() as camera:
+            log(f"Camera warm-up (up to {CAMERA_WARM_UP_TIME}s)...")
+            with span("warm-up"):
+                self._wait_until_settled(camera, CAMERA_WARM_UP_TIME)
+
+            start = monotonic()
+            captures = camera.capture_continuous(str(self.temp_photo_path), use_video_port=True)
+            while shot < frames:
+                with span("capture"):
+                    next(captures)
+                timestamp = datetime.datetime.now()
+                shot += 1
+
+                if shot == 1 and before_processing:
+                    before_processing()
+                with span("processing"):
+                    self._process_picture()
+
+                # The next picture would overwrite this one
+                frame_path = DATA_PATH / f".burst_{shot}.{self.extension}"
+                try:
+                    os.replace(self.processed_image_path, frame_path)
+                except Exception as e:
+                    log_error(f"Picture {shot} of the burst could not be processed. Skipping it.", e)
+                else:
+                    on_frame(frame_path, timestamp)
+
+                if shot == frames:
+                    break
+                next_frame_in = start + shot * interval - monotonic()
+                remaining_time = time_left()
+                if remaining_time is not None and remaining_time < next_frame_in + BURST_FRAME_MARGIN:
+                    log(f"WARNING! Not enough time left in this run for more pictures: "
+                        f"{frames - shot} pictures of the burst won't be shot.")
+                    break
+                if next_frame_in < 0:
+                    log(f"WARNING! The burst is {-next_frame_in:.1f}s behind schedule.")
+                else:
+                    sleep(next_frame_in)
+
+        log(f"Burst completed: {shot} pictures shot.")
+        return shot
 
 
     def _prepare_camera_object(self, expanded_framerate_range: bool = False) -> int:
@@ -76,10 +229,11 @@ class Camera:
         if `expanded_framerate_range` is given, framerate_range is set to (1/10, 90).
         Use this function in `with` blocks only, or remember to close the returned `camera` object!
         """
+        camera_class = load_picamera()
         if expanded_framerate_range:
-            camera = PiCamera(sensor_mode=3, framerate_range=(Fraction(1, 10), Fraction(15, 1)))
+            camera = camera_class(sensor_mode=DEFAULT_SENSOR_MODE, framerate_range=LOW_LIGHT_FRAMERATE_RANGE)
         else:
-            camera = PiCamera(sensor_mode=3)  # sensor_mode 1 has a blue halo on v2!
+            camera = camera_class(sensor_mode=DEFAULT_SENSOR_MODE)
 
         if int(self.width) > camera.MAX_RESOLUTION.width:
             log(f"WARNING! The requested image width ({self.width}) "
@@ -93,6 +247,25 @@ class Camera:
                 f"Using the maximum height resolution instead.")
             self.height = camera.MAX_RESOLUTION.height
 
+        # The revision is known only once the camera is open: switch mode afterwards.
+        # Sessions that may go into low light need the long exposures from the start,
+        # because they're reconfigured in place (see `_low_light_session()`).
+        sensor_mode = self.sensor_mode
+        if sensor_mode != "auto":
+            try:
+                sensor_mode = int(sensor_mode)
+            except (TypeError, ValueError):
+                log(f"WARNING! Invalid sensor mode: '{sensor_mode}'. Choosing it automatically.")
+                sensor_mode = "auto"
+        if sensor_mode == "auto":
+            min_framerate = DAYLIGHT_MIN_FRAMERATE
+            if expanded_framerate_range or self.use_low_light_algorithm:
+                min_framerate = LOW_LIGHT_FRAMERATE_RANGE[0]
+            sensor_mode = plan_sensor_mode(camera.revision, int(self.width), int(self.height), min_framerate)
+        if sensor_mode != DEFAULT_SENSOR_MODE:
+            log(f"Using sensor mode {sensor_mode} for a {self.width}x{self.height} picture.")
+            camera.sensor_mode = sensor_mode
+
         camera.resolution = (int(self.width), int(self.height))
         camera.vflip = self.ver_flip
         camera.hflip = self.hor_flip
@@ -107,7 +280,8 @@ class Camera:
         taking care of the logging too.
         """
         log("Taking picture...")
-        camera.capture(str(self.temp_photo_path))
+        with span("capture"):
+            camera.capture(str(self.temp_photo_path))
         exposure_speed = f"{camera.exposure_speed/10**6:.4f}" if camera.exposure_speed else '[auto]'
         shutter_speed = f"{camera.shutter_speed/10**6:.4f}" if camera.shutter_speed else '[auto]'
         iso = camera.iso if camera.iso else '[auto]'
@@ -120,57 +294,249 @@ class Camera:
         Shoots the picture using PiCamera. If the luminance is found  
         to be too low, uses an iterative algorithm to adjusts the 
         shutter speed of the camera value and tries again.
+
+        The camera is opened only once: the low light pictures reconfigure
+        it in place, which is much faster than opening and warming it up again.
+        If the position of the camera is given, the first picture and the
+        luminance check are skipped when the sun is high or well below the horizon.
         """
-        with self._prepare_camera_object() as camera:
-            log(f"Camera warm-up ({CAMERA_WARM_UP_TIME}s)...")
-            sleep(CAMERA_WARM_UP_TIME)
-            self._camera_capture(camera)
-
-        # If the low light algorithm is disabled, return
-        if not self.use_low_light_algorithm:
-            log(f"Luminance won't be checked, because "
-                f"`use_low_light_algorithm = {self.use_low_light_algorithm}`.")
-            return
+        # Where the position of the camera is known, the sun tells whether it's
+        # day or night: the picture in automatic mode is needed only at twilight
+        phase = self._solar_phase() if self.use_low_light_algorithm else None
 
-        # Test the luminance: if the picture is bright enough, return
-        initial_luminance = self._luminance_from_path(self.temp_photo_path)
-        if initial_luminance >= MINIMUM_DAYLIGHT_LUMINANCE:
-            log(f"Daylight luminance detected: {initial_luminance:.2f} "
-                f"(lower bound is {MINIMUM_DAYLIGHT_LUMINANCE}).")
-            return
+        with self._prepare_camera_object(expanded_framerate_range=(phase == "night")) as camera:
 
-        # We're in low light conditions and allowed to try correcting it.
-        # Calculate new shutter speed with the low light algorithm
-        new_luminance, shutter_speed, iso, attempts = self._low_light_search(initial_luminance)
+            if phase == "night":
+                # The low light algorithm reconfigures the camera anyway
+                initial_luminance = 0
+            else:
+                log(f"Camera warm-up (up to {CAMERA_WARM_UP_TIME}s)...")
+                with span("warm-up"):
+                    self._wait_until_settled(camera, CAMERA_WARM_UP_TIME)
+                # Even if the warm-up didn't end early, the gains are the best guess so far,
+                # unless the camera still reads 0
+                awb_gains = camera.awb_gains if self.awb_mode == "auto" else None
+                if not awb_gains or not all(awb_gains):
+                    awb_gains = None
+                self._camera_capture(camera)
 
-        # If we're good without one final picture with the long wait for the AWB, return here
-        if not self.let_awb_settle_in_dark:
-            log(f"AWB adjusted picture not required")
-            return
+                # If the low light algorithm is disabled, return
+                if not self.use_low_light_algorithm:
+                    log(f"Luminance won't be checked, because "
+                        f"`use_low_light_algorithm = {self.use_low_light_algorithm}`.")
+                    if self.bracketing:
+                        self._merge_bracketing(camera)
+                    return
+
+                if phase == "day":
+                    if awb_gains:
+                        exposure.record_awb_gains(awb_gains)
+                    if self.bracketing:
+                        self._merge_bracketing(camera)
+                    return
+
+                # Test the luminance: if the picture is bright enough, return
+                initial_luminance = self._picture_luminance(self.temp_photo_path)
 
-        # Once the correct shutter speed has been found, shoot again a picture with the correct params.
-        log(f"Taking AWB stabilized picture with the final parameters "
-            f"(shutter speed: {shutter_speed/10**6:.2f}s, ISO: {iso})")
+                # The white balance is reliable only with enough light: remember it for the dark
+                if awb_gains and initial_luminance >= MINIMUM_NIGHT_LUMINANCE:
+                    exposure.record_awb_gains(awb_gains)
+
+                if initial_luminance >= MINIMUM_DAYLIGHT_LUMINANCE:
+                    log(f"Daylight luminance detected: {initial_luminance:.2f} "
+                        f"(lower bound is {MINIMUM_DAYLIGHT_LUMINANCE}).")
+                    if self.bracketing:
+                        self._merge_bracketing(camera)
+                    return
+
+            # We're in low light conditions and allowed to try correcting it.
+            # Calculate new shutter speed with the low light algorithm
+            search = self._low_light_search
+            if self.low_light_algorithm == "secant":
+                search = self._secant_search
+            elif self.low_light_algorithm != "proportional":
+                log(f"WARNING! Unknown low light algorithm: '{self.low_light_algorithm}'. "
+                    f"Using the proportional one.")
+
+            # The white balance of the previous runs at this time of the day
+            # spares the long wait for the AWB to settle in the dark
+            cached_awb_gains = None
+            if self.let_awb_settle_in_dark and self.awb_mode == "auto":
+                cached_awb_gains = exposure.predict_awb_gains()
+            if cached_awb_gains:
+                log(f"Using the white balance of the previous runs at this time "
+                    f"(red gain: {cached_awb_gains[0]:.2f}, blue gain: {cached_awb_gains[1]:.2f}).")
+                camera.awb_mode = "off"
+                camera.awb_gains = cached_awb_gains
+
+            new_luminance, shutter_speed, iso, attempts = search(
+                initial_luminance, camera, picture_taken=(phase != "night"))
+
+            # If we're good without one final picture with the long wait for the AWB, return here
+            if not self.let_awb_settle_in_dark:
+                log(f"AWB adjusted picture not required")
+                return
+            if cached_awb_gains:
+                log(f"AWB adjusted picture not required: the white balance "
+                    f"of the previous runs was used.")
+                return
+
+            # The AWB stabilized picture takes long: skip it if the run must end before
+            timeout = (shutter_speed/10**6) * 7 + 5
+            if not self._has_time_for(timeout, shutter_speed):
+                log("WARNING! Not enough time left in this run for the AWB adjusted picture. "
+                    "Keeping the last picture taken.")
+                return
+
+            # Once the correct shutter speed has been found, shoot again a picture with the correct params.
+            log(f"Taking AWB stabilized picture with the final parameters "
+                f"(shutter speed: {shutter_speed/10**6:.2f}s, ISO: {iso})")
 
-        with self._prepare_camera_object(expanded_framerate_range=True) as camera:
             camera.shutter_speed = shutter_speed
             camera.iso = iso
-            
-            timeout = (shutter_speed/10**6) * 7 + 5
-            log(f"Adjusting white balance: will take {timeout:.1f} seconds...")
-            sleep(timeout)
+            # The low light search locked the gains: let them settle again with the AWB
+            camera.exposure_mode = "auto"
+
+            log(f"Adjusting white balance: will take up to {timeout:.1f} seconds...")
+            with span("white balance"):
+                self._wait_until_settled(camera, timeout)
             camera.exposure_mode = "off"
 
-            self._camera_capture(camera)
+            self._low_light_capture(camera)
 
-        final_luminance = self._luminance_from_path(str(self.temp_photo_path))
+        final_luminance = self._picture_luminance(self.temp_photo_path)
         log(f"Final luminance: {final_luminance:.2f}.")
 
 
-    def _low_light_search(self, initial_luminance: int) -> Tuple[float, int, int, int]:
+    def _solar_phase(self) -> Optional[str]:
         """
-        Tries to find the correct shutter speed in low-light conditions.
-        Returns the final luminance, the shutter speed, and the number of attempts done, in this order.
+        Returns `day`, `night` or `twilight` according to the position of the
+        sun (see `solar.light_phase()`), or None if the position of the
+        camera is not given or is invalid.
+        """
+        if self.latitude is None or self.longitude is None:
+            return None
+        try:
+            latitude, longitude = float(self.latitude), float(self.longitude)
+            if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+                raise ValueError("latitude or longitude out of range")
+            elevation = solar.solar_elevation(latitude, longitude, datetime.datetime.now())
+        except Exception as e:
+            log_error(f"Invalid position of the camera: latitude '{self.latitude}', "
+                      f"longitude '{self.longitude}'. Luminance will be checked.", e)
+            return None
+
+        phase = solar.light_phase(elevation)
+        log(f"The sun is {abs(elevation):.1f} degrees {'above' if elevation >= 0 else 'below'} "
+            f"the horizon: {phase}.")
+        return phase
+
+
+    def _merge_bracketing(self, camera) -> bool:
+        """
+        Shoots one picture for each exposure of `bracketing`, given in stops
+        from the automatic exposure, and merges them into the temporary
+        picture (see `merging.fuse_exposures()`). Gains and white balance
+        are locked: only the shutter speed changes between the pictures.
+
+        Keeps the picture already taken if the bracketing is invalid, if
+        there's no time for at least two pictures, or if the merge fails.
+        Returns True if the pictures were merged, False otherwise.
+        """
+        try:
+            stops = sorted(set(float(stop) for stop in self.bracketing))
+        except (TypeError, ValueError):
+            stops = []
+        if len(stops) < 2:
+            log(f"WARNING! Invalid bracketing: '{self.bracketing}'. It must be "
+                f"a list of at least two exposures, in stops. Keeping a single picture.")
+            return False
+
+        base_speed = camera.exposure_speed
+        if not base_speed:
+            log("WARNING! The camera doesn't report its exposure speed: "
+                "can't shoot the bracketing. Keeping a single picture.")
+            return False
+
+        # The lowest framerate bounds the longest shutter speed
+        try:
+            longest_speed = int(10**6 / camera.framerate_range.low)
+        except Exception:
+            longest_speed = MAX_SHUTTER_SPEED
+
+        camera.exposure_mode = "off"
+        if self.awb_mode == "auto" and camera.awb_gains:
+            gains = camera.awb_gains
+            camera.awb_mode = "off"
+            camera.awb_gains = gains
+
+        log(f"Shooting a bracketing of {len(stops)} pictures "
+            f"({', '.join(f'{stop:+g}' for stop in stops)} stops).")
+        paths = []
+        try:
+            for stop in stops:
+                shutter_speed = int(min(max(base_speed * 2 ** stop, 1), longest_speed))
+                if not self._has_time_for(0, shutter_speed):
+                    log("WARNING! Not enough time left in this run for the whole bracketing.")
+                    break
+                camera.shutter_speed = shutter_speed
+                path = DATA_PATH / f".bracket_{len(paths)}.{self.extension}"
+                with span("capture"):
+                    camera.capture(str(path))
+                paths.append(path)
+
+            if len(paths) < 2:
+                log("WARNING! Less than two pictures of the bracketing were shot. "
+                    "Keeping a single picture.")
+                return False
+
+            log(f"Merging {len(paths)} exposures...")
+            from zanzocam.webcam import merging
+            with span("merge"):
+                # The EXIF data comes from the exposure closest to the automatic one
+                reference = paths[min(range(len(paths)), key=lambda index: abs(stops[index]))]
+                merging.fuse_exposures(paths, self.temp_photo_path, exif_path=reference)
+            log("Exposures merged.")
+            return True
+
+        except Exception as e:
+            log_error("The bracketing could not be merged. Keeping a single picture.", e)
+            return False
+
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+    @contextmanager
+    def _low_light_session(self, camera=None, iso: int = INITIAL_LOW_LIGHT_ISO):
+        """
+        Yields a camera ready for long exposures at the given ISO.
+        If `camera` is given, it's reconfigured in place and left open,
+        otherwise a new camera is opened, warmed up, and closed on exit.
+        """
+        if camera is None:
+            with self._prepare_camera_object(expanded_framerate_range=True) as camera:
+                camera.iso = iso
+                log(f"Camera warm-up (up to {CAMERA_WARM_UP_TIME}s)...")
+                with span("warm-up"):
+                    self._wait_until_settled(camera, CAMERA_WARM_UP_TIME)
+                yield camera
+            return
+
+        camera.framerate_range = LOW_LIGHT_FRAMERATE_RANGE
+        camera.iso = iso
+        log(f"Reconfiguring the camera for low light (up to {CAMERA_RECONFIGURE_TIME}s)...")
+        with span("reconfigure"):
+            self._wait_until_settled(camera, CAMERA_RECONFIGURE_TIME)
+        yield camera
+
+
+    def _low_light_start(self, initial_luminance: int) -> Tuple[float, int, int]:
+        """
+        Logs the start of a low light search and chooses where to start from.
+        Returns the target luminance, the initial shutter speed and the initial ISO, in this order.
         """
         target_luminance = self._compute_target_luminance(initial_luminance)        
         log(f"Low light detected: {initial_luminance:.2f} "
@@ -191,25 +557,45 @@ class Camera:
             shutter_speed = NO_LUMINANCE_SHUTTER_SPEED
         else:
             shutter_speed = MIN_SHUTTER_SPEED
-    
+        iso = INITIAL_LOW_LIGHT_ISO
+
+        # The previous runs at this time of the day are the best guess
+        prediction = exposure.predict_exposure()
+        if prediction:
+            shutter_speed, iso = prediction
+            log(f"Starting from the exposure found in the previous runs at this time: "
+                f"shutter speed {shutter_speed/10**6:.2f}s, ISO {iso}")
+        return target_luminance, shutter_speed, iso
+
+
+    def _low_light_search(self, initial_luminance: int, camera=None, 
+                          picture_taken: bool = True) -> Tuple[float, int, int, int]:
+        """
+        Tries to find the correct shutter speed in low-light conditions.
+        Reuses `camera` if given (see `_low_light_session()`).
+        `picture_taken` tells whether a picture was taken in automatic mode
+        (see `_capture_at_deadline()`).
+        Returns the final luminance, the shutter speed, the ISO and the number of attempts done, in this order.
+        """
+        target_luminance, shutter_speed, iso = self._low_light_start(initial_luminance)
         new_luminance = initial_luminance
 
         # Note that we're looping within this block for a reason!
         # Re-initializing the camera for every picture would take a lot of
         # time and require a warm-up of at least 5 seconds every time.
-        with self._prepare_camera_object(expanded_framerate_range=True) as camera:
-
-            camera.iso = INITIAL_LOW_LIGHT_ISO
-            log(f"Camera warm-up ({CAMERA_WARM_UP_TIME}s)...")
-            sleep(CAMERA_WARM_UP_TIME)
+        with self._low_light_session(camera, iso) as camera:
 
             for attempt in range(1, 10):
+
+                # Don't start a picture that would end after the run deadline
+                if not self._has_time_for(0, shutter_speed):
+                    self._capture_at_deadline(camera, shutter_speed, picture_taken)
+                    return new_luminance, camera.shutter_speed or shutter_speed, camera.iso, attempt
                 
-                # Take the picture & check the luminance
+                # Meter the luminance: the full size picture is taken only at the end
                 camera.shutter_speed = shutter_speed          
                 camera.exposure_mode = "off"
-                self._camera_capture(camera)
-                new_luminance = self._luminance_from_path(self.temp_photo_path)
+                new_luminance = self._meter_luminance(camera)
 
                 # In rare cases, the camera might return pitch black images for no good reason.
                 # So if the luminance is 0, just retry.
@@ -232,6 +618,8 @@ class Camera:
                         if camera.iso >= 800:
                             log(f"WARNING! ISO is at 800 and shutter speed is at max "
                                 f"({MAX_SHUTTER_SPEED/10**6:.2f}). Cannot increase further.")
+                            exposure.record_exposure(shutter_speed, camera.iso, new_luminance, attempt)
+                            self._low_light_capture(camera)
                             return new_luminance, shutter_speed, camera.iso, attempt
 
                         log(f"Not allowed to raise the shutter speed further. "
@@ -242,6 +630,8 @@ class Camera:
                 # Otherwise return the match
                 else:
                     log(f"# {attempt}: OK! Luminance achieved: {new_luminance:.2f}.")
+                    exposure.record_exposure(shutter_speed, camera.iso, new_luminance, attempt)
+                    self._low_light_capture(camera)
                     return new_luminance, shutter_speed, camera.iso, attempt
 
                 # Compute the shutter speed and loop
@@ -252,8 +642,303 @@ class Camera:
                       f"Returning the last values "
                       f"(shutter speed: {shutter_speed}, "
                       f"luminance: {new_luminance}, iso: {camera.iso}).")
+            self._low_light_capture(camera)
             return new_luminance, shutter_speed, camera.iso, attempt
         
+    def _secant_search(self, initial_luminance: int, camera=None,
+                       picture_taken: bool = True) -> Tuple[float, int, int, int]:
+        """
+        Tries to find the correct exposure in low-light conditions, adjusting
+        shutter speed and ISO together (see `_split_exposure()`).
+
+        The logarithms of the exposure and of the luminance are roughly linear:
+        every step is a secant step over the last two pictures, or uses 
+        `LOW_LIGHT_RESPONSE_SLOPE` when there is only one. Steps that would
+        leave the range known to contain the target are replaced by a bisection
+        of that range. Black and saturated pictures only narrow the range.
+
+        Reuses `camera` if given (see `_low_light_session()`). `picture_taken`
+        tells whether a picture was taken in automatic mode (see `_capture_at_deadline()`).
+        Returns the final luminance, the shutter speed, the ISO and the number of attempts done, in this order.
+        """
+        target_luminance, shutter_speed, iso = self._low_light_start(initial_luminance)
+        log_target = math.log(target_luminance)
+
+        min_exposure = math.log(MIN_LOW_LIGHT_EXPOSURE)
+        max_exposure = math.log(MAX_SHUTTER_SPEED * MAX_LOW_LIGHT_ISO)
+        exposure_value = min(max(math.log(shutter_speed * iso), min_exposure), max_exposure)
+
+        too_dark = None    # Highest exposure known to be too dark
+        too_bright = None  # Lowest exposure known to be too bright
+        previous = None    # Last (exposure, luminance) pair, in log scale
+        new_luminance = initial_luminance
+
+        with self._low_light_session(camera, iso) as camera:
+
+            for attempt in range(1, 10):
+                shutter_speed, iso = self._split_exposure(math.exp(exposure_value))
+
+                # Don't start a picture that would end after the run deadline
+                if not self._has_time_for(0, shutter_speed):
+                    self._capture_at_deadline(camera, shutter_speed, picture_taken)
+                    return new_luminance, camera.shutter_speed or shutter_speed, camera.iso, attempt
+
+                camera.iso = iso
+                camera.shutter_speed = shutter_speed
+                camera.exposure_mode = "off"
+                new_luminance = self._meter_luminance(camera)
+                settings = f"(shutter speed: {shutter_speed/10**6:.2f}s, ISO: {iso})"
+
+                if abs(new_luminance - target_luminance) <= TARGET_LUMINOSITY_MARGIN:
+                    log(f"# {attempt}: OK! Luminance achieved: {new_luminance:.2f} {settings}.")
+                    exposure.record_exposure(shutter_speed, iso, new_luminance, attempt)
+                    self._low_light_capture(camera)
+                    return new_luminance, shutter_speed, iso, attempt
+
+                # Black and saturated pictures say nothing about the response
+                # of the sensor: jump by a fixed step instead
+                if new_luminance <= 0.001 or new_luminance >= SATURATED_LUMINANCE:
+                    direction = 1 if new_luminance <= 0.001 else -1
+                    log(f"# {attempt}: {'black' if direction > 0 else 'saturated'} picture "
+                        f"{settings}. {'Up' if direction > 0 else 'Down'}!")
+                    next_value = exposure_value + direction * math.log(LOW_LIGHT_BLIND_STEP)
+                    previous = None
+
+                else:
+                    direction = 1 if new_luminance < target_luminance else -1
+                    log(f"# {attempt}: {'dark' if direction > 0 else 'bright'}. "
+                        f"Luminance achieved: {new_luminance:.2f} {settings}. "
+                        f"{'Up' if direction > 0 else 'Down'}!")
+                    current = (exposure_value, math.log(new_luminance))
+                    slope = LOW_LIGHT_RESPONSE_SLOPE
+                    if previous and previous[0] != current[0]:
+                        secant = (current[1] - previous[1]) / (current[0] - previous[0])
+                        if secant > 0:
+                            slope = secant
+                    next_value = exposure_value + (log_target - current[1]) / slope
+                    previous = current
+
+                if direction > 0:
+                    too_dark = exposure_value
+                else:
+                    too_bright = exposure_value
+
+                # Stay within the range that contains the target
+                if too_dark is not None and too_bright is not None and not too_dark < next_value < too_bright:
+                    next_value = (too_dark + too_bright) / 2
+                next_value = min(max(next_value, min_exposure), max_exposure)
+
+                if next_value == exposure_value:
+                    log(f"WARNING! The exposure can't be {'increased' if direction > 0 else 'decreased'} "
+                        f"further {settings}.")
+                    exposure.record_exposure(shutter_speed, iso, new_luminance, attempt)
+                    self._low_light_capture(camera)
+                    return new_luminance, shutter_speed, iso, attempt
+
+                exposure_value = next_value
+
+            # Exit condition - 10 iterations
+            log_error(f"The low light algorithm failed! "
+                      f"Returning the last values "
+                      f"(shutter speed: {shutter_speed}, "
+                      f"luminance: {new_luminance}, iso: {iso}).")
+            self._low_light_capture(camera)
+            return new_luminance, shutter_speed, iso, attempt
+
+
+    def _capture_at_deadline(self, camera, shutter_speed: int, picture_taken: bool) -> None:
+        """
+        Ends a low light search stopped by the run deadline. Keeps the picture
+        taken in automatic mode if there is one, otherwise takes the final
+        picture anyway, with the last exposure tried, or with `shutter_speed`
+        if none was: a late picture is better than no picture at all.
+        """
+        if picture_taken:
+            log(f"WARNING! Not enough time left in this run for another picture. "
+                f"Keeping the picture taken in automatic mode.")
+            return
+
+        log(f"WARNING! Not enough time left in this run for another picture. "
+            f"Taking the final picture with the best exposure found so far.")
+        camera.shutter_speed = camera.shutter_speed or shutter_speed
+        camera.exposure_mode = "off"
+        self._low_light_capture(camera)
+
+
+    def _low_light_capture(self, camera) -> None:
+        """
+        Takes the final picture of the low light algorithm with the current
+        settings: with `stacking_frames` above 1, long exposures are replaced
+        by a stack of pictures (see `_stack_frames()`).
+        """
+        try:
+            frames = int(self.stacking_frames)
+        except (TypeError, ValueError):
+            log(f"WARNING! Invalid number of pictures to stack: '{self.stacking_frames}'. "
+                f"Taking a single picture.")
+            frames = 1
+        if frames > STACKING_MAX_FRAMES:
+            log(f"WARNING! Can't stack more than {STACKING_MAX_FRAMES} pictures. "
+                f"Stacking {STACKING_MAX_FRAMES} pictures instead of {frames}.")
+            frames = STACKING_MAX_FRAMES
+
+        if frames > 1 and (camera.shutter_speed or 0) >= STACKING_MIN_SHUTTER_SPEED:
+            try:
+                self._stack_frames(camera, frames)
+                return
+            except Exception as e:
+                log_error("The pictures could not be stacked. Taking a single picture.", e)
+        self._camera_capture(camera)
+
+
+    def _stack_frames(self, camera, frames: int) -> int:
+        """
+        Takes `frames` pictures with the current settings and saves their average
+        as the temporary picture, which divides the random noise by about the
+        square root of `frames`. The pictures come from the video port, where a
+        long exposure takes one frame time instead of the three of a still
+        capture: a stack of three pictures takes as long as a single one.
+
+        The pictures are added to a uint16 sum as they arrive, so only the
+        sum and one unencoded picture are in memory at any time.
+        Stops earlier if the run must end before the next picture.
+        Returns the number of pictures stacked.
+        """
+        import numpy
+
+        width, height = int(self.width), int(self.height)
+        shutter_speed = camera.shutter_speed
+        log(f"Stacking {frames} pictures (shutter speed: {shutter_speed/10**6:.2f}s, "
+            f"ISO: {camera.iso})...")
+
+        # Unencoded captures are padded to multiples of 32 (width) and 16 (height)
+        frame = numpy.empty((-(-height // 16) * 16, -(-width // 32) * 32, 3), dtype=numpy.uint8)
+        total = numpy.zeros((height, width, 3), dtype=numpy.uint16)
+        stacked = 0
+        with span("stack"):
+            while stacked < frames:
+                remaining_time = time_left()
+                if stacked and remaining_time is not None and remaining_time < shutter_speed/10**6 + 1:
+                    log(f"WARNING! Not enough time left in this run for more pictures: "
+                        f"stacking {stacked} pictures instead of {frames}.")
+                    break
+                camera.capture(frame, format="rgb", use_video_port=True)
+                total += frame[:height, :width]
+                stacked += 1
+
+            # Rounded average
+            average = ((total + stacked // 2) // stacked).astype(numpy.uint8)
+
+        # The exposure of each picture goes into the EXIF data, like for a still capture
+        save_arguments = {}
+        try:
+            save_arguments["exif"] = piexif.dump({"Exif": {
+                piexif.ExifIFD.ExposureTime: (int(shutter_speed), 10**6),
+                piexif.ExifIFD.ISOSpeedRatings: int(camera.iso or 0),
+                piexif.ExifIFD.DateTimeOriginal: datetime.datetime.now().strftime("%Y:%m:%d %H:%M:%S"),
+            }})
+        except Exception as e:
+            log_error("Failed to create the EXIF data of the stacked picture. Ignoring them.", e)
+        if not save_arguments.get("exif"):
+            save_arguments = {}
+        Image.fromarray(average).save(str(self.temp_photo_path), **save_arguments)
+
+        log(f"Picture taken ({stacked} pictures stacked).")
+        return stacked
+
+
+    @staticmethod
+    def _split_exposure(exposure_value: float) -> Tuple[int, int]:
+        """
+        Given an exposure (shutter speed in microseconds times ISO), returns
+        the shutter speed and the ISO to obtain it. The ISO stays at
+        `INITIAL_LOW_LIGHT_ISO` and is doubled only if the shutter speed 
+        would exceed `MAX_SHUTTER_SPEED`, up to `MAX_LOW_LIGHT_ISO`.
+        """
+        iso = INITIAL_LOW_LIGHT_ISO
+        while exposure_value / iso > MAX_SHUTTER_SPEED and iso < MAX_LOW_LIGHT_ISO:
+            iso *= 2
+        shutter_speed = int(min(max(exposure_value / iso, 1), MAX_SHUTTER_SPEED))
+        return shutter_speed, iso
+
+
+    @staticmethod
+    def _wait_until_settled(camera, max_wait: float) -> float:
+        """
+        Waits until the automatic exposure and white balance of the camera
+        have converged, that is until gains, exposure speed and AWB gains
+        stay within `CONVERGENCE_TOLERANCE` of the same values for
+        `CONVERGENCE_STABLE_POLLS` polls in a row. Waits `max_wait` seconds
+        at most, or exactly if the camera doesn't report these values.
+
+        The values change at most once per frame: the polls are never
+        closer than the current exposure speed.
+        Returns how long it waited.
+        """
+        start = monotonic()
+        reference = None
+        stable_polls = 0
+
+        while True:
+            elapsed = monotonic() - start
+            if elapsed >= max_wait:
+                if reference:
+                    log(f"WARNING! The camera exposure and white balance did not "
+                        f"settle in {max_wait:.1f}s.")
+                return elapsed
+
+            current = Camera._auto_settings(camera)
+            if not current:
+                sleep(min(CONVERGENCE_POLL_INTERVAL, max_wait - elapsed))
+                continue
+
+            # Compare with the first values of the stable polls, so that
+            # slow drifts are not mistaken for stability
+            if reference and all(
+                abs(value - reference_value) <= CONVERGENCE_TOLERANCE * abs(reference_value)
+                for value, reference_value in zip(current, reference)
+            ):
+                stable_polls += 1
+                if stable_polls >= CONVERGENCE_STABLE_POLLS:
+                    return elapsed
+            else:
+                reference = current
+                stable_polls = 0
+
+            frame_duration = current[2] / 10**6
+            sleep(min(max(CONVERGENCE_POLL_INTERVAL, frame_duration), max_wait - elapsed))
+
+
+    @staticmethod
+    def _auto_settings(camera) -> Optional[List[float]]:
+        """
+        Returns the values set by the automatic exposure and white balance:
+        analog gain, digital gain, exposure speed and the two AWB gains.
+        Returns None if the camera doesn't report them yet (gains and
+        exposure are zero until the firmware starts adjusting them).
+        """
+        try:
+            values = [camera.analog_gain, camera.digital_gain, camera.exposure_speed, *camera.awb_gains]
+            values = [float(value) for value in values]
+        except Exception:
+            return None
+        if not all(values[:3]):
+            return None
+        return values
+
+
+    @staticmethod
+    def _has_time_for(wait: float, shutter_speed: int) -> bool:
+        """
+        Checks whether waiting `wait` seconds and then taking a picture
+        with the given shutter speed fits before the run deadline.
+        A long exposure takes about three frames to be captured.
+        """
+        remaining_time = time_left()
+        if remaining_time is None:
+            return True
+        return remaining_time > wait + (shutter_speed/10**6) * 3 + 1
+
     @staticmethod
     def _low_light_equation(shutter_speed, initial_luminance, target_luminance) -> int:
         """
@@ -281,7 +966,59 @@ class Camera:
         """
         photo = Image.open(str(path))
         r, g, b = ImageStat.Stat(photo).mean
-        return math.sqrt(0.241*(r**2) + 0.691*(g**2) + 0.068*(b**2))
+        return Camera._luminance_from_means(r, g, b)
+
+
+    @staticmethod
+    def _luminance_from_means(r: float, g: float, b: float) -> float:
+        """
+        Given the mean value of each channel, returns the perceived luminance
+        """
+        red_weight, green_weight, blue_weight = LUMINANCE_WEIGHTS
+        return math.sqrt(red_weight*(r**2) + green_weight*(g**2) + blue_weight*(b**2))
+
+
+    def _meter_luminance(self, camera) -> float:
+        """
+        Captures a small unencoded frame in memory and returns its luminance.
+        Nothing is encoded, written to the SD card and decoded again, 
+        unlike with `_camera_capture()` and `_luminance_from_path()`.
+        """
+        import numpy
+
+        width, height = METERING_RESOLUTION
+        if self._metering_buffer is None:
+            self._metering_buffer = numpy.empty((height, width, 3), dtype=numpy.uint8)
+
+        with span("metering"):
+            camera.capture(self._metering_buffer, format="rgb", resize=METERING_RESOLUTION)
+        return self._metered_luminance(self._metering_buffer)
+
+
+    def _picture_luminance(self, path: Path) -> float:
+        """
+        Returns the luminance of a picture according to `metering_mode`.
+        The default mode, `average`, doesn't need numpy (see `_luminance_from_path()`).
+        """
+        if self.metering_mode == "average":
+            return self._luminance_from_path(path)
+        from zanzocam.webcam import metering
+        return self._metered_luminance(metering.load_frame(path))
+
+
+    def _metered_luminance(self, frame) -> float:
+        """
+        Returns the luminance of an RGB frame according to `metering_mode`
+        (see `metering.frame_statistics()`). Falls back to the average
+        luminance if the metering settings are invalid.
+        """
+        from zanzocam.webcam import metering
+        try:
+            return metering.frame_statistics(frame, self.metering_mode, self.metering_region)["luminance"]
+        except ValueError as e:
+            log_error("Invalid metering settings. Using the average luminance.", e)
+            self.metering_mode = "average"
+            return metering.frame_statistics(frame)["luminance"]
 
 
     @staticmethod
@@ -305,93 +1042,50 @@ class Camera:
         """
         # Open and measures the picture
         try:
-            photo = Image.open(str(self.temp_photo_path)).convert("RGBA")
+            photo = Image.open(str(self.temp_photo_path))
+            photo.load()
         except Exception as e:
             log_error("Failed to open the image for editing. "
                       "The photo will have no overlays applied.", e)
             return
 
         # Create the overlay images
-        rendered_overlays = []
-        for position, data in self.overlays.items():
-            try:
-                overlay = Overlay(position, data, 
-                                  photo.width, 
-                                  photo.height, 
-                                  self.date_format, 
-                                  self.time_format)
-                if overlay.rendered_image:
-                    rendered_overlays.append(overlay)
-                    
-            except Exception as e:
-                log_error(f"Something happened processing the overlay {position}. "
-                          f"This overlay will be skipped.", e)
-
-        # Calculate final image size
-        border_top = 0
-        border_bottom = 0
-        for overlay in rendered_overlays:                        
-            # If this overlay is out of the picture, add its height to the 
-            # final image size (above or below)
-            if not overlay.over_the_picture:
-                if overlay.vertical_position == "top":
-                    border_top = max(border_top, overlay.rendered_image.height)
-                else:
-                    border_bottom = max(border_bottom, overlay.rendered_image.height)
-        total_height = photo.height + border_top + border_bottom
-
-        # Generate canvas of the correct size
-        image = Image.new("RGBA", 
-                          (photo.width, total_height),
-                          color=self.background_color)
-
-        # Add the picture on the canvas
-        image.paste(photo, (0, border_top))
-
-        # Add the overlays on the canvas in the right position
-        for overlay in rendered_overlays:
-            if overlay.rendered_image:  # it might be None if it failed along the way
-                x, y = overlay.compute_position(image.width, image.height, border_top, border_bottom)
-                if x + overlay.rendered_image.width > image.width:
-                    log("WARNING! This overlay exceeds the margin of the image itself "
-                        "on the right. It might not be fully visible in the final picture.")
-                if x < 0:
-                    log("WARNING! This overlay exceeds the margin of the image itself "
-                        "on the left. It might not be fully visible in the final picture.")
-                if y < 0:
-                    log("WARNING! This overlay exceeds the margin of the image itself "
-                        "at the top. It might not be fully visible in the final picture.")
-                if y + overlay.rendered_image.height > image.height:
-                    log("WARNING! This overlay exceeds the margin of the image itself "
-                        "at the bottom. It might not be fully visible in the final picture.")
-                # mask is to allow for transparent images
-                image.paste(overlay.rendered_image, (x, y), mask=overlay.rendered_image)  
+        with span("overlays"):
+            rendered_overlays = render_overlays(self.overlays, photo.width, photo.height,
+                                                self.date_format, self.time_format)
+
+        # Lay out the final picture and blend the overlays on it.
+        # JPEGs have no transparency: no need to carry the alpha channel around
+        keep_alpha = self.extension.lower() not in ["jpg", "jpeg"]
+        with span("compositing"):
+            image = compositing.composite(photo, rendered_overlays, self.background_color, keep_alpha)
 
         # Recover and edit the EXIF data
         exif_bytes = None
-        try:
-            exif_dict = piexif.load(photo.info["exif"])
-            exif_dict["0th"][piexif.ImageIFD.Make] = f"ZanzoCam {VERSION} (https://zanzocam.github.io)"
-            exif_dict["0th"][piexif.ImageIFD.Software] = f"ZanzoCam {VERSION} (https://zanzocam.github.io)"
-            exif_dict["0th"][piexif.ImageIFD.ProcessingSoftware] = f"ZanzoCam {VERSION} (https://zanzocam.github.io)"
-            exif_bytes = piexif.dump(exif_dict)
+        with span("exif"):
+            try:
+                exif_dict = piexif.load(photo.info["exif"])
+                exif_dict["0th"][piexif.ImageIFD.Make] = f"ZanzoCam {VERSION} (https://zanzocam.github.io)"
+                exif_dict["0th"][piexif.ImageIFD.Software] = f"ZanzoCam {VERSION} (https://zanzocam.github.io)"
+                exif_dict["0th"][piexif.ImageIFD.ProcessingSoftware] = f"ZanzoCam {VERSION} (https://zanzocam.github.io)"
+                exif_bytes = piexif.dump(exif_dict)
 
-        except Exception as e:
-            # EXIF data is not critical, if something happens just drop them
-            log_error("Failed to copy EXIF information from the photo to the final image. Ignoring them.", e)
+            except Exception as e:
+                # EXIF data is not critical, if something happens just drop them
+                log_error("Failed to copy EXIF information from the photo to the final image. Ignoring them.", e)
         
         # Save the image appropriately
         save_arguments = {}
         if exif_bytes:
             save_arguments['exif'] = exif_bytes
 
-        if self.extension.lower() in ["jpg", "jpeg"]:
-            image = image.convert('RGB')
-            save_arguments['format'] = 'JPEG'
-            save_arguments['subsampling'] = self.jpeg_subsampling
-            save_arguments['quality'] = self.jpeg_quality
+        with span("encode"):
+            if self.extension.lower() in ["jpg", "jpeg"]:
+                save_arguments['format'] = 'JPEG'
+                save_arguments['subsampling'] = self.jpeg_subsampling
+                save_arguments['quality'] = self.jpeg_quality
 
-        image.save(self.processed_image_path, **save_arguments)
+            image.save(self.processed_image_path, **save_arguments)
 
 
     def cleanup_image_files(self) -> bool:
@@ -0,0 +1,104 @@
+from typing import Any, List, Tuple
+
+from PIL import Image
+
+from zanzocam.constants import *
+from zanzocam.webcam.utils import log
+from zanzocam.webcam.overlays import Overlay
+
+
+
+def plan_layout(width: int, height: int, overlays: List[Overlay]) -> Tuple[int, int, List[Tuple[Overlay, int, int]]]:
+    """
+    Lays out the final picture before any pixel is touched: computes
+    the borders needed above and below the picture by the overlays that
+    don't go over it, and the position of each overlay in the final picture.
+    Warns about the overlays that exceed the final picture.
+
+    Returns the height of the top border, the height of the bottom border
+    and the overlays with their x and y position, in this order.
+    """
+    border_top = 0
+    border_bottom = 0
+    for overlay in overlays:
+        # If this overlay is out of the picture, add its height to the
+        # final image size (above or below)
+        if not overlay.over_the_picture:
+            if overlay.vertical_position == "top":
+                border_top = max(border_top, overlay.rendered_image.height)
+            else:
+                border_bottom = max(border_bottom, overlay.rendered_image.height)
+    total_height = height + border_top + border_bottom
+
+    layout = []
+    for overlay in overlays:
+        x, y = overlay.compute_position(width, total_height, border_top, border_bottom)
+        if x + overlay.rendered_image.width > width:
+            log("WARNING! This overlay exceeds the margin of the image itself "
+                "on the right. It might not be fully visible in the final picture.")
+        if x < 0:
+            log("WARNING! This overlay exceeds the margin of the image itself "
+                "on the left. It might not be fully visible in the final picture.")
+        if y < 0:
+            log("WARNING! This overlay exceeds the margin of the image itself "
+                "at the top. It might not be fully visible in the final picture.")
+        if y + overlay.rendered_image.height > total_height:
+            log("WARNING! This overlay exceeds the margin of the image itself "
+                "at the bottom. It might not be fully visible in the final picture.")
+        layout.append((overlay, x, y))
+
+    return border_top, border_bottom, layout
+
+
+
+def composite(photo: Image.Image, overlays: List[Overlay], background_color: Any,
+              keep_alpha: bool = False) -> Image.Image:
+    """
+    Returns the final picture: the photo, with the borders needed by the
+    overlays (see `plan_layout()`), and the overlays blended over it.
+
+    Full size copies of the photo are avoided as much as possible:
+        - without borders, the overlays are blended in place on `photo`;
+        - with borders, a single canvas of the final size is allocated;
+        - each overlay touches only its own bounding box, with
+            `alpha_composite()` on RGBA pictures and a masked paste on RGB
+            ones, which gives the same result over an opaque picture.
+
+    The result is RGB, ready for JPEG, unless `keep_alpha` is set and the
+    picture has transparent parts (like borders of a transparent color).
+    """
+    border_top, border_bottom, layout = plan_layout(photo.width, photo.height, overlays)
+
+    transparent = "A" in photo.getbands() or "transparency" in photo.info
+    mode = "RGBA" if keep_alpha and (transparent or border_top or border_bottom) else "RGB"
+
+    if border_top or border_bottom:
+        # The background color may have an alpha channel even on RGB canvases
+        color = Image.new("RGBA", (1, 1), background_color).convert(mode).getpixel((0, 0))
+        image = Image.new(mode, (photo.width, photo.height + border_top + border_bottom), color)
+        # Pasting converts the photo on the fly
+        image.paste(photo, (0, border_top))
+    else:
+        image = photo if photo.mode == mode else photo.convert(mode)
+
+    for overlay, x, y in layout:
+        rendered = overlay.rendered_image
+        if rendered.mode != "RGBA":
+            rendered = rendered.convert("RGBA")
+
+        # Only the part of the overlay that is within the picture
+        left, top = max(x, 0), max(y, 0)
+        right = min(x + rendered.width, image.width)
+        bottom = min(y + rendered.height, image.height)
+        if left >= right or top >= bottom:
+            continue
+        source = (left - x, top - y, right - x, bottom - y)
+
+        if image.mode == "RGBA":
+            image.alpha_composite(rendered, dest=(left, top), source=source)
+        else:
+            if source != (0, 0, rendered.width, rendered.height):
+                rendered = rendered.crop(source)
+            image.paste(rendered, (left, top), mask=rendered)
+
+    return image
@@ -111,6 +111,42 @@ class Configuration:
         return json.dumps(vars(self), indent=4, default=lambda x: str(x))
 
 
+    def as_dict(self) -> Dict:
+        """
+        Returns the configuration as a dictionary, without the
+        information about the file it was loaded from.
+        """
+        return {k: v for k, v in vars(self).items() if not k.startswith("_")}
+
+
+    def changed_sections(self, data: Dict) -> List[str]:
+        """
+        Compares the configuration with another one, given as a dictionary
+        like the one sent by the server, after decoding its values.
+        A missing section is the same as a null one.
+
+        Returns the names of the sections that differ, sorted.
+        """
+        current = self.as_dict()
+        new = self._decode_json_values(data)
+        return sorted(
+            section for section in set(current) | set(new)
+                if current.get(section) != new.get(section)
+        )
+
+
+    def backup_is_current(self) -> bool:
+        """
+        Tells whether the backup copy of the configuration file
+        holds the same configuration as this one.
+        """
+        try:
+            with open(self._backup_path, 'r') as backup:
+                return not self.changed_sections(json.load(backup))
+        except Exception:
+            return False
+
+
     def get_start_time(self):
         """
         Return either the start time defined, or 00:00
@@ -210,13 +246,8 @@ class Configuration:
             self._backup_path = path
         
         try:
-            backup_vars = {
-                k: v 
-                    for k, v in vars(self).items() 
-                    if not k.startswith("_")    
-                }
             with open(self._backup_path, 'w') as backup:
-                json.dump(backup_vars, backup, indent=4, cls=AllStringEncoder)
+                json.dump(self.as_dict(), backup, indent=4, cls=AllStringEncoder)
 
         except Exception as e:
             log_error("Cannot backup the configuration file! "
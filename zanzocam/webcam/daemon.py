@@ -0,0 +1,295 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import fcntl
+import datetime
+from time import sleep
+
+from zanzocam.constants import *
+from zanzocam.webcam import system
+from zanzocam.webcam.configuration import load_configuration_from_disk
+from zanzocam.webcam.utils import log, log_error
+
+
+#: The daemon lock, while the daemon runs in this process
+_daemon_lock = None
+
+#: Names allowed in the month and day of week crontab fields
+_CRON_MONTHS = {name: number for number, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun",
+     "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+_CRON_WEEKDAYS = {name: number for number, name in enumerate(
+    ["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+#: Crontab macros and the schedule they stand for.
+#: '@reboot' has no trigger time the daemon can wait for.
+_CRON_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+    "@reboot": None,
+}
+
+
+
+def run_daemon(run: Callable[[], None],
+               on_start: Optional[Callable[[], None]] = None) -> None:
+    """
+    Keeps ZanzoCam running as a long-lived process: reads the schedule
+    from the configuration, sleeps until the next trigger and calls `run`
+    in-process, so that imports, camera libraries and so on are loaded
+    only once.
+
+    Exits immediately if another daemon is already running, which allows
+    cron to call `z-webcam --daemon` periodically as a watchdog.
+    Exits as well if the daemon mode is disabled in the configuration.
+
+    `on_start` is called only once the lock is held, so it can safely
+    set up resources that belong to the running daemon, like the logs.
+    """
+    global _daemon_lock
+    lock = acquire_daemon_lock()
+    if not lock:
+        log("Another ZanzoCam daemon is already running. Exiting.")
+        return
+    _daemon_lock = lock
+
+    if on_start:
+        on_start()
+    log("ZanzoCam daemon started.")
+    try:
+        while True:
+            config = load_configuration_from_disk(quiet=True)
+            if not config:
+                log_error("", fatal="the daemon cannot run without "
+                                    "a configuration. Exiting.")
+                return
+
+            time_settings = config.get_system_settings().get("time", {})
+            if not time_settings.get("daemon", False):
+                log("The daemon mode is disabled in the configuration. Exiting.")
+                return
+
+            try:
+                trigger = next_trigger(system.prepare_crontab_string(time_settings))
+            except Exception as e:
+                log_error("Could not find out when the next picture is due.", e)
+                trigger = None
+            if not trigger:
+                log_error("", fatal="no trigger time found in the "
+                                    "configuration. Exiting.")
+                return
+
+            log(f"Next picture at {trigger.strftime('%Y-%m-%d %H:%M')}.")
+            sleep_until(trigger)
+
+            try:
+                run()
+            except Exception as e:
+                log_error("The run failed unexpectedly. "
+                          "The daemon will keep running.", e)
+    finally:
+        _daemon_lock = None
+        lock.close()
+
+
+
+def acquire_daemon_lock():
+    """
+    Takes an exclusive lock on DAEMON_LOCK_FILE, which is released
+    automatically by the OS if the daemon dies.
+    Returns the open lock file, or None if the lock is held by someone else.
+    """
+    lock = open(DAEMON_LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+
+def daemon_running_elsewhere() -> bool:
+    """
+    Returns True if a daemon is running in another process. That daemon
+    owns the camera logs, so they must not be wiped.
+    """
+    if _daemon_lock:
+        return False
+    lock = acquire_daemon_lock()
+    if not lock:
+        return True
+    lock.close()
+    return False
+
+
+
+def sleep_until(trigger: datetime.datetime) -> None:
+    """
+    Sleeps until the given time. Sleeps in chunks of at most
+    DAEMON_MAX_SLEEP seconds so that clock adjustments are noticed.
+    """
+    while True:
+        remaining = (trigger - datetime.datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        sleep(min(remaining, DAEMON_MAX_SLEEP))
+
+
+
+def run_duration_limit(time_settings: Dict, now: Optional[datetime.datetime] = None) -> float:
+    """
+    Returns how long (in seconds) a run started now can last: until the
+    next scheduled run, minus RUN_DEADLINE_MARGIN for the logs upload,
+    and at most RUN_MAX_DURATION.
+    """
+    if not now:
+        now = datetime.datetime.now()
+    try:
+        trigger = next_trigger(system.prepare_crontab_string(time_settings), now)
+    except Exception as e:
+        log_error("Could not find out when the next run is due.", e)
+        trigger = None
+    if not trigger:
+        return RUN_MAX_DURATION
+    seconds_to_trigger = (trigger - now).total_seconds() - RUN_DEADLINE_MARGIN
+    return max(0, min(seconds_to_trigger, RUN_MAX_DURATION))
+
+
+
+def next_trigger(cron_strings: List[str],
+                 now: Optional[datetime.datetime] = None
+) -> Optional[datetime.datetime]:
+    """
+    Given the crontab lines generated by `system.prepare_crontab_string`,
+    returns the first trigger time strictly after the current minute.
+    Returns None if no trigger is found in the next year.
+
+    Supports '*', numbers, names, ranges, lists, steps (like '*/10' or
+    '1-5/2') and macros (like '@hourly'). Like cron, if both the day of
+    month and the day of week are restricted, a day matching either is
+    enough. Malformed lines are logged and ignored.
+    """
+    if not now:
+        now = datetime.datetime.now()
+    schedules = []
+    for cron_string in cron_strings:
+        fields = cron_string.split()
+
+        # Macros replace the whole schedule
+        if fields and fields[0].startswith("@"):
+            if fields[0].lower() not in _CRON_MACROS:
+                log_error(f"Malformed crontab line ignored: '{cron_string}'")
+                continue
+            if not _CRON_MACROS[fields[0].lower()]:
+                log(f"The daemon can't wait for '{fields[0]}': crontab line ignored.")
+                continue
+            fields = _CRON_MACROS[fields[0].lower()].split()
+
+        if len(fields) != 5:
+            log_error(f"Malformed crontab line ignored: '{cron_string}'")
+            continue
+        minute_field, hour_field, day_field, month_field, weekday_field = fields
+        try:
+            schedules.append((
+                _parse_cron_field(minute_field, (0, 59)),
+                _parse_cron_field(hour_field, (0, 23)),
+                _parse_cron_field(day_field, (1, 31)),
+                _parse_cron_field(month_field, (1, 12), _CRON_MONTHS),
+                # Sunday can be written both as 0 and as 7
+                {weekday % 7 for weekday in
+                    _parse_cron_field(weekday_field, (0, 7), _CRON_WEEKDAYS)},
+                not day_field.startswith("*") and not weekday_field.startswith("*"),
+            ))
+        except ValueError as e:
+            log_error(f"Malformed crontab line ignored: '{cron_string}'", e)
+
+    start = now.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    for day_offset in range(367):
+        day = (start + datetime.timedelta(days=day_offset)).date()
+        # Cron counts weekdays from Sunday (0), Python from Monday (0)
+        weekday = (day.weekday() + 1) % 7
+
+        candidates = []
+        for minutes, hours, days, months, weekdays, either_day in schedules:
+            if day.month not in months:
+                continue
+            if either_day:
+                if day.day not in days and weekday not in weekdays:
+                    continue
+            elif day.day not in days or weekday not in weekdays:
+                continue
+            candidate = _first_match_in_day(day, hours, minutes, start)
+            if candidate:
+                candidates.append(candidate)
+
+        if candidates:
+            return min(candidates)
+    return None
+
+
+
+def _first_match_in_day(day: datetime.date, hours: Set[int], minutes: Set[int],
+                        not_before: datetime.datetime) -> Optional[datetime.datetime]:
+    """
+    Returns the first time of the given day matching the hours and minutes
+    of a crontab line that is not earlier than `not_before`.
+    """
+    for hour in sorted(hours):
+        for minute in sorted(minutes):
+            candidate = datetime.datetime(day.year, day.month, day.day, hour, minute)
+            if candidate >= not_before:
+                return candidate
+    return None
+
+
+
+def _parse_cron_field(field: str, bounds: Tuple[int, int],
+                      names: Optional[Dict[str, int]] = None) -> Set[int]:
+    """
+    Returns the values matched by a single crontab field.
+    `bounds` are the lowest and highest values allowed in the field
+    (like 0-23 for the hours, 1-31 for the days of the month): '*' and
+    the steps from a single number span them. `names` are the names the
+    field accepts in place of numbers, like 'jan' or 'mon'.
+    Raises ValueError if the field is malformed.
+    """
+    values = set()
+    for item in field.split(","):
+        step = 1
+        if "/" in item:
+            item, step = item.split("/")
+            step = int(step)
+            if step < 1:
+                raise ValueError(f"invalid step in '{field}'")
+
+        if item == "*":
+            low, high = bounds
+        elif "-" in item:
+            low, high = [_cron_value(x, bounds, names) for x in item.split("-")]
+        else:
+            low = _cron_value(item, bounds, names)
+            # A plain value with a step means 'from here onwards'
+            high = bounds[1] if step > 1 else low
+
+        values.update(range(low, high + 1, step))
+    return values
+
+
+
+def _cron_value(value: str, bounds: Tuple[int, int],
+                names: Optional[Dict[str, int]] = None) -> int:
+    """
+    Converts a single value of a crontab field, either a number or a name,
+    into a number. Raises ValueError if it's unknown or out of `bounds`.
+    """
+    if names and value.lower() in names:
+        return names[value.lower()]
+    number = int(value)
+    if not bounds[0] <= number <= bounds[1]:
+        raise ValueError(f"'{value}' is out of range {bounds[0]}-{bounds[1]}")
+    return number
@@ -1,2 +1,11 @@
+from typing import Optional
+
+
 class ServerError(Exception):
-    pass
+    """
+    Raised when the communication with the server fails.
+    `status_code` is the HTTP status code of the reply, if any.
+    """
+    def __init__(self, *args, status_code: Optional[int] = None):
+        super().__init__(*args)
+        self.status_code = status_code
@@ -0,0 +1,155 @@
+from typing import Dict, Optional, Tuple
+
+import json
+import datetime
+
+from zanzocam.constants import *
+from zanzocam.webcam.utils import log_error
+
+
+
+def history_key(moment: datetime.datetime) -> str:
+    """
+    Returns the key of the exposure history for the given moment:
+    the month, as a rough season, and the slot of the time of day.
+    """
+    slot = (moment.hour * 60 + moment.minute) // EXPOSURE_HISTORY_SLOT
+    return f"{moment.month:02d}-{slot:03d}"
+
+
+
+def load_history(now: Optional[datetime.datetime] = None, path: Optional[Path] = None) -> Dict[str, Dict]:
+    """
+    Returns the exposure history (or the AWB gains history, if `path` is
+    `AWB_GAINS_FILE`), without the entries older than `EXPOSURE_HISTORY_MAX_AGE`.
+    Returns an empty history in case of errors.
+    """
+    now = now or datetime.datetime.now()
+    path = path or EXPOSURE_HISTORY_FILE
+    try:
+        with open(path, "r") as history_file:
+            history = json.load(history_file)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log_error(f"Could not read the exposure history ({path.name}). Ignoring it.", e)
+        return {}
+
+    fresh_history = {}
+    for key, entry in history.items():
+        try:
+            date = datetime.datetime.strptime(entry["date"], PICTURE_DATE_FORMAT)
+            if (now - date).total_seconds() <= EXPOSURE_HISTORY_MAX_AGE:
+                fresh_history[key] = entry
+        except Exception:
+            pass  # Malformed entries are simply dropped
+    return fresh_history
+
+
+
+def predict_exposure(now: Optional[datetime.datetime] = None) -> Optional[Tuple[int, int]]:
+    """
+    Returns the shutter speed and the ISO found by the low light search
+    in a recent run in the same season and time of day, or None.
+    """
+    now = now or datetime.datetime.now()
+    entry = load_history(now).get(history_key(now))
+    if not entry:
+        return None
+    try:
+        return int(entry["shutter_speed"]), int(entry["iso"])
+    except Exception as e:
+        log_error("The exposure history contains an invalid entry. Ignoring it.", e)
+        return None
+
+
+
+def record_exposure(shutter_speed: int, iso: int, luminance: float, attempts: int,
+                    now: Optional[datetime.datetime] = None) -> bool:
+    """
+    Stores the result of the low light search in the exposure history,
+    replacing the previous entry for the same season and time of day.
+    Stale entries are dropped.
+
+    Returns True if the history was saved, False otherwise.
+    """
+    now = now or datetime.datetime.now()
+    history = load_history(now)
+    history[history_key(now)] = {
+        "shutter_speed": int(shutter_speed),
+        "iso": int(iso),
+        "luminance": round(float(luminance), 2),
+        "attempts": attempts,
+        "date": now.strftime(PICTURE_DATE_FORMAT),
+    }
+    return _save_history(history, EXPOSURE_HISTORY_FILE)
+
+
+
+def record_awb_gains(awb_gains: Tuple[float, float], now: Optional[datetime.datetime] = None) -> bool:
+    """
+    Stores the red and blue gains chosen by the automatic white balance,
+    replacing the previous entry for the same time of day.
+    Stale entries are dropped.
+
+    Returns True if the history was saved, False otherwise.
+    """
+    now = now or datetime.datetime.now()
+    history = load_history(now, AWB_GAINS_FILE)
+    slot = (now.hour * 60 + now.minute) // EXPOSURE_HISTORY_SLOT
+    history[f"{slot:03d}"] = {
+        "red": round(float(awb_gains[0]), 3),
+        "blue": round(float(awb_gains[1]), 3),
+        "date": now.strftime(PICTURE_DATE_FORMAT),
+    }
+    return _save_history(history, AWB_GAINS_FILE)
+
+
+
+def predict_awb_gains(now: Optional[datetime.datetime] = None) -> Optional[Tuple[float, float]]:
+    """
+    Returns the red and blue gains of the automatic white balance for the
+    current time of day, interpolated between the closest times of day
+    recorded before and after it. At night, that's usually between the
+    last picture of the evening and the first of the morning.
+    Returns None if there are no recent gains.
+    """
+    now = now or datetime.datetime.now()
+    minutes_per_day = 24 * 60
+    minute = now.hour * 60 + now.minute + now.second / 60
+    gains = []
+    for slot, entry in load_history(now, AWB_GAINS_FILE).items():
+        try:
+            slot_minute = int(slot) * EXPOSURE_HISTORY_SLOT + EXPOSURE_HISTORY_SLOT / 2
+            gains.append(((slot_minute - minute) % minutes_per_day, float(entry["red"]), float(entry["blue"])))
+        except Exception:
+            pass  # Malformed entries are ignored
+    if not gains:
+        return None
+
+    # Distance in minutes from now to the next recorded time (after) and from the last one (before)
+    after = min(gains, key=lambda gain: gain[0])
+    before = max(gains, key=lambda gain: gain[0])
+    distance_after = after[0]
+    distance_before = minutes_per_day - before[0]
+    if after is before or distance_after + distance_before == 0:
+        return after[1], after[2]
+
+    weight = distance_before / (distance_before + distance_after)
+    return (before[1] + (after[1] - before[1]) * weight,
+            before[2] + (after[2] - before[2]) * weight)
+
+
+
+def _save_history(history: Dict[str, Dict], path: Path) -> bool:
+    """
+    Saves a history in compact JSON.
+    Returns True if the history was saved, False otherwise.
+    """
+    try:
+        with open(path, "w") as history_file:
+            json.dump(history, history_file, separators=(",", ":"))
+        return True
+    except Exception as e:
+        log_error(f"Could not save the exposure history ({path.name}).", e)
+        return False
@@ -1,38 +1,94 @@
 # pylint: disable
+from typing import Callable, Tuple
 
 import os
 import sys
 import json
 import shutil
 import logging
+import argparse
 import datetime
-from time import sleep
+from pathlib import Path
 
 from zanzocam.constants import (
     CAMERA_LOGS,
     LOG_NAME_FORMAT,
     SEND_LOGS_FLAG,
     CAMERA_LOG,
-    WAIT_AFTER_CAMERA_FAIL
+    CAMERA_RETRIES,
+    WAIT_AFTER_CAMERA_FAIL,
+    SPOOL_DRAIN_BUDGET
 )
-from zanzocam.webcam import system
-from zanzocam.webcam.configuration import load_configuration_from_disk
+from zanzocam.webcam import system, metrics, spool
+from zanzocam.webcam.configuration import Configuration, load_configuration_from_disk
 from zanzocam.webcam.server import Server
 from zanzocam.webcam.camera import Camera
+from zanzocam.webcam.daemon import run_daemon, run_duration_limit, daemon_running_elsewhere
+from zanzocam.webcam.startup_report import startup_report
 from zanzocam.webcam.errors import ServerError
-from zanzocam.webcam.utils import log, log_error, log_row
+from zanzocam.webcam.metrics import span
+from zanzocam.webcam.utils import (
+    log,
+    log_error,
+    log_row,
+    retry,
+    set_run_deadline,
+    time_left,
+    BackgroundTask
+)
 from zanzocam.web_ui.utils import read_flag_file
 
 
-def main():
+def cli():
     """
-    Main script coordinating all operations.
+    Entry point of the z-webcam executable.
+    """
+    parser = argparse.ArgumentParser(
+        prog="z-webcam",
+        description="ZanzoCam: takes a picture and sends it to the server.")
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="keep running and take the pictures according to the schedule "
+             "found in the configuration, instead of taking a single picture.")
+    parser.add_argument(
+        "--startup-report", action="store_true",
+        help="measure how long z-webcam takes to import its modules and "
+             "compare it with the last report. Exits with 1 on regressions.")
+    parser.add_argument(
+        "--export-trace", metavar="PATH",
+        help="export the phases of a past run as a Chrome trace-event file, "
+             "to be opened with chrome://tracing or https://ui.perfetto.dev.")
+    parser.add_argument(
+        "--run", type=int, default=-1,
+        help="with --export-trace, the run to export: -1 is the last one "
+             "(default), -2 the one before it, 0 the oldest one stored.")
+    args = parser.parse_args()
+
+    if args.startup_report or args.export_trace:
+        logging.basicConfig(level=logging.INFO, format='%(message)s',
+                            handlers=[logging.StreamHandler(sys.stdout)])
+        if args.startup_report:
+            sys.exit(0 if startup_report() else 1)
+        sys.exit(0 if metrics.export_chrome_trace(args.export_trace, args.run) else 1)
+
+    if args.daemon:
+        # The logs belong to the daemon holding the lock, which might not be this one
+        run_daemon(main, on_start=setup_logging)
+    else:
+        main()
+
+
+def setup_logging(wipe: bool = True):
+    """
+    Wipes the camera logs and makes sure they're written both to file
+    and to the console. Can be called again at every run.
+    With `wipe=False` the logs are appended to the existing ones.
     """
-    # Setup the logging
     if not os.path.isdir(CAMERA_LOGS):
         os.mkdir(CAMERA_LOGS)
-    with open(CAMERA_LOG, "w") as _:
-        pass
+    if wipe:
+        with open(CAMERA_LOG, "w") as _:
+            pass
     logging.basicConfig(
         level=logging.INFO,
         format='%(message)s',
@@ -41,6 +97,117 @@ def main():
             logging.StreamHandler(sys.stdout),
         ]
     )
+
+
+def report_status() -> bool:
+    """
+    Logs the status report. Runs in parallel with the rest of the run.
+    Returns True if the execution was successful, False in case of errors.
+    """
+    with span("status"):
+        return system.log_general_status()
+
+
+def update_configuration(config: Configuration, status_task: BackgroundTask) -> Tuple[Configuration, Server, bool]:
+    """
+    Connects to the server, downloads the new configuration, applies
+    the new system settings, if they changed, and downloads the overlays.
+    Runs in parallel with the camera.
+
+    Returns the configuration in use, the server to use for the rest of
+    the run and False in case of errors.
+    """
+    # The status check connects to a known WiFi network if needed
+    # (see `system.run_autohotspot()`): wait for it before using the network
+    status_task.result()
+
+    # Create the server
+    server = Server(config.get_server_settings())
+
+    # Update the configuration file
+    system_no_errors = True
+    with span("configuration"):
+        new_config = server.update_configuration(config)
+    if new_config:
+
+        # Update the system to conform to the new configuration file,
+        # only if its settings changed or the crontab doesn't match them
+        # (for example because the last update failed)
+        changed_sections = config.changed_sections(new_config.as_dict())
+        time_settings = new_config.get_system_settings().get("time", {})
+        if "time" in changed_sections or not system.crontab_up_to_date(time_settings):
+            with span("system settings"):
+                # Returns None if there are no system settings to apply
+                system_no_errors = system.apply_system_settings(new_config.get_system_settings()) is not False
+        config = new_config
+
+    log(f"Configuration in use:\n{config}")
+
+    # Recreate the server (might differ in the new configuration)
+    server = Server(config.get_server_settings())
+
+    # Download the overlays
+    overlays_list = config.list_overlays()
+    with span("overlays download"):
+        no_errors = server.download_overlay_images(overlays_list)
+
+    return config, server, no_errors and system_no_errors
+
+
+@retry(times=CAMERA_RETRIES, wait_for=WAIT_AFTER_CAMERA_FAIL)
+def shoot_picture(config: Configuration, before_processing: Callable[[Camera], None],
+                  on_frame: Callable[[Camera, Path, datetime.datetime], None]) -> Camera:
+    """
+    Initializes the camera and takes the picture, retrying on failures.
+    `before_processing` is called with the camera before the overlays
+    are rendered (see `Camera.take_picture`).
+    If the configuration asks for a burst, shoots it instead and gives
+    every picture to `on_frame` (see `Camera.take_burst`).
+    Returns the camera, which knows where the picture is.
+    """
+    log("Initializing camera...")
+    camera = Camera(config.get_camera_settings())
+    with span("camera"):
+        if camera.is_burst():
+            camera.take_burst(lambda path, timestamp: on_frame(camera, path, timestamp),
+                              before_processing=lambda: before_processing(camera))
+        else:
+            camera.take_picture(before_processing=lambda: before_processing(camera))
+    return camera
+
+
+def upload_burst_picture(network_phase: BackgroundTask, camera: Camera,
+                         image_path: Path, timestamp: datetime.datetime) -> bool:
+    """
+    Uploads a picture of a burst as soon as the server is known,
+    or stores it in the spool if the upload fails.
+    Returns True if the picture was uploaded, False otherwise.
+    """
+    # Errors of the network phase are not handled here, but after the camera is done.
+    try:
+        _, server, _ = network_phase.result()
+    except Exception:
+        log_error("A picture of the burst can't be uploaded: the server is not available.")
+        spool.spool_picture(image_path, camera.name, camera.extension, timestamp)
+        return False
+
+    with span("upload"):
+        try:
+            server.upload_picture(image_path, camera.name, camera.extension, timestamp=timestamp)
+            return True
+        except Exception as e:
+            log_error("A picture of the burst could not be uploaded.", e)
+            server.spool_picture(image_path, camera.name, camera.extension)
+            return False
+
+
+def main():
+    """
+    Main script coordinating all operations.
+    """
+    # Never wipe the logs of a daemon that is running in another process
+    setup_logging(wipe=not daemon_running_elsewhere())
+    metrics.start_run()
     log_row()
     log(f"Starting...")
 
@@ -49,12 +216,13 @@ def main():
     config = None
     server = None
     camera = None
+    status_task = None
 
     try:
         start = datetime.datetime.now()
 
-        # System check
-        no_errors = system.log_general_status()
+        # System check, in the background: it doesn't need to delay the picture
+        status_task = BackgroundTask(report_status)
  
         # Locale setup
         no_errors = system.set_locale()
@@ -76,47 +244,66 @@ def main():
             log_error("Continuing the run.")
             no_errors = True
 
-        # Create the server
-        server = Server(config.get_server_settings())
+        # Retries and timeouts must not make the run last
+        # beyond the next scheduled one
+        time_settings = (config.get_system_settings() or {}).get("time", {})
+        set_run_deadline(run_duration_limit(time_settings))
 
-        # Update the configuration file
-        new_config = server.update_configuration(config)
-        if new_config:
-        
-            # Update the system to conform to the new configuration file
-            no_errors = system.apply_system_settings(new_config.get_system_settings())
-            config = new_config
+        # Connect to the server, update the configuration and download
+        # the overlays in the background, while the camera warms up and
+        # shoots the picture.
+        # NOTE: the picture is shot with the camera settings of the
+        # current configuration: a new one is used from the next run.
+        network_phase = BackgroundTask(update_configuration, config, status_task)
 
-        log(f"Configuration in use:\n{config}")
-
-        # Recreate the server (might differ in the new configuration)
-        server = Server(config.get_server_settings())
+        def wait_for_overlays(camera):
+            # Errors are not handled here, but after the camera is done.
+            try:
+                new_config, _, _ = network_phase.result()
+                camera.overlays = new_config.get_camera_settings()["overlays"]
+            except Exception:
+                pass
 
-        # Download the overlays
-        overlays_list = config.list_overlays()
-        no_errors = server.download_overlay_images(overlays_list)
+        # The pictures of a burst are uploaded one at a time,
+        # each while the next one is being shot
+        burst_uploads = []
+        def upload_in_background(camera, image_path, timestamp):
+            if burst_uploads:
+                burst_uploads[-1].result()
+            burst_uploads.append(BackgroundTask(
+                upload_burst_picture, network_phase, camera, image_path, timestamp))
 
         # Take the picture
-        for _ in range(3):
-            log("Initializing camera...")
-            try:
-                camera = Camera(config.get_camera_settings())
-                camera.take_picture()
-                break
+        try:
+            camera = shoot_picture(config, wait_for_overlays, upload_in_background)
+        except Exception as exception:
+            no_errors = False
+            log_error("The camera could not take the picture.", exception)
 
-            except Exception as exception:
-                no_errors = False
-                log_error("An exception occurred!", exception)
-                log(f"Waiting for {WAIT_AFTER_CAMERA_FAIL} sec. "
-                    "and retrying...")
-                sleep(WAIT_AFTER_CAMERA_FAIL)
+        # Wait for the server communication to be over
+        camera_no_errors = no_errors
+        with span("network wait"):
+            # The burst uploads first: they spool their pictures even if the server fails
+            burst_no_errors = all([upload.result() for upload in burst_uploads])
+            config, server, no_errors = network_phase.result()
+        no_errors = no_errors and camera_no_errors and burst_no_errors
 
         if not camera:
             no_errors = False
             return
 
-        # Send the picture
-        server.upload_picture(camera.processed_image_path, camera.name, camera.extension)
+        # Send the picture. If it fails, store it to send it in the next runs
+        if not burst_uploads:
+            with span("upload"):
+                try:
+                    server.upload_picture(camera.processed_image_path, camera.name, camera.extension)
+                except Exception:
+                    server.spool_picture(camera.processed_image_path, camera.name, camera.extension)
+                    raise
+
+        # The server is reachable: send the pictures that failed to upload before
+        with span("spool drain"):
+            server.drain_spool(budget=time_left(SPOOL_DRAIN_BUDGET))
 
         # Cleanup the image files
         no_errors = no_errors and camera.cleanup_image_files()
@@ -159,7 +346,15 @@ def main():
         else:
             errors_str = "with errors"
 
+        # Make sure the status report makes it into the logs
+        if status_task:
+            try:
+                status_task.result()
+            except Exception as status_exception:
+                log_error("The status report failed.", status_exception)
+
         end = datetime.datetime.now()
+        metrics.log_summary()
         log(f"Execution completed {errors_str} in: {end - start}")
         log_row()
 
@@ -170,15 +365,20 @@ def main():
         if upload_logs:
             try:
                 log("Uploading the logs...")
-                current_conf = load_configuration_from_disk(quiet=True)
-                server = Server(current_conf.get_server_settings())
-                server.upload_logs()
+                with span("logs upload"):
+                    current_conf = load_configuration_from_disk(quiet=True)
+                    server = Server(current_conf.get_server_settings())
+                    server.upload_logs()
             except Exception as log_exception:
                 log_error("Something went wrong uploading the logs. "
                           "Logs won't be uploaded.", log_exception)
         else:
             log("Logs are not sent to the server.")
 
+        # Store the duration of each phase, logs upload included
+        metrics.save_run(no_errors)
+        set_run_deadline(None)
+
 
 if "__main__" == __name__:
-    main()
+    cli()
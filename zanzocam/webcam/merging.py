@@ -0,0 +1,130 @@
+"""
+Merges the pictures of a bracketing with numpy.
+
+Imported only where it's used, because of numpy (see `metering`).
+"""
+from typing import List, Optional, Sequence
+
+import numpy
+from pathlib import Path
+from PIL import Image
+
+from zanzocam.constants import *
+
+
+
+def fuse_exposures(paths: Sequence[Path], output_path: Path,
+                   exif_path: Optional[Path] = None,
+                   tile_rows: int = MERGE_TILE_ROWS) -> None:
+    """
+    Merges pictures of the same scene taken with different exposures
+    into a single picture, where every area comes mostly from the
+    pictures that exposed it best (exposure fusion, see `fuse_tile()`).
+
+    The merge goes through horizontal bands of `tile_rows` rows: only the
+    decoded pictures are kept in memory at full size, as bytes, while the
+    float arrays of the computation never exceed a band. The result is
+    saved in `output_path` in the format of its extension, with the EXIF
+    data of `exif_path` if given.
+
+    Raises ValueError if there are less than two pictures, or if their
+    sizes differ.
+    """
+    if len(paths) < 2:
+        raise ValueError("At least two pictures are needed for the merge.")
+
+    frames = [Image.open(str(path)).convert("RGB") for path in paths]
+    width, height = frames[0].size
+    if any(frame.size != (width, height) for frame in frames):
+        raise ValueError(f"The pictures to merge must have the same size: "
+                         f"{', '.join(f'{f.width}x{f.height}' for f in frames)}.")
+
+    # The weights are smoothed across the bands: each band is computed
+    # with some extra rows above and below to avoid visible seams
+    halo = MERGE_WEIGHT_RADIUS + 1
+    merged = Image.new("RGB", (width, height))
+    for top in range(0, height, tile_rows):
+        bottom = min(top + tile_rows, height)
+        halo_top = max(top - halo, 0)
+        halo_bottom = min(bottom + halo, height)
+
+        tiles = [numpy.asarray(frame.crop((0, halo_top, width, halo_bottom))) for frame in frames]
+        fused = fuse_tile(tiles)[top - halo_top:bottom - halo_top]
+        merged.paste(Image.fromarray(fused), (0, top))
+
+    save_arguments = {}
+    if exif_path:
+        with Image.open(str(exif_path)) as exif_source:
+            if "exif" in exif_source.info:
+                save_arguments["exif"] = exif_source.info["exif"]
+    if Path(output_path).suffix.lower() in [".jpg", ".jpeg"]:
+        # The picture is encoded again after the overlays are added
+        save_arguments["quality"] = MERGE_JPEG_QUALITY
+    merged.save(str(output_path), **save_arguments)
+
+
+
+def fuse_tile(tiles: List[numpy.ndarray]) -> numpy.ndarray:
+    """
+    Merges the same area of differently exposed pictures (height x width x 3,
+    with values from 0 to 255) with a per-pixel weighted average.
+    The weight of each pixel grows with:
+        - its contrast with the pixels around it (the absolute Laplacian of
+            its luminance), so that details are kept
+        - its saturation (the spread of its channels), so that colors are kept
+        - how close to mid-grey it is (a Gaussian of width
+            `MERGE_WELL_EXPOSED_SIGMA` on each channel), so that clipped and
+            very dark pixels count the least
+
+    The weights are blurred over `MERGE_WEIGHT_RADIUS` pixels, which avoids
+    the noise of purely per-pixel weights at a fraction of the cost of
+    multi-resolution blending.
+    Returns the merged area as bytes.
+    """
+    channel_weights = numpy.array(LUMINANCE_WEIGHTS, dtype=numpy.float32)
+    weighted_sum = None
+    weights_sum = None
+
+    for tile in tiles:
+        pixels = tile.astype(numpy.float32) / 255
+
+        # Contrast: absolute Laplacian of the luminance, edges repeated
+        grey = numpy.pad(pixels @ channel_weights, 1, mode="edge")
+        contrast = numpy.abs(4 * grey[1:-1, 1:-1] - grey[:-2, 1:-1] - grey[2:, 1:-1]
+                                                  - grey[1:-1, :-2] - grey[1:-1, 2:])
+        saturation = pixels.std(axis=2)
+        well_exposed = numpy.exp(-((pixels - 0.5) ** 2).sum(axis=2) / (2 * MERGE_WELL_EXPOSED_SIGMA ** 2))
+
+        weights = _box_blur(contrast * saturation * well_exposed + 1e-6, MERGE_WEIGHT_RADIUS)
+        weighted = pixels * weights[:, :, numpy.newaxis]
+        if weighted_sum is None:
+            weighted_sum, weights_sum = weighted, weights
+        else:
+            weighted_sum += weighted
+            weights_sum += weights
+
+    merged = weighted_sum / weights_sum[:, :, numpy.newaxis]
+    return numpy.clip(numpy.rint(merged * 255), 0, 255).astype(numpy.uint8)
+
+
+
+def _box_blur(values: numpy.ndarray, radius: int) -> numpy.ndarray:
+    """
+    Averages each value of a 2D array with its neighbours within `radius`,
+    in both directions, with cumulative sums: the cost doesn't depend on
+    the radius. Near the edges, only the values inside the array are averaged.
+    """
+    if radius < 1:
+        return values
+    for axis in [0, 1]:
+        length = values.shape[axis]
+        cumulative = numpy.cumsum(values, axis=axis, dtype=numpy.float32)
+        cumulative = numpy.insert(cumulative, 0, 0, axis=axis)
+        starts = numpy.clip(numpy.arange(length) - radius, 0, length)
+        ends = numpy.clip(numpy.arange(length) + radius + 1, 0, length)
+        counts = (ends - starts).astype(numpy.float32)
+        totals = numpy.take(cumulative, ends, axis=axis) - numpy.take(cumulative, starts, axis=axis)
+        shape = [1, 1]
+        shape[axis] = length
+        values = totals / counts.reshape(shape)
+    return values
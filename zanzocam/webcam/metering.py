@@ -0,0 +1,131 @@
+"""
+Measures the luminance of the pictures with numpy.
+
+numpy is slow to import on the Pi, so this module, `merging` and numpy
+itself are imported only inside the functions that use them.
+"""
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import math
+import numpy
+from pathlib import Path
+from PIL import Image
+
+from zanzocam.constants import *
+
+
+#: The metering modes, to be used as `metering_mode` in the image settings
+METERING_MODES = ["average", "centre", "region", "median"]
+
+# The weights of the centre-weighted mean only depend on the frame size
+_centre_weights_cache = {}
+
+
+
+def luminance_from_means(means: numpy.ndarray) -> float:
+    """
+    Given the mean value of each channel, returns the perceived luminance
+    """
+    return math.sqrt(float((numpy.asarray(means, dtype=numpy.float64) ** 2) @ LUMINANCE_WEIGHTS))
+
+
+
+def load_frame(path: Path, size: Tuple[int, int] = METERING_RESOLUTION) -> numpy.ndarray:
+    """
+    Loads a picture as a small RGB frame, ready to be metered. 
+    JPEGs are scaled down while decoding, which is much faster
+    than decoding them at full size.
+    """
+    with Image.open(str(path)) as picture:
+        picture.draft("RGB", size)
+        picture = picture.convert("RGB").resize(size)
+        return numpy.asarray(picture)
+
+
+
+def frame_statistics(frame: numpy.ndarray, mode: str = "average", 
+                     region: Optional[Sequence[float]] = None) -> Dict[str, Any]:
+    """
+    Measures an RGB frame (height x width x 3, with values from 0 to 255).
+    Returns:
+        - `luminance`: the luminance according to the metering mode:
+            - `average`: the perceived luminance of the mean of each channel,
+                like `Camera._luminance_from_path()`
+            - `centre`: like `average`, but the pixels weight less the farther
+                they are from the centre (see `METERING_CENTRE_SIGMA`)
+            - `region`: like `average`, but only within `region`, given as
+                the [left, top, right, bottom] edges as fractions of the frame
+            - `median`: the median of the luminance of the pixels, which
+                ignores bright lamps and sky as long as they're less than half
+                of the picture
+        - `histogram`: the number of pixels at each luminance level (0-255)
+        - `percentiles`: the luminance at the `METERING_PERCENTILES`
+        - `clipped`: the fraction of pixels at `SATURATED_LUMINANCE` or above
+
+    Raises ValueError if the mode is unknown or the region is invalid.
+    """
+    if mode not in METERING_MODES:
+        raise ValueError(f"Unknown metering mode: '{mode}'. "
+                         f"Choose between {', '.join(METERING_MODES)}.")
+    height, width, _ = frame.shape
+    pixels = frame.reshape(-1, 3).astype(numpy.float32)
+
+    # Per-pixel luminance, rounded to the 256 levels of the histogram
+    levels = numpy.sqrt((pixels ** 2) @ numpy.array(LUMINANCE_WEIGHTS, dtype=numpy.float32))
+    levels = numpy.clip(numpy.rint(levels), 0, 255).astype(numpy.uint8)
+    histogram = numpy.bincount(levels, minlength=256)
+    cumulative = numpy.cumsum(histogram)
+    percentiles = {
+        percentile: int(numpy.searchsorted(cumulative, percentile / 100 * levels.size))
+        for percentile in METERING_PERCENTILES
+    }
+
+    if mode == "median":
+        luminance = float(numpy.searchsorted(cumulative, levels.size / 2))
+    elif mode == "centre":
+        weights = _centre_weights(height, width)
+        luminance = luminance_from_means(weights @ pixels)
+    elif mode == "region":
+        left, top, right, bottom = _region_bounds(region, height, width)
+        luminance = luminance_from_means(frame[top:bottom, left:right].reshape(-1, 3).mean(axis=0))
+    else:
+        luminance = luminance_from_means(pixels.mean(axis=0))
+
+    return {
+        "luminance": luminance,
+        "histogram": histogram,
+        "percentiles": percentiles,
+        "clipped": float(cumulative[-1] - cumulative[SATURATED_LUMINANCE - 1]) / levels.size,
+    }
+
+
+
+def _centre_weights(height: int, width: int) -> numpy.ndarray:
+    """
+    Returns the normalized weights of the pixels for the centre-weighted
+    mean, flattened: a gaussian centered on the frame.
+    """
+    if (height, width) not in _centre_weights_cache:
+        y = (numpy.arange(height) - (height - 1) / 2) / height
+        x = (numpy.arange(width) - (width - 1) / 2) / width
+        weights = numpy.exp(-(y[:, None] ** 2 + x[None, :] ** 2) / (2 * METERING_CENTRE_SIGMA ** 2))
+        _centre_weights_cache[(height, width)] = (weights / weights.sum()).astype(numpy.float32).reshape(-1)
+    return _centre_weights_cache[(height, width)]
+
+
+
+def _region_bounds(region: Optional[Sequence[float]], height: int, width: int) -> Tuple[int, int, int, int]:
+    """
+    Converts a region given as fractions of the frame into pixels.
+    Raises ValueError if the region is missing or empty.
+    """
+    try:
+        left, top, right, bottom = (float(edge) for edge in region)
+    except Exception:
+        raise ValueError(f"The metering region must be given as [left, top, right, bottom], "
+                         f"as fractions of the picture, not {region}.")
+    left, right = int(left * width), int(math.ceil(right * width))
+    top, bottom = int(top * height), int(math.ceil(bottom * height))
+    if not (0 <= left < right <= width and 0 <= top < bottom <= height):
+        raise ValueError(f"The metering region {region} is empty or outside of the picture.")
+    return left, top, right, bottom
@@ -0,0 +1,189 @@
+from typing import Any, Dict, List
+
+import os
+import json
+import time
+import datetime
+import resource
+import threading
+from contextlib import contextmanager
+
+from zanzocam.constants import *
+from zanzocam.webcam.utils import log, log_error
+
+
+# Per-thread CPU time is available from Python 3.7 only
+_cpu_time = getattr(time, "thread_time", time.process_time)
+
+# Spans recorded in the current run
+_run = {"start": time.perf_counter(), "date": datetime.datetime.now(), "spans": []}
+_threads = {}
+_lock = threading.Lock()
+
+
+
+def start_run() -> None:
+    """
+    Discards all the spans recorded so far and starts measuring a new run.
+    """
+    with _lock:
+        _run["start"] = time.perf_counter()
+        _run["date"] = datetime.datetime.now()
+        _run["spans"] = []
+        _threads.clear()
+        _threads[threading.get_ident()] = 0
+
+
+
+@contextmanager
+def span(name: str):
+    """
+    Measures the block of code it wraps: wall time, CPU time of the current
+    thread and how much the peak RSS of the process grew during the block.
+    The peak RSS grows only when the process needs more memory than ever
+    before, so a block that uses less memory than a previous one records 0.
+    Spans can be nested and can be recorded from different threads.
+
+        with span("upload"):
+            server.upload_picture(...)
+    """
+    # On Linux ru_maxrss is in KB
+    start_peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_wall = time.perf_counter()
+    start_cpu = _cpu_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = _cpu_time() - start_cpu
+        peak_rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_peak_rss
+        with _lock:
+            thread = _threads.setdefault(threading.get_ident(), len(_threads))
+            _run["spans"].append([
+                name,
+                round((start_wall - _run["start"]) * 1000, 1),
+                round(wall * 1000, 1),
+                round(cpu * 1000, 1),
+                peak_rss_growth,
+                thread
+            ])
+
+
+
+def get_spans() -> List[Dict[str, Any]]:
+    """
+    Returns the spans of the current run as a list of dictionaries.
+    """
+    with _lock:
+        return [_span_to_dict(values) for values in _run["spans"]]
+
+
+
+def _span_to_dict(values: List) -> Dict[str, Any]:
+    """
+    Spans are stored as lists to keep the metrics file compact.
+    """
+    keys = ["name", "start_ms", "wall_ms", "cpu_ms", "peak_rss_growth_kb", "thread"]
+    return dict(zip(keys, values))
+
+
+
+def log_summary() -> None:
+    """
+    Logs one line with the duration of each phase of the run.
+    """
+    spans = sorted(get_spans(), key=lambda span: span["start_ms"])
+    phases = ", ".join(f"{span['name']} {span['wall_ms']/1000:.2f}s" for span in spans)
+    log(f"Phases: {phases}")
+
+
+
+def save_run(no_errors: bool) -> None:
+    """
+    Appends the spans of the current run to the metrics file as a single
+    JSON line. When the file grows over METRICS_FILE_MAX_SIZE, the oldest
+    half of the runs is dropped.
+    """
+    try:
+        with _lock:
+            record = {
+                "date": _run["date"].strftime("%Y-%m-%d %H:%M:%S"),
+                "ok": no_errors,
+                "spans": _run["spans"],
+            }
+        with open(METRICS_FILE, "a") as metrics:
+            metrics.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+        if os.path.getsize(METRICS_FILE) > METRICS_FILE_MAX_SIZE:
+            with open(METRICS_FILE, "r") as metrics:
+                lines = metrics.readlines()
+            with open(METRICS_FILE, "w") as metrics:
+                metrics.writelines(lines[len(lines)//2:])
+
+    except Exception as e:
+        log_error("Could not save the metrics of this run.", e)
+
+
+
+def load_runs() -> List[Dict[str, Any]]:
+    """
+    Loads all the runs stored in the metrics file. Malformed lines are skipped.
+    """
+    runs = []
+    with open(METRICS_FILE, "r") as metrics:
+        for line in metrics:
+            try:
+                runs.append(json.loads(line))
+            except ValueError:
+                continue
+    return runs
+
+
+
+def export_chrome_trace(output_path: Path, run_index: int = -1) -> bool:
+    """
+    Exports one of the runs of the metrics file (the last one by default)
+    as a Chrome trace-event file, to be opened with chrome://tracing
+    or https://ui.perfetto.dev.
+
+    Returns True if the export was successful, False otherwise.
+    """
+    try:
+        run = load_runs()[run_index]
+    except FileNotFoundError:
+        log_error(f"No metrics found in {METRICS_FILE}.")
+        return False
+    except IndexError:
+        log_error(f"Run {run_index} not found in {METRICS_FILE}.")
+        return False
+
+    events = []
+    for values in run["spans"]:
+        span = _span_to_dict(values)
+        events.append({
+            "name": span["name"],
+            "cat": "zanzocam",
+            "ph": "X",
+            "ts": int(span["start_ms"] * 1000),
+            "dur": int(span["wall_ms"] * 1000),
+            "pid": 1,
+            "tid": span["thread"],
+            "args": {
+                "cpu_ms": span["cpu_ms"],
+                "peak_rss_growth_kb": span["peak_rss_growth_kb"]
+            }
+        })
+    trace = {
+        "traceEvents": events,
+        "displayTimeUnit": "ms",
+        "otherData": {"run": run["date"], "ok": run["ok"], "version": VERSION}
+    }
+    try:
+        with open(output_path, "w") as trace_file:
+            json.dump(trace, trace_file)
+    except Exception as e:
+        log_error(f"Could not write the trace file to {output_path}.", e)
+        return False
+
+    log(f"Run of {run['date']} exported to {output_path}")
+    return True
@@ -1,11 +1,117 @@
-from typing import Any, Dict, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 
+import os
 import math
 import datetime
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image, ImageFont, ImageDraw
 
 from zanzocam.constants import *
-from zanzocam.webcam.utils import log, log_error
+from zanzocam.webcam import render_cache, text_layout
+from zanzocam.webcam.utils import log, log_error, available_memory
+
+
+
+def load_font(font_size: int) -> Any:
+    """
+    Loads the font at the given size. The fonts stay in memory
+    across the runs, when running as a daemon.
+
+    Each thread gets its own fonts: FreeType faces can't be used
+    by two threads at once.
+    """
+    return _load_font(font_size, threading.get_ident())
+
+
+@lru_cache(maxsize=16)
+def _load_font(font_size: int, thread: int) -> Any:
+    """
+    Loads the font at the given size for the given thread (see `load_font()`).
+    """
+    return ImageFont.truetype(FONT_PATH, font_size)
+
+
+
+def render_overlays(overlays: Dict[str, Dict], photo_width: int, photo_height: int, 
+                    date_format: Optional[str], time_format: Optional[str]) -> List["Overlay"]:
+    """
+    Renders the overlays, in parallel on boards with more than one core,
+    and returns the ones that could be rendered in the order they are given.
+
+    Overlays start rendering only if their estimated memory (see 
+    `estimate_memory()`), added to the one of the overlays already rendering,
+    fits in `OVERLAYS_MEMORY_FRACTION` of the available memory, so that 
+    decoding large images at once can't run a small board out of memory. 
+    Overlays larger than that are rendered alone. If the available memory
+    is unknown, overlays are rendered one at a time.
+    """
+    def render(position, data):
+        try:
+            overlay = Overlay(position, data, photo_width, photo_height, date_format, time_format)
+            if overlay.rendered_image:
+                return overlay
+        except Exception as e:
+            log_error(f"Something happened processing the overlay {position}. "
+                      f"This overlay will be skipped.", e)
+        return None
+
+    workers = min(os.cpu_count() or 1, OVERLAYS_MAX_WORKERS, len(overlays))
+    memory = available_memory()
+    if workers < 2 or memory is None:
+        rendered = [render(position, data) for position, data in overlays.items()]
+        return [overlay for overlay in rendered if overlay]
+
+    budget = memory * OVERLAYS_MEMORY_FRACTION
+    futures = []
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for position, data in overlays.items():
+            needed = estimate_memory(data, photo_width)
+            # Wait for some overlay to be done until this one fits
+            while running and sum(running.values()) + needed > budget:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+            future = executor.submit(render, position, data)
+            running[future] = needed
+            futures.append(future)
+
+    rendered = [future.result() for future in futures]
+    return [overlay for overlay in rendered if overlay]
+
+
+
+def estimate_memory(data: Dict, photo_width: int) -> int:
+    """
+    Estimates the peak memory needed to render an overlay, in bytes, 
+    without rendering it: images are decoded, converted, resized and pasted
+    on a new canvas, text is drawn on a label at most as wide as the picture.
+    Only the header of the images is read.
+    """
+    if not isinstance(data, dict):
+        return 0
+    padding = data.get("padding", OVERLAY_DEFAULTS["padding"]) or 0
+
+    if data.get("type") == "image":
+        try:
+            with Image.open(IMAGE_OVERLAYS_PATH / data.get("path", "")) as image:
+                width, height = image.size
+        except Exception:
+            # The overlay will fail without decoding anything
+            return 0
+        output_width = data.get("width") or width
+        output_height = data.get("height") or height
+        # Decoded, converted to RGBA, resized and pasted on the RGBA canvas
+        return (width * height * 8 
+                + output_width * output_height * 4 
+                + (output_width + padding*2) * (output_height + padding*2) * 4)
+
+    # Text: the label and its copy in the render cache
+    font_size = data.get("font_size", OVERLAY_DEFAULTS["font_size"]) or 0
+    lines = str(data.get("text", "")).count("\n") + 1
+    return (photo_width + padding*2) * (lines * font_size * 2 + padding*2) * 4 * 2
 
 
 
@@ -23,6 +129,7 @@ class Overlay:
         # Populate the attributes with the overlay data 
         for key, value in data.items():
             setattr(self, key, value)
+        self._configuration = data
         self.date_format = date_format if date_format else "%d %B %Y"
         self.time_format = time_format if time_format else "%H:%M"
 
@@ -109,31 +216,67 @@ class Overlay:
         """ 
         Prepares an overlay containing text.
         In case of issues, self.overlay_image will stay None.
+
+        The rendered text is reused from the render cache. Texts with %%TIME
+        and %%DATE are cached without the lines containing them, which are
+        drawn at every run on a copy of the cached label.
         """
         try:
+            # Text that never changes doesn't even need to be laid out again
+            dynamic = "%%TIME" in self.text or "%%DATE" in self.text
+            key = None
+            if not dynamic:
+                key = render_cache.cache_key(self._configuration, photo_width)
+                label = render_cache.get(key)
+                if label:
+                    return label
+
             # Creates the font and calculate the line height
-            font_size = self.font_size
-            font = ImageFont.truetype(FONT_PATH, font_size)
+            font = load_font(self.font_size)
 
-            # Replace %%TIME and %%DATE with respective values
+            # Replace %%TIME and %%DATE with respective values,
+            # remembering which lines change at every run
             time_string = datetime.datetime.now().strftime(self.time_format)
             date_string = datetime.datetime.now().strftime(self.date_format)
-            self.text = self.text.replace("%%TIME", time_string)
-            self.text = self.text.replace("%%DATE", date_string)
+            lines, estimates, dynamic_lines = [], [], []
+            for line in self.text.split("\n"):
+                line_is_dynamic = "%%TIME" in line or "%%DATE" in line
+                line = line.replace("%%TIME", time_string).replace("%%DATE", date_string)
+                wrapped_lines, wrapped_estimates = text_layout.wrap_line(font, line, photo_width)
+                lines += wrapped_lines
+                estimates += wrapped_estimates
+                dynamic_lines += [line_is_dynamic] * len(wrapped_lines)
+            self.text = "\n".join(lines)
 
             # Calculate the dimension of the text with the padding added
-            text_width, text_height = self.process_text(font, photo_width)
+            text_width, text_height = text_layout.measure_lines(font, lines, estimates)
             text_size = (text_width + self.padding*2, text_height + self.padding*2)
 
             # Some very popular browsers use \r\n to save newlines from 
-            # textareas: normalize
+            # textareas: normalize.
+            # Each pass draws its own lines and leaves the others blank,
+            # so that every line lands where it would in a single pass
             self.text = self.text.replace("\r\n", "\n")
-
-            # Creates the image
-            label = Image.new("RGBA", text_size, color=self.background_color)
-            draw = ImageDraw.Draw(label)
-            draw.text((self.padding, self.padding, self.padding), 
-                      self.text, self.font_color, font=font)
+            static_text = "\n".join("" if is_dynamic else line 
+                                    for line, is_dynamic in zip(lines, dynamic_lines)).replace("\r\n", "\n")
+            dynamic_text = "\n".join(line if is_dynamic else "" 
+                                     for line, is_dynamic in zip(lines, dynamic_lines)).replace("\r\n", "\n")
+
+            # Creates the image, or reuses the one with the same static lines
+            if dynamic:
+                key = render_cache.cache_key(self._configuration, photo_width, extra=[text_size, static_text])
+            label = render_cache.get(key)
+            if label is None:
+                label = Image.new("RGBA", text_size, color=self.background_color)
+                draw = ImageDraw.Draw(label)
+                draw.text((self.padding, self.padding, self.padding), 
+                          static_text, self.font_color, font=font)
+                render_cache.put(key, label)
+
+            if dynamic:
+                draw = ImageDraw.Draw(label)
+                draw.text((self.padding, self.padding, self.padding), 
+                          dynamic_text, self.font_color, font=font)
 
             # Store it
             return label
@@ -144,36 +287,6 @@ class Overlay:
             return
 
 
-    def process_text(self, font: Any, max_line_length: int) -> Tuple[int, int]:
-        """ 
-        Measures and insert returns into the text to make it fit into the image.
-        """
-        # Insert as many returns as needed to make the text fit.
-        lines = []
-        for line in self.text.split("\n"):
-            if font.getsize(line)[0] <= max_line_length:
-                lines.append(line)
-            else:
-                new_line = ""
-                for word in line.split(" "):
-                    if font.getsize(new_line + word)[0] <= max_line_length:
-                        new_line = new_line + word + " "
-                    else:
-                        lines.append(new_line)
-                        new_line = word + " "
-                if new_line != "":
-                    lines.append(new_line)
-        self.text = '\n'.join(lines)
-
-        # Measure text's bounding box (no margins applied here)
-        text_width = max([font.getsize(line)[0] for line in lines])
-        # https://stackoverflow.com/questions/43060479/how-to-get-the-font-pixel-height-using-pils-imagefont-class
-        ascent, descent = font.getmetrics()
-        # The text has approximately a 3% interline space
-        text_height = math.ceil(len(lines) * ascent * 1.03) + descent
-        return text_width, text_height
-
-
     def create_image_overlay(self) -> Any:
         """ 
         Prepares an overlay containing an image.
@@ -181,6 +294,15 @@ class Overlay:
         """
         overlay_image_path = IMAGE_OVERLAYS_PATH / self.path
 
+        # The same image, resized in the same way, is reused from the render cache.
+        # Image overlays don't depend on the width of the photo.
+        key = None
+        if os.path.isfile(overlay_image_path):
+            key = render_cache.cache_key(self._configuration, 0, source=overlay_image_path)
+            overlay = render_cache.get(key)
+            if overlay:
+                return overlay
+
         try:
             image = Image.open(overlay_image_path).convert("RGBA")
         except Exception as e:
@@ -206,6 +328,7 @@ class Overlay:
             overlay = Image.new("RGBA", overlay_size, color=self.background_color)
             overlay.paste(image, (self.padding, self.padding), mask=image)
 
+            render_cache.put(key, overlay)
             return overlay
             
         except Exception as e:
@@ -0,0 +1,151 @@
+from typing import Any, Dict, Optional
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+from zanzocam.constants import *
+from zanzocam.webcam.utils import log, log_error
+
+
+# The most recently used overlays, newest last. Survives across the runs
+# only when running as a daemon.
+_memory_cache = OrderedDict()
+
+# Overlays can be rendered by several threads at once
+_lock = threading.RLock()
+
+
+
+def cache_key(data: Dict[str, Any], photo_width: int, source: Optional[Path] = None,
+              extra: Any = None) -> Optional[str]:
+    """
+    Returns the key of a rendered overlay: a hash of everything that
+    changes its pixels. That is the overlay configuration, the width of
+    the photo, the font, the content of the `source` image if any and
+    `extra` (like the layout of the text), plus the ZanzoCam version,
+    in case the rendering itself changes.
+
+    Returns None if the key can't be computed: the overlay is not cached.
+    """
+    try:
+        digest = hashlib.sha256()
+        digest.update(json.dumps([VERSION, data, photo_width, extra], sort_keys=True, default=str).encode())
+
+        # Checking the font by size and modification time is enough,
+        # hashing it would read a large file at every run
+        font = os.stat(FONT_PATH)
+        digest.update(f"{FONT_PATH}:{font.st_size}:{font.st_mtime}".encode())
+
+        if source:
+            with open(source, "rb") as source_file:
+                for chunk in iter(lambda: source_file.read(64 * 1024), b""):
+                    digest.update(chunk)
+
+        return digest.hexdigest()
+
+    except Exception as e:
+        log_error("Could not compute the key of the overlay in the render cache. "
+                  "It will be rendered from scratch.", e)
+        return None
+
+
+
+def get(key: Optional[str]) -> Optional[Image.Image]:
+    """
+    Returns a copy of the overlay rendered with the given key,
+    from memory or from disk, or None if it's not in the cache.
+    """
+    if not key:
+        return None
+
+    with _lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key].copy()
+
+    path = RENDER_CACHE_PATH / f"{key}.png"
+    if not os.path.exists(path):
+        return None
+    try:
+        with Image.open(str(path)) as cached:
+            image = cached.convert("RGBA")
+        # The modification time tells which overlays were used least recently
+        os.utime(path)
+    except Exception as e:
+        log_error(f"The cached overlay {path.name} can't be read. It will be rendered again.", e)
+        return None
+
+    _remember(key, image)
+    return image.copy()
+
+
+
+def put(key: Optional[str], image: Image.Image) -> None:
+    """
+    Stores a rendered overlay in memory and on disk, then removes the
+    overlays used least recently if the cache exceeds `RENDER_CACHE_MAX_SIZE`.
+    """
+    if not key or image is None:
+        return
+    _remember(key, image.copy())
+    try:
+        os.makedirs(RENDER_CACHE_PATH, exist_ok=True)
+        image.save(str(RENDER_CACHE_PATH / f"{key}.png"), format="PNG")
+    except Exception as e:
+        log_error("Could not store the overlay in the render cache.", e)
+        return
+    with _lock:
+        enforce_cache_limits()
+
+
+
+def enforce_cache_limits() -> None:
+    """
+    Deletes the overlays used least recently until the cache on disk
+    is within `RENDER_CACHE_MAX_SIZE`.
+    """
+    try:
+        entries = []
+        for name in os.listdir(RENDER_CACHE_PATH):
+            stat = os.stat(RENDER_CACHE_PATH / name)
+            entries.append((stat.st_mtime, stat.st_size, name))
+    except Exception as e:
+        log_error("Could not check the size of the render cache.", e)
+        return
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total_size <= RENDER_CACHE_MAX_SIZE:
+            break
+        try:
+            os.remove(RENDER_CACHE_PATH / name)
+            total_size -= size
+            log(f"The render cache is full: removed {name}, the overlay used least recently.")
+        except Exception as e:
+            log_error(f"Could not remove {name} from the render cache.", e)
+
+
+
+def clear_memory_cache() -> None:
+    """
+    Forgets the overlays kept in memory. The cache on disk is untouched.
+    """
+    with _lock:
+        _memory_cache.clear()
+
+
+
+def _remember(key: str, image: Image.Image) -> None:
+    """
+    Keeps a rendered overlay in memory, forgetting the oldest ones
+    beyond `RENDER_CACHE_MEMORY_ITEMS`.
+    """
+    with _lock:
+        _memory_cache[key] = image
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > RENDER_CACHE_MEMORY_ITEMS:
+            _memory_cache.popitem(last=False)
@@ -0,0 +1,83 @@
+from typing import Any, Dict, Optional
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+from zanzocam.constants import *
+from zanzocam.webcam.utils import log_error
+
+
+
+def load_index(path: Path = OVERLAYS_INDEX_FILE) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns an index of the files downloaded in the previous runs: for each
+    file, what the server said about it when it was downloaded (ETag and
+    Last-Modified over HTTP, the size and modification time over FTP),
+    plus the size and the SHA-256 of the local copy.
+
+    Returns an empty index if there's none or it can't be read.
+    """
+    try:
+        with open(path, "r") as index_file:
+            index = json.load(index_file)
+        if isinstance(index, dict):
+            return index
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_error(f"The index of the downloads {Path(path).name} can't be read. "
+                  "All its files will be downloaded again.", e)
+    return {}
+
+
+
+def save_index(index: Dict[str, Dict[str, Any]], path: Path = OVERLAYS_INDEX_FILE) -> None:
+    """
+    Stores an index of the downloaded files (see `load_index()`).
+    """
+    try:
+        temp_path = Path(path).parent / (Path(path).name + ".tmp")
+        with open(temp_path, "w") as index_file:
+            json.dump(index, index_file, indent=4)
+        os.replace(temp_path, path)
+    except Exception as e:
+        log_error(f"Could not save the index of the downloads {Path(path).name}. "
+                  "Its files will be downloaded again at the next run.", e)
+
+
+
+def describe_file(path: Path) -> Dict[str, Any]:
+    """
+    Returns the size and the SHA-256 of a local file, as stored in the index.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as local_file:
+        for chunk in iter(lambda: local_file.read(64 * 1024), b""):
+            digest.update(chunk)
+    return {"size": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+
+
+def cached_entry(index: Dict[str, Dict[str, Any]], name: str,
+                 path: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    """
+    Returns what the index knows about a file, but only if the local copy,
+    in `path` (by default, the overlay image called `name`), is still the one
+    that was downloaded. If it's missing or changed, returns None: the file
+    must be downloaded again, whatever the server says about it.
+    """
+    entry = index.get(name)
+    if not isinstance(entry, dict):
+        return None
+    try:
+        path = path or IMAGE_OVERLAYS_PATH / name
+        # The size is checked first, to avoid hashing files that changed anyway
+        if os.path.getsize(path) != entry.get("size"):
+            return None
+        if describe_file(path)["sha256"] != entry.get("sha256"):
+            return None
+    except OSError:
+        return None
+    return entry
@@ -4,12 +4,11 @@ import os
 import json
 import shutil
 import datetime
-import requests
 from ftplib import FTP, FTP_TLS, error_perm
 from json import JSONDecodeError
 
 from zanzocam.constants import *
-from zanzocam.webcam.utils import log, log_error, retry
+from zanzocam.webcam.utils import log, log_error, retry, request_timeout
 from zanzocam.webcam.configuration import Configuration
 from zanzocam.webcam.errors import ServerError
 
@@ -41,19 +40,27 @@ class FtpServer:
         self.subfolder = parameters.get("subfolder")
         self.max_photos = parameters.get("max_photos", 0)
 
+        # Size and modification time of the overlay images on the server,
+        # listed the first time they're needed
+        self._remote_overlays = None
+
+        # Size and modification time on the server of the last
+        # configuration downloaded
+        self.configuration_validators = {}
+
         # Estabilish the FTP connection
         try:
             if self.tls:
                 self._ftp_client = _Patched_FTP_TLS(host=self.hostname, 
                                                     user=self.username, 
                                                     passwd=self.password, 
-                                                    timeout=REQUEST_TIMEOUT*2)
+                                                    timeout=request_timeout(REQUEST_TIMEOUT*2))
                 self._ftp_client.prot_p()  # Set up secure data connection.
             else:
                 self._ftp_client = FTP(host=self.hostname, 
                                         user=self.username, 
                                         passwd=self.password, 
-                                        timeout=REQUEST_TIMEOUT*2)
+                                        timeout=request_timeout(REQUEST_TIMEOUT*2))
             if self.subfolder:
                 self._ftp_client.cwd(self.subfolder)
                 
@@ -62,10 +69,23 @@ class FtpServer:
                               "with the FTP server") from e
         
 
-    def download_new_configuration(self) -> Dict[str, Any]:
+    def download_new_configuration(self, cached: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """
-        Download the new configuration file from the server.
+        Download the new configuration file from the server, unless its
+        size and modification time on the server are the same of the copy
+        described by `cached` (see `download_index`). Stores them in 
+        `configuration_validators`.
+
+        Returns None if the configuration was not downloaded.
         """
+        # The local copy is reformatted, so the size on the server is stored apart
+        remote = self._remote_file_facts(FTP_CONFIGURATION_PATH)
+        if (cached and remote and cached.get("modify") == remote["modify"]
+                and cached.get("remote_size") == remote["size"]):
+            return None
+        self.configuration_validators = {"modify": remote["modify"], 
+                                         "remote_size": remote["size"]} if remote else {}
+
         self.configuration_string = ""
 
         # Callback for the incoming data
@@ -73,7 +93,7 @@ class FtpServer:
             self.configuration_string += line.decode(FTP_CONFIG_FILE_ENCODING)
 
         # Fetch the new config
-        response = self._ftp_client.retrbinary("RETR configuration/configuration.json", store_line)
+        response = self._ftp_client.retrbinary(f"RETR {FTP_CONFIGURATION_PATH}", store_line)
 
         # Make sure the server did not reply with an error
         if "226" in response:
@@ -84,16 +104,63 @@ class FtpServer:
         raise ServerError("The server replied with an error code: " + response)
             
     @retry(times=3, wait_for=10)
-    def download_overlay_image(self, image_name: str) -> None:
+    def download_overlay_image(self, image_name: str, cached: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """ 
-        Download an overlay image.
+        Download an overlay image, unless its size and modification time
+        on the server are the same of the copy described by `cached` 
+        (see `download_index`).
+
+        Returns the modification time of the image on the server, or `cached`
+        itself if the image was not downloaded.
         """
+        remote = self._remote_overlay_facts(image_name)
+        if (cached and remote and cached.get("modify") == remote["modify"] 
+                and cached.get("size") == remote["size"]):
+            log(f"Overlay image not changed, not downloaded: {image_name}")
+            return cached
+
         with open(IMAGE_OVERLAYS_PATH / image_name ,'wb') as overlay:
             response = self._ftp_client.retrbinary(
                             f"RETR {REMOTE_IMAGES_PATH}{image_name}", overlay.write)
         if not "226" in response:
             raise ServerError(f"The server replied with an error code for '{image_name}': " + response)
         log(f"New overlay image downloaded: {image_name}")
+        return {"modify": remote["modify"] if remote else None}
+
+
+    def _remote_overlay_facts(self, image_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the size and the modification time of an overlay image on
+        the server, or None if the server can't tell.
+
+        The whole overlays folder is listed with MLSD the first time, in a
+        single round trip. Servers without MLSD are asked SIZE and MDTM.
+        """
+        if self._remote_overlays is None:
+            try:
+                self._remote_overlays = dict(self._ftp_client.mlsd(REMOTE_IMAGES_PATH, facts=["size", "modify"]))
+            except Exception:
+                self._remote_overlays = {}
+
+        facts = self._remote_overlays.get(image_name, {})
+        if "size" in facts and "modify" in facts:
+            return {"size": int(facts["size"]), "modify": facts["modify"]}
+
+        return self._remote_file_facts(f"{REMOTE_IMAGES_PATH}{image_name}")
+
+
+    def _remote_file_facts(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the size and the modification time of a file on the server,
+        asking SIZE and MDTM, or None if the server can't tell.
+        """
+        try:
+            self._ftp_client.voidcmd("TYPE I")  # SIZE is unreliable in ASCII mode
+            size = self._ftp_client.size(path)
+            modify = self._ftp_client.sendcmd(f"MDTM {path}").split()[-1]
+            return {"size": size, "modify": modify}
+        except Exception:
+            return None
         
 
     def send_logs(self, path: Path):
@@ -121,9 +188,12 @@ class FtpServer:
                             "uploading the logs: " + response)
 
 
-    def upload_picture(self, image_path: Path, image_name: str, image_extension: str) -> str:
+    def upload_picture(self, image_path: Path, image_name: str, image_extension: str,
+                       timestamp: Optional[datetime.datetime] = None) -> str:
         """
         Uploads the new picture to the server.
+        If `max_photos = 0`, the picture name contains `timestamp`,
+        or the current time if no timestamp is given.
         Returns the final image path (for cleanup operations)
         """
         if not os.path.isfile(image_path):
@@ -132,12 +202,11 @@ class FtpServer:
         # Rename the picture according to max_photos
         modifier = ""
         if self.max_photos == 0:
-            modifier = datetime.datetime.now().strftime("_%Y-%m-%d_%H:%M:%S")
+            modifier = "_" + (timestamp or datetime.datetime.now()).strftime(PICTURE_DATE_FORMAT)
         elif self.max_photos > 1:
             modifier = "__0"
         final_image_name = image_name + modifier + "." + image_extension
         final_image_path = Path(image_path).parent / final_image_name
-        os.rename(image_path, final_image_path)
 
         # If the server is supposed to contain only a fixed amount of pictures,
         # apply the prefix to this one and scale the other pictures' prefixes.
@@ -161,15 +230,18 @@ class FtpServer:
                         log(f"Error: {str(e)}. Probably the image didn't exist. Ignoring.")
                         
         # Upload the picture
-        response = self._ftp_client.storbinary(
-            f"STOR pictures/{final_image_name}", open(final_image_path ,"rb"))
+        with open(image_path, "rb") as picture:
+            response = self._ftp_client.storbinary(f"STOR pictures/{final_image_name}", picture)
                 
         # Make sure the server did not reply with an error
         if not "226" in response:
             raise ServerError("The server replied with an error code while " +
                             "uploading the picture. The image was probably not sent! " +
                             "FTP Error: " + response)
-            
+
+        # Renamed only once uploaded: if the upload fails, the picture
+        # must stay where it is, to be uploaded again or spooled
+        os.rename(image_path, final_image_path)
         return final_image_path
 
 
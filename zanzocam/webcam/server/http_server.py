@@ -1,4 +1,4 @@
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import os
 import json
@@ -9,7 +9,7 @@ import traceback
 
 from zanzocam.constants import *
 from zanzocam.webcam.errors import ServerError
-from zanzocam.webcam.utils import log, log_error, retry, AllStringEncoder
+from zanzocam.webcam.utils import log, log_error, retry, request_timeout, AllStringEncoder
 
 
 class HttpServer:
@@ -34,6 +34,27 @@ class HttpServer:
             self.password = parameters.get("password", None)
             self.credentials = requests.auth.HTTPBasicAuth(self.username, self.password)
 
+        # ETag and Last-Modified headers of the last configuration downloaded
+        self.configuration_validators = {}
+
+        # Shared by the uploads between `open_session()` and `close_session()`
+        self.session = None
+
+    def open_session(self) -> None:
+        """
+        Makes the next uploads reuse a single connection to the server,
+        until `close_session()` is called.
+        """
+        self.session = requests.Session()
+
+    def close_session(self) -> None:
+        """
+        Closes the connection opened by `open_session()`, if any.
+        """
+        if self.session:
+            self.session.close()
+            self.session = None
+
     @staticmethod
     def _try_print_response_content(response):
         """
@@ -44,14 +65,30 @@ class HttpServer:
         except Exception as e:
             return str(response)
 
-    def download_new_configuration(self) -> Dict[str, Any]:
+    def download_new_configuration(self, cached: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """
-        Download the new configuration file from the server.
+        Download the new configuration file from the server, unless the
+        server replies that it didn't change since the copy described by
+        `cached` (see `download_index`). Stores the ETag and Last-Modified
+        headers of the reply in `configuration_validators`.
+
+        Returns None if the configuration was not downloaded.
         """
         r = "[no response from server]"
         try:
+            # Ask the server to send the configuration only if it changed
+            headers = {}
+            if cached:
+                if cached.get("etag"):
+                    headers["If-None-Match"] = cached["etag"]
+                if cached.get("last_modified"):
+                    headers["If-Modified-Since"] = cached["last_modified"]
+
             # Fetch the new config
-            r = requests.get(self.url, auth=self.credentials, timeout=REQUEST_TIMEOUT)
+            r = requests.get(self.url, auth=self.credentials, headers=headers, timeout=request_timeout())
+
+            if r.status_code == 304 and cached:
+                return None
             
             if r.status_code >= 400:
                 raise ServerError(f"Failed to download the configuration file. "
@@ -59,7 +96,8 @@ class HttpServer:
                                   f"{r.status_code} ({r.reason}). "
                                   f"Check your server configuration for errors. "
                                   f"Full server response:\n\n"
-                                  f"{self._try_print_response_content(r)}")
+                                  f"{self._try_print_response_content(r)}",
+                                  status_code=r.status_code)
                 
             response = r.json()
             if "configuration" not in response:
@@ -68,6 +106,8 @@ class HttpServer:
                     f"Full server response:\n\n"
                     f"{self._try_print_response_content(r)}")
 
+            self.configuration_validators = {"etag": r.headers.get("ETag"),
+                                             "last_modified": r.headers.get("Last-Modified")}
             return response["configuration"]
 
         except json.decoder.JSONDecodeError as e:
@@ -86,21 +126,39 @@ class HttpServer:
 
 
     @retry(times=3, wait_for=10)
-    def download_overlay_image(self, image_name: str) -> None:
+    def download_overlay_image(self, image_name: str, cached: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """ 
-        Download an overlay image.
+        Download an overlay image, unless the server replies that it didn't
+        change since the copy described by `cached` (see `download_index`),
+        checking its ETag and Last-Modified headers.
+
+        Returns the ETag and Last-Modified headers of the image, or `cached` 
+        itself if the image was not downloaded.
         """
         r = "[no response from server]"
         try:
             overlays_url = self.url + \
                             ("" if self.url.endswith("/") else "/") + \
                             REMOTE_IMAGES_PATH
+
+            # Ask the server to send the image only if it changed
+            headers = {}
+            if cached:
+                if cached.get("etag"):
+                    headers["If-None-Match"] = cached["etag"]
+                if cached.get("last_modified"):
+                    headers["If-Modified-Since"] = cached["last_modified"]
             
             # Download from the server
             r = requests.get(f"{overlays_url}{image_name}",
                                 stream=True,
                                 auth=self.credentials,
-                                timeout=REQUEST_TIMEOUT)
+                                headers=headers,
+                                timeout=request_timeout())
+
+            if r.status_code == 304 and cached:
+                log(f"Overlay image not changed, not downloaded: {image_name}")
+                return cached
 
             # Report every error code as a failed download
             if r.status_code >= 400:
@@ -109,7 +167,8 @@ class HttpServer:
                                   f"{r.status_code} ({r.reason}). "
                                   f"Check your server configuration for errors. "
                                   f"Full server response:\n\n"
-                                  f"{self._try_print_response_content(r)}")
+                                  f"{self._try_print_response_content(r)}",
+                                  status_code=r.status_code)
 
             # Save image to file
             r.raw.decode_content = True
@@ -118,6 +177,9 @@ class HttpServer:
                 shutil.copyfileobj(r.raw, f)
             log(f"New overlay image downloaded: {image_name}")
 
+            return {"etag": r.headers.get("ETag"), 
+                    "last_modified": r.headers.get("Last-Modified")}
+
         except Exception as e:
             err = ServerError(f"Something went wrong downloading the "
                               f"overlay image '{image_name}'. "
@@ -153,14 +215,15 @@ class HttpServer:
             r = requests.post(self.url, 
                             data=data, 
                             auth=self.credentials, 
-                            timeout=REQUEST_TIMEOUT)
+                            timeout=request_timeout())
 
             if r.status_code >= 400:
                 raise ServerError(
                     f"The server replied with status code {r.status_code} ({r.reason}). "
                     f"Check your server configuration for errors. "
                     f"Full server response:\n\n"
-                    f"{self._try_print_response_content(r)}")
+                    f"{self._try_print_response_content(r)}",
+                    status_code=r.status_code)
             try:
                 response = r.json()
             except json.decoder.JSONDecodeError as e:
@@ -187,9 +250,12 @@ class HttpServer:
             raise err.with_traceback(e.__traceback__)
 
 
-    def upload_picture(self, image_path: Path, image_name: str, image_extension: str) -> None:
+    def upload_picture(self, image_path: Path, image_name: str, image_extension: str,
+                       timestamp: Optional[datetime.datetime] = None) -> None:
         """
         Uploads the new picture to the server.
+        If `max_photos = 0`, the picture name contains `timestamp`,
+        or the current time if no timestamp is given.
         """
         if not os.path.isfile(image_path):
             raise ServerError(f"No picture to upload at {image_path}")
@@ -200,7 +266,7 @@ class HttpServer:
         try:
             date_time = ""
             if not self.max_photos:
-                date_time = datetime.datetime.now().strftime("_%Y-%m-%d_%H:%M:%S")
+                date_time = "_" + (timestamp or datetime.datetime.now()).strftime(PICTURE_DATE_FORMAT)
             final_image_name = f"{image_name}{date_time}.{image_extension}"
             final_image_path = Path(image_path).parent / final_image_name
             os.rename(image_path, final_image_path)
@@ -213,17 +279,19 @@ class HttpServer:
         # Upload the picture
         try:
             files = {'photo': open(final_image_path, 'rb')}
-            r = requests.post(self.url, 
-                            files=files, 
-                            auth=self.credentials,
-                            timeout=REQUEST_TIMEOUT)
+            post = self.session.post if self.session else requests.post
+            r = post(self.url, 
+                     files=files, 
+                     auth=self.credentials,
+                     timeout=request_timeout())
 
             if r.status_code >= 400:
                 raise ServerError(
                     f"The server replied with status code {r.status_code} ({r.reason}). "
                     f"Check your server configuration for errors. "
                     f"Full server response:\n\n"
-                    f"{self._try_print_response_content(r)}")
+                    f"{self._try_print_response_content(r)}",
+                    status_code=r.status_code)
             try:
                 response = r.json()
             except json.decoder.JSONDecodeError as e:
@@ -245,6 +313,13 @@ class HttpServer:
             return final_image_path
         
         except Exception as e:
+            # Give the picture its name back, so it can be uploaded again or spooled
+            if os.path.exists(final_image_path) and final_image_path != image_path:
+                try:
+                    os.rename(final_image_path, image_path)
+                except Exception as rename_error:
+                    log_error(f"Could not give the picture its name back: {image_path}", rename_error)
+
             err = ServerError(f"Something went wrong uploading the picture. "
                               f"Full server response:\n\n"
                               f"{self._try_print_response_content(r)}")
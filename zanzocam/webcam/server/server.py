@@ -2,20 +2,23 @@ from typing import Any, List, Dict, Optional
 
 import os
 import random
-from time import sleep
+import datetime
+from time import sleep, monotonic
 from pathlib import Path
 
 from zanzocam.constants import (
     CONFIGURATION_FILE,
+    CONFIGURATION_INDEX_FILE,
     CAMERA_LOG,
     IMAGE_OVERLAYS_PATH,
     DATA_PATH,
+    SPOOL_DRAIN_BUDGET,
 )
 from zanzocam.web_ui.utils import read_flag_file
+from zanzocam.webcam import spool
+from zanzocam.webcam.server import download_index
 from zanzocam.webcam.utils import log, log_error, retry
 from zanzocam.webcam.configuration import Configuration
-from zanzocam.webcam.server.http_server import HttpServer
-from zanzocam.webcam.server.ftp_server import FtpServer
 from zanzocam.webcam.errors import ServerError
 
 
@@ -39,10 +42,14 @@ class Server:
         # Protect against protocol not being a string, where upper() would fail
         self.protocol = str(self.protocol).upper()
 
+        # The backends are imported here so that only the one in use
+        # gets loaded: the HTTP one depends on requests, which is slow to import
         if self.protocol.upper() == "HTTP":
+            from zanzocam.webcam.server.http_server import HttpServer
             self._server = HttpServer(server_settings)
 
         elif self.protocol.upper() == "FTP":
+            from zanzocam.webcam.server.ftp_server import FtpServer
             self._server = FtpServer(server_settings)
 
         else:
@@ -73,6 +80,10 @@ class Server:
         Download the new configuration file from the server and updates it
         locally. Takes care of backups.
 
+        The configuration is downloaded only if it changed on the server 
+        since the last time, and written only if some of its sections 
+        changed: otherwise the old configuration is returned as it is.
+
         Returns either the new configuration or None in case of errors.
         """
         if not new_conf_path:
@@ -83,8 +94,40 @@ class Server:
         try:
             log(f"Downloading the new configuration file from {endpoint}")
 
-            # Get the new configuration from the server
-            configuration_data = self._server.download_new_configuration()
+            # The old configuration can be kept only if it's the one in
+            # new_conf_path, and not a backup
+            same_file = Path(old_configuration._path) == Path(new_conf_path)
+
+            # Get the new configuration from the server, if it changed
+            # since the last time and the local copy is still the one downloaded
+            index = download_index.load_index(CONFIGURATION_INDEX_FILE)
+            cached = None
+            if same_file:
+                cached = download_index.cached_entry(index, endpoint, path=new_conf_path)
+            configuration_data = self._server.download_new_configuration(cached=cached)
+
+            if configuration_data is None:
+                log("The configuration did not change on the server.")
+                changed_sections = []
+            else:
+                changed_sections = old_configuration.changed_sections(configuration_data)
+
+            if same_file and not changed_sections:
+                log("The configuration is the same as the one in use, not updating it.")
+
+                # The backup must hold this configuration, in case it gets restored
+                if not old_configuration.backup_is_current():
+                    old_configuration.backup()
+
+                entry = cached
+                if configuration_data is not None:
+                    entry = {**self._server.configuration_validators, 
+                             **download_index.describe_file(new_conf_path)}
+                if entry != index.get(endpoint):
+                    download_index.save_index({endpoint: entry}, CONFIGURATION_INDEX_FILE)
+                return old_configuration
+
+            log(f"Sections of the configuration that changed: {', '.join(changed_sections) or 'none'}")
 
             # If the old server replied something good, it's OK to backup its data.
             old_configuration.backup()
@@ -93,6 +136,10 @@ class Server:
             configuration = Configuration.create_from_dictionary(
                 configuration_data, path=new_conf_path)
 
+            download_index.save_index({endpoint: {**self._server.configuration_validators, 
+                                                  **download_index.describe_file(new_conf_path)}},
+                                      CONFIGURATION_INDEX_FILE)
+
             log("Configuration updated successfully")
             return configuration
 
@@ -119,10 +166,22 @@ class Server:
 
         log(f"Overlays to download: {images_list}")
 
+        # Images are downloaded only if they changed on the server
+        # since the last time, or if the local copy changed
+        index = download_index.load_index()
+        new_index = {}
+
         no_errors = True
         for image_name in images_list:
+            cached = download_index.cached_entry(index, image_name)
             try:
-                self._server.download_overlay_image(image_name)
+                entry = self._server.download_overlay_image(image_name, cached=cached)
+
+                # Describe the new copy of the images that were just downloaded
+                if entry is not None and entry is not cached:
+                    entry = {**entry, **download_index.describe_file(IMAGE_OVERLAYS_PATH / image_name)}
+                if entry is not None:
+                    new_index[image_name] = entry
 
             except Exception as e:
                 no_errors = False
@@ -130,6 +189,7 @@ class Server:
                           f"'{image_name}'. Ignoring it. This overlay "
                           f"image will not appear on the final image.", e)
 
+        download_index.save_index(new_index)
         return no_errors
 
 
@@ -147,11 +207,14 @@ class Server:
                       fatal="Logs won't be uploaded.")
 
 
-    @retry(times=5, wait_for=15)
+    # Few retries: if the upload keeps failing, the picture goes to the spool
+    @retry(times=2, wait_for=10)
     def upload_picture(self, image_path: Path, image_name: str,
-                       image_extension: str, cleanup: bool = True) -> None:
+                       image_extension: str, cleanup: bool = True,
+                       timestamp: Optional[datetime.datetime] = None) -> None:
         """
-        Uploads the new picture to the server.
+        Uploads the new picture to the server. `timestamp` is the time
+        the picture was taken, if it's not now (see the backends).
         """
         # Wait a random time, if enabled
         try:
@@ -180,7 +243,7 @@ class Server:
         # Upload the picture
         self.final_image_path = Path(
             self._server.upload_picture(
-                image_path, image_name, image_extension))
+                image_path, image_name, image_extension, timestamp=timestamp))
         log(f"Picture '{self.final_image_path.name}' uploaded successfully.")
 
         if cleanup:
@@ -189,3 +252,83 @@ class Server:
             if os.path.exists(self.final_image_path):
                 os.remove(self.final_image_path)
             log("Pictures deleted successfully.")
+
+
+    def spool_picture(self, image_path: Path, image_name: str,
+                      image_extension: str) -> bool:
+        """
+        Stores a picture that failed to upload in the spool, to be sent
+        by `drain_spool()` in the next runs.
+
+        Only pictures that get a timestamp in their name (max_photos = 0)
+        are spooled: with a fixed amount of pictures on the server, an
+        old picture would take the place of the newest ones.
+
+        Returns True if the picture was spooled, False otherwise.
+        """
+        if self._server.max_photos:
+            log(f"The picture is not stored for later, because the server "
+                f"keeps only the last {self._server.max_photos} pictures.")
+            return False
+        try:
+            timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(image_path))
+        except Exception as e:
+            log_error("Can't read the time the picture was taken. "
+                      "Using the current time.", e)
+            timestamp = datetime.datetime.now()
+        return spool.spool_picture(image_path, image_name, image_extension, timestamp)
+
+
+    def drain_spool(self, budget: float = SPOOL_DRAIN_BUDGET) -> bool:
+        """
+        Uploads the pictures that failed to upload in the previous runs,
+        newest first, over the connection of this server.
+        Stops at the first failure, or once `budget` seconds have passed:
+        the rest is left for the next runs.
+
+        Returns True if the spool was emptied, False otherwise.
+        """
+        entries = spool.list_spooled_pictures()
+        if not entries:
+            return True
+
+        if self._server.max_photos:
+            log(f"{len(entries)} pictures are waiting in the spool, but they "
+                f"won't be uploaded: the server keeps only the last "
+                f"{self._server.max_photos} pictures.")
+            return False
+
+        log(f"Uploading {len(entries)} pictures that failed to upload "
+            f"in the previous runs (time available: {budget}s)...")
+        # Over HTTP the pictures share one connection,
+        # the FTP client keeps its own open anyway
+        if self.protocol == "HTTP":
+            self._server.open_session()
+        try:
+            start = monotonic()
+            for uploaded, entry in enumerate(entries):
+
+                if monotonic() - start > budget:
+                    log(f"Time is up: {uploaded} pictures uploaded, {len(entries) - uploaded} "
+                        f"left for the next runs.")
+                    return False
+
+                try:
+                    final_path = self._server.upload_picture(
+                        entry["path"], entry["name"], entry["extension"],
+                        timestamp=entry["timestamp"])
+                except Exception as e:
+                    log_error(f"Could not upload the spooled picture {entry['path'].name}. "
+                              f"{len(entries) - uploaded} pictures are left for the next runs.", e)
+                    return False
+
+                # The backends give the picture its final name
+                spool.remove_spooled_picture(entry)
+                if final_path and os.path.exists(final_path):
+                    os.remove(final_path)
+        finally:
+            if self.protocol == "HTTP":
+                self._server.close_session()
+
+        log(f"All the {len(entries)} spooled pictures were uploaded successfully.")
+        return True
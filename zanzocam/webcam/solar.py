@@ -0,0 +1,91 @@
+import math
+import datetime
+
+from zanzocam.constants import *
+
+
+
+def solar_elevation(latitude: float, longitude: float, moment: datetime.datetime) -> float:
+    """
+    Returns the elevation of the centre of the sun above the horizon, in
+    degrees, seen from the given latitude and longitude (in degrees, north
+    and east are positive) at the given moment, with the equations of the
+    NOAA solar calculator. Accurate within a fraction of a degree between
+    1800 and 2100, refraction included: plenty for telling day from night.
+
+    Naive moments are taken as local time of the system.
+    """
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    unix_time = moment.timestamp()
+
+    # Julian century since J2000
+    julian_day = 2440587.5 + unix_time / 86400
+    century = (julian_day - 2451545) / 36525
+
+    mean_longitude = (280.46646 + century * (36000.76983 + century * 0.0003032)) % 360
+    mean_anomaly = 357.52911 + century * (35999.05029 - 0.0001537 * century)
+    eccentricity = 0.016708634 - century * (0.000042037 + 0.0000001267 * century)
+    anomaly = math.radians(mean_anomaly)
+    centre = (math.sin(anomaly) * (1.914602 - century * (0.004817 + 0.000014 * century))
+              + math.sin(2 * anomaly) * (0.019993 - 0.000101 * century)
+              + math.sin(3 * anomaly) * 0.000289)
+    omega = math.radians(125.04 - 1934.136 * century)
+    apparent_longitude = math.radians(mean_longitude + centre - 0.00569 - 0.00478 * math.sin(omega))
+
+    mean_obliquity = 23 + (26 + (21.448 - century * (46.815 + century * (0.00059 - century * 0.001813))) / 60) / 60
+    obliquity = math.radians(mean_obliquity + 0.00256 * math.cos(omega))
+    declination = math.asin(math.sin(obliquity) * math.sin(apparent_longitude))
+
+    # Equation of time, in minutes
+    y = math.tan(obliquity / 2) ** 2
+    longitude_rad = math.radians(mean_longitude)
+    equation_of_time = 4 * math.degrees(
+        y * math.sin(2 * longitude_rad)
+        - 2 * eccentricity * math.sin(anomaly)
+        + 4 * eccentricity * y * math.sin(anomaly) * math.cos(2 * longitude_rad)
+        - 0.5 * y ** 2 * math.sin(4 * longitude_rad)
+        - 1.25 * eccentricity ** 2 * math.sin(2 * anomaly))
+
+    minutes_utc = (unix_time / 60) % 1440
+    true_solar_time = (minutes_utc + equation_of_time + 4 * longitude) % 1440
+    hour_angle = math.radians(true_solar_time / 4 - 180)
+
+    latitude_rad = math.radians(latitude)
+    cos_zenith = (math.sin(latitude_rad) * math.sin(declination)
+                  + math.cos(latitude_rad) * math.cos(declination) * math.cos(hour_angle))
+    elevation = 90 - math.degrees(math.acos(min(max(cos_zenith, -1), 1)))
+    return elevation + _refraction(elevation)
+
+
+
+def light_phase(elevation: float) -> str:
+    """
+    Given the elevation of the sun (see `solar_elevation()`), returns `day`
+    if it's higher than `SOLAR_DAY_ELEVATION`, `night` if it's lower than
+    `SOLAR_NIGHT_ELEVATION` and `twilight` in between, when only measuring
+    the light can tell.
+    """
+    if elevation >= SOLAR_DAY_ELEVATION:
+        return "day"
+    if elevation <= SOLAR_NIGHT_ELEVATION:
+        return "night"
+    return "twilight"
+
+
+
+def _refraction(elevation: float) -> float:
+    """
+    Returns how much the atmosphere lifts the sun at the given elevation,
+    in degrees (the approximation of the NOAA solar calculator).
+    """
+    if elevation > 85:
+        return 0
+    tangent = math.tan(math.radians(elevation))
+    if elevation > 5:
+        seconds = 58.1 / tangent - 0.07 / tangent ** 3 + 0.000086 / tangent ** 5
+    elif elevation > -0.575:
+        seconds = 1735 + elevation * (-518.2 + elevation * (103.4 + elevation * (-12.79 + elevation * 0.711)))
+    else:
+        seconds = -20.772 / tangent
+    return seconds / 3600
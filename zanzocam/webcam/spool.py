@@ -0,0 +1,131 @@
+from typing import Any, Dict, List
+
+import os
+import json
+import shutil
+import datetime
+
+from zanzocam.constants import *
+from zanzocam.webcam.utils import log, log_error
+
+
+
+def spool_picture(image_path: Path, image_name: str, image_extension: str,
+                  timestamp: datetime.datetime) -> bool:
+    """
+    Moves a picture that could not be uploaded into the spool, together
+    with a JSON file with its metadata. The picture is stored under the
+    name it will have on the server plus a counter, because pictures of
+    a burst can be shot within the same second: they must not overwrite
+    each other. The backends give it its final name once uploaded.
+    Then enforces the size and age limits of the spool.
+
+    Returns True if the picture was spooled, False otherwise.
+    """
+    try:
+        os.makedirs(SPOOL_PATH, exist_ok=True)
+        base_name = f"{image_name}_{timestamp.strftime(PICTURE_DATE_FORMAT)}"
+        counter = 0
+        while os.path.exists(SPOOL_PATH / f"{base_name}_{counter}.{image_extension}"):
+            counter += 1
+        spooled_path = SPOOL_PATH / f"{base_name}_{counter}.{image_extension}"
+        shutil.move(str(image_path), str(spooled_path))
+
+        metadata = {
+            "name": image_name,
+            "extension": image_extension,
+            "timestamp": timestamp.strftime(PICTURE_DATE_FORMAT),
+        }
+        with open(str(spooled_path) + ".json", "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+
+        log(f"Picture stored in the spool as {spooled_path.name}: "
+            f"it will be uploaded in the next runs.")
+
+    except Exception as e:
+        log_error("Could not store the picture in the spool. "
+                  "This picture will be lost.", e)
+        return False
+
+    enforce_spool_limits()
+    return True
+
+
+
+def list_spooled_pictures() -> List[Dict[str, Any]]:
+    """
+    Returns the metadata of all the spooled pictures, newest first.
+    Each entry also contains the path of the picture and its size.
+    Pictures without metadata and metadata without a picture are removed.
+    """
+    if not os.path.isdir(SPOOL_PATH):
+        return []
+
+    entries = []
+    for filename in os.listdir(SPOOL_PATH):
+        path = SPOOL_PATH / filename
+
+        if filename.endswith(".json"):
+            if not os.path.exists(str(path)[:-len(".json")]):
+                _remove_quietly(path)
+            continue
+
+        try:
+            with open(str(path) + ".json", "r") as metadata_file:
+                entry = json.load(metadata_file)
+            entry["timestamp"] = datetime.datetime.strptime(
+                entry["timestamp"], PICTURE_DATE_FORMAT)
+            entry["path"] = path
+            entry["size"] = os.path.getsize(path)
+            entries.append(entry)
+
+        except Exception as e:
+            log_error(f"The spooled picture {filename} has no valid "
+                      f"metadata. Removing it.", e)
+            remove_spooled_picture({"path": path})
+
+    return sorted(entries, key=lambda entry: entry["timestamp"], reverse=True)
+
+
+
+def remove_spooled_picture(entry: Dict[str, Any]) -> None:
+    """
+    Removes a picture from the spool, along with its metadata.
+    """
+    _remove_quietly(entry["path"])
+    _remove_quietly(str(entry["path"]) + ".json")
+
+
+
+def enforce_spool_limits(now: datetime.datetime = None) -> None:
+    """
+    Removes the pictures older than SPOOL_MAX_AGE, then the oldest
+    ones until the spool is smaller than SPOOL_MAX_SIZE.
+    """
+    if not now:
+        now = datetime.datetime.now()
+
+    total_size = 0
+    for entry in list_spooled_pictures():
+        too_old = (now - entry["timestamp"]).total_seconds() > SPOOL_MAX_AGE
+        too_big = total_size + entry["size"] > SPOOL_MAX_SIZE
+
+        if too_old or too_big:
+            reason = "is too old" if too_old else "does not fit in the spool"
+            log(f"WARNING! The spooled picture {entry['path'].name} {reason}: "
+                f"it will be deleted without being uploaded.")
+            remove_spooled_picture(entry)
+        else:
+            total_size += entry["size"]
+
+
+
+def _remove_quietly(path: Path) -> None:
+    """
+    Removes a file, logging any error.
+    """
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        log_error(f"Could not remove {path} from the spool.", e)
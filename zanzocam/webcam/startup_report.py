@@ -0,0 +1,117 @@
+from typing import Dict, Tuple
+
+import sys
+import json
+import subprocess
+
+from zanzocam.constants import *
+from zanzocam.webcam.utils import log, log_error
+
+
+
+def startup_report(module: str = "zanzocam.webcam.main", top: int = 15) -> bool:
+    """
+    Measures how long it takes to import the given module in a fresh
+    interpreter, logs the slowest imports and compares the result with
+    the last report saved in STARTUP_REPORT_FILE, to spot regressions.
+
+    The report is saved only if no regression was found, so the saved
+    one always represents the best known state.
+    Returns True if no regression was found, False otherwise.
+    """
+    try:
+        timings = measure_import_times(module)
+    except Exception as e:
+        log_error("Could not measure the import times.", e)
+        return False
+
+    if module not in timings:
+        log_error(f"No import time found for {module}. "
+                  "Note that this report requires Python 3.7+.")
+        return False
+
+    total = timings[module][1]
+    report = f"Startup report: importing {module} takes {total/1000:.1f} ms.\n"
+    report += f"Slowest {top} imports (cumulative / self):\n"
+    slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)
+    slowest = [(name, times) for name, times in slowest if name != module]
+    for name, (self_time, cumulative_time) in slowest[:top]:
+        report += f"- {name}: {' ' * (40 - len(name))}" \
+                  f"{cumulative_time/1000:8.1f} ms / {self_time/1000:8.1f} ms\n"
+    log(report)
+
+    previous = load_startup_report()
+    if previous and module in previous:
+        previous_total = previous[module][1]
+        if total > previous_total * (1 + STARTUP_REGRESSION_TOLERANCE):
+            log(f"WARNING! The startup time regressed: {total/1000:.1f} ms "
+                f"against {previous_total/1000:.1f} ms of the last report.")
+            for name, (_, cumulative_time) in slowest:
+                previous_time = previous.get(name, (0, 0))[1]
+                if cumulative_time - previous_time > STARTUP_REGRESSION_MIN_DELTA:
+                    log(f"- {name} got slower: {previous_time/1000:.1f} ms "
+                        f"-> {cumulative_time/1000:.1f} ms")
+            return False
+        log(f"No regression against the last report "
+            f"({previous_total/1000:.1f} ms).")
+
+    try:
+        with open(STARTUP_REPORT_FILE, "w") as report_file:
+            json.dump(timings, report_file)
+    except Exception as e:
+        log_error("Could not save the startup report.", e)
+    return True
+
+
+
+def measure_import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Imports the module in a new interpreter with `-X importtime`.
+    Returns a dictionary of module name: (self time, cumulative time),
+    both in microseconds.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed: "
+                           f"{process.stderr.decode('utf-8')}")
+
+    return parse_import_times(process.stderr.decode("utf-8"))
+
+
+
+def parse_import_times(output: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parses the output of `python -X importtime`.
+    Returns a dictionary of module name: (self time, cumulative time).
+    """
+    timings = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_time, cumulative_time, name = line[len("import time:"):].split("|")
+            timings[name.strip()] = (int(self_time), int(cumulative_time))
+        except ValueError:
+            # The header line
+            continue
+    return timings
+
+
+
+def load_startup_report() -> Dict[str, Tuple[int, int]]:
+    """
+    Loads the last saved startup report. Returns an empty dict
+    if there is no report yet or it can't be read.
+    """
+    try:
+        with open(STARTUP_REPORT_FILE, "r") as report_file:
+            return {name: tuple(times) for name, times in json.load(report_file).items()}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log_error("Could not read the last startup report. Ignoring it.", e)
+    return {}
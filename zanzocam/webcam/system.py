@@ -1,22 +1,28 @@
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import os
 import re
 import sys
+import json
 import math
 import shutil
 import locale
-import requests
 import datetime
+import threading
 import subprocess
+from time import monotonic
 from pathlib import Path
 from textwrap import dedent
 
 from zanzocam.constants import *
-from zanzocam.webcam.utils import log, log_error
+from zanzocam.webcam.utils import log, log_error, request_timeout, BackgroundTask
 from zanzocam.web_ui.utils import read_flag_file
 
 
+# Serializes the access to STATUS_CACHE_FILE from the status probes
+_status_cache_lock = threading.Lock()
+
+
 def log_general_status() -> bool:
     """
     Returns True if the execution was successful, False in case of errors
@@ -54,13 +60,15 @@ def report_general_status() -> Dict:
     In all cases, None means that the value could not be retrieved
     (i.e. an error occurred). Errors will be logged in the console with
     their stacktraces for further debug.
+
+    The probes run concurrently, each with its own timeout.
+    The slow-changing values are cached across runs.
     """
     status = {}
     status["version"] = VERSION
     status["current time"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    status["last reboot"] = get_last_reboot_time()
-    status["uptime"] = get_uptime()
 
+    # The hotspot script connects to a known WiFi, if any: run it before the network probes
     autohotspot_status = run_autohotspot()
     if autohotspot_status is None:
         status["hotspot status"] = "FAILED (see stacktrace)"
@@ -70,17 +78,89 @@ def report_general_status() -> Dict:
         else: 
             status["hotspot status"] = "ON (no known WiFi in range)"
 
-    status['wifi data'] = get_wifi_data()
-    status['internet access'] = check_internet_connectivity()
+    results = run_probes({
+        'uptime': (get_uptime, STATUS_PROBE_TIMEOUT),
+        'wifi data': (get_wifi_data, STATUS_PROBE_TIMEOUT),
+        'internet access': (check_internet_connectivity, CHECK_UPLINK_TIMEOUT + 1),
+        'disk size': (lambda: cached_status_value("disk size", get_filesystem_size), STATUS_PROBE_TIMEOUT),
+        'free disk space': (get_free_space_on_disk, STATUS_PROBE_TIMEOUT),
+        'RAM': (get_ram_stats, STATUS_PROBE_TIMEOUT),
+    })
+
+    # Reboot time and uptime come from the same reading of /proc/uptime
+    uptime = results.pop("uptime")
+    status["last reboot"] = None
+    if uptime is not None:
+        status["last reboot"] = (datetime.datetime.now() - uptime).replace(microsecond=0)
+    status["uptime"] = uptime
+
+    status['wifi data'] = results['wifi data']
+    status['internet access'] = results['internet access']
     status['max upload wait'] = get_max_random_upload_interval()
 
-    status['disk size'] = get_filesystem_size()
-    status['free disk space'] = get_free_space_on_disk()
-    status['RAM'] = get_ram_stats()
+    status['disk size'] = results['disk size']
+    status['free disk space'] = results['free disk space']
+    status['RAM'] = results['RAM']
     
     return status
 
 
+def run_probes(probes: Dict[str, Tuple[Callable[[], Any], float]]) -> Dict[str, Any]:
+    """
+    Runs all the given probes concurrently. Each probe is given as
+    name: (function, timeout in seconds).
+    Returns a dictionary of name: result. Probes that time out are
+    logged and get None as result: they are left running in the background,
+    in daemon threads that don't delay the end of the run.
+    """
+    start = monotonic()
+    tasks = {name: BackgroundTask(probe) for name, (probe, _) in probes.items()}
+
+    results = {}
+    for name, task in tasks.items():
+        timeout = probes[name][1]
+        try:
+            results[name] = task.result(timeout=max(0, start + timeout - monotonic()))
+        except TimeoutError:
+            log_error(f"The status probe '{name}' did not answer within {timeout} seconds.")
+            results[name] = None
+        except Exception as e:
+            log_error(f"The status probe '{name}' failed.", e)
+            results[name] = None
+
+    return results
+
+
+def cached_status_value(name: str, probe: Callable[[], Any], ttl: float = STATUS_CACHE_TTL) -> Any:
+    """
+    Returns the value of a slow-changing probe, like the disk size.
+    The value is read from STATUS_CACHE_FILE if it was stored less than
+    `ttl` seconds ago, otherwise the probe is run and its result stored.
+    Values must be JSON serializable. Failed probes (None) are not cached.
+    """
+    with _status_cache_lock:
+        cache = {}
+        try:
+            with open(STATUS_CACHE_FILE, "r") as cache_file:
+                cache = json.load(cache_file)
+            stored_at, value = cache[name]
+            if 0 <= datetime.datetime.now().timestamp() - stored_at < ttl:
+                return value
+        except Exception:
+            # No cache, unreadable cache or no value for this probe
+            pass
+
+        value = probe()
+        if value is not None:
+            try:
+                cache[name] = (datetime.datetime.now().timestamp(), value)
+                with open(STATUS_CACHE_FILE, "w") as cache_file:
+                    json.dump(cache, cache_file)
+            except Exception as e:
+                log_error("Could not cache the status report values.", e)
+        return value
+
+
 def get_max_random_upload_interval():
     try:
         random_upload_interval = int(read_flag_file(DATA_PATH / "upload-interval.txt", default="5"))
@@ -95,36 +175,23 @@ def get_last_reboot_time() -> Optional[datetime.datetime]:
     Read the last reboot time of ZANZOCAM as a datetime object.
     Returns None if an error occurs.
     """
-    try:
-        uptime_proc = subprocess.Popen(['/usr/bin/uptime', '-s'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT)
-        stdout, stderr = uptime_proc.communicate()
-        
-        if uptime_proc.returncode > 0:
-            raise Exception(f"Process failed with return code "
-                            f"{uptime_proc.returncode}. "
-                            f"Stdout: {stdout}"
-                            f"Stderr: {stderr}")
-
-        last_reboot_string = stdout.decode('utf-8').strip()
-        return datetime.datetime.strptime(last_reboot_string, 
-                                            "%Y-%m-%d %H:%M:%S")
-
-    except Exception as e:
-        log_error("Could not get last reboot time information", e)
-    return None
+    uptime = get_uptime()
+    if uptime is None:
+        log_error("Could not get last reboot time information")
+        return None
+    return (datetime.datetime.now() - uptime).replace(microsecond=0)
 
 
 
 def get_uptime() -> Optional[datetime.timedelta]:
     """ 
-    Read the uptime of ZANZOCAM as a timedelta object.
+    Read the uptime of ZANZOCAM from /proc/uptime as a timedelta object.
     Returns None if an error occurs.
     """
     try:
-        last_reboot = get_last_reboot_time()
-        return datetime.datetime.now() - last_reboot
+        with open("/proc/uptime", "r") as uptime_file:
+            seconds = float(uptime_file.read().split()[0])
+        return datetime.timedelta(seconds=int(seconds))
 
     except Exception as e:
         log_error("Could not get uptime information", e)
@@ -182,7 +249,11 @@ def get_wifi_data() -> Optional[Dict[str, str]]:
         iwconfig_proc = subprocess.Popen(['/usr/sbin/iwconfig', 'wlan0'],
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT)
-        stdout, stderr = iwconfig_proc.communicate()
+        try:
+            stdout, stderr = iwconfig_proc.communicate(timeout=STATUS_PROBE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            iwconfig_proc.kill()
+            raise
         
         if iwconfig_proc.returncode > 0:
             raise Exception(f"Process failed with return code "
@@ -222,8 +293,11 @@ def check_internet_connectivity() -> Optional[bool]:
     Returns True if there is Internet connection, False if there isn't, 
     None if an error occurred during the test.
     """
+    # Imported here because it's slow to load, see `z-webcam --startup-report`
+    import requests
+
     try:
-        r = requests.head(CHECK_UPLINK_URL, timeout=REQUEST_TIMEOUT)
+        r = requests.head(CHECK_UPLINK_URL, timeout=request_timeout(CHECK_UPLINK_TIMEOUT))
         return True
     except requests.ConnectionError as ex:
         return False
@@ -416,7 +490,7 @@ def update_crontab(time: Dict, backup: bool = True) -> bool:
 
     # Get the crontab content
     try:
-        cron_strings = prepare_crontab_string(time)
+        content = crontab_content(time)
     except Exception as e:
         log_error("Something happened assembling the crontab. "
                     "Aborting crontab update.", e)
@@ -438,9 +512,7 @@ def update_crontab(time: Dict, backup: bool = True) -> bool:
             remove_root_owned_file(TEMP_CRONJOB)
 
         with open(TEMP_CRONJOB, 'w') as d:
-            d.writelines("# ZANZOCAM - shoot picture\n")
-            for line in cron_strings:
-                d.writelines(f"{line} {SYSTEM_USER} {sys.argv[0]}\n")
+            d.write(content)
 
     except Exception as e:
         log_error("Failed to generate the new crontab. "
@@ -468,6 +540,40 @@ def update_crontab(time: Dict, backup: bool = True) -> bool:
 
 
 
+def crontab_content(time: Dict) -> str:
+    """
+    Returns the content of the crontab file for the given time settings.
+    """
+    command = sys.argv[0]
+    # In daemon mode the daemon follows the schedule by itself,
+    # so cron only needs to restart it in case it died
+    if time.get("daemon", False):
+        cron_strings = [f"*/{DAEMON_WATCHDOG_INTERVAL} * * * *"]
+        command += " --daemon"
+    else:
+        cron_strings = prepare_crontab_string(time)
+
+    content = "# ZANZOCAM - shoot picture\n"
+    for line in cron_strings:
+        content += f"{line} {SYSTEM_USER} {command}\n"
+    return content
+
+
+
+def crontab_up_to_date(time: Dict) -> bool:
+    """
+    Checks whether the crontab file matches the given time settings.
+    Returns False if it doesn't or it can't be read, for example because
+    the last update failed: in that case the crontab should be updated.
+    """
+    try:
+        with open(CRONJOB_FILE, "r") as crontab:
+            return crontab.read() == crontab_content(time)
+    except Exception:
+        return False
+
+
+
 def prepare_crontab_string(time: Dict, length: Optional[int] = None) -> List[str]:
     """
     Converts time directives from the configuration file into
@@ -0,0 +1,127 @@
+from typing import Any, Callable, List, Optional, Tuple
+
+import math
+from functools import lru_cache
+
+from zanzocam.constants import *
+
+
+
+@lru_cache(maxsize=TEXT_LAYOUT_CACHE_SIZE)
+def text_length(font: Any, text: str) -> float:
+    """
+    Returns how far `text` moves the pen, in pixels with 1/64 precision,
+    without kerning against the text around it. Cached by font and text,
+    so the words that come back in a caption are measured only once.
+    """
+    return font.getlength(text)
+
+
+
+def text_width(font: Any, text: str) -> int:
+    """
+    Returns the exact width of `text` once rendered, kerning included.
+    """
+    return font.getsize(text)[0]
+
+
+
+def layout_text(font: Any, text: str, max_width: int) -> Tuple[List[str], int, int]:
+    """
+    Wraps `text` to make it fit into `max_width` pixels and measures it,
+    in one pass. Newlines in the text are kept.
+
+    Returns the lines, the width and the height of the text, in this order
+    (no margins applied here).
+    """
+    lines, estimates = [], []
+    for line in text.split("\n"):
+        wrapped_lines, wrapped_estimates = wrap_line(font, line, max_width)
+        lines += wrapped_lines
+        estimates += wrapped_estimates
+    return (lines, *measure_lines(font, lines, estimates))
+
+
+
+def wrap_line(font: Any, line: str, max_width: int) -> Tuple[List[str], List[float]]:
+    """
+    Splits a line of text into as many lines as needed to make it fit
+    into `max_width` pixels, breaking at the spaces only. The lines, but
+    the last one, keep the space they were broken at.
+
+    The width of each line is estimated summing the cached widths of its
+    words (see `text_length()`), and measured exactly only when the
+    estimate is too close to `max_width` to tell (see `TEXT_LAYOUT_MARGIN`),
+    so the result is the same as measuring every line.
+
+    Returns the lines and their estimated widths.
+    """
+    margin = _margin(font)
+    space = text_length(font, " ")
+    words = line.split(" ")
+    lengths = [text_length(font, word) for word in words]
+
+    line_length = sum(lengths) + space * (len(words) - 1)
+    if _fits(font, line_length, max_width, margin, lambda: line):
+        return [line], [line_length]
+
+    lines, estimates = [], []
+    new_line, new_line_length = [], 0.0
+    for word, length in zip(words, lengths):
+        if _fits(font, new_line_length + length, max_width, margin,
+                 lambda: " ".join(new_line + [word])):
+            new_line.append(word)
+            new_line_length += length + space
+        else:
+            lines.append(" ".join(new_line + [""]) if new_line else "")
+            estimates.append(new_line_length)
+            new_line, new_line_length = [word], length + space
+    if new_line:
+        lines.append(" ".join(new_line + [""]))
+        estimates.append(new_line_length)
+    return lines, estimates
+
+
+
+def measure_lines(font: Any, lines: List[str], estimates: Optional[List[float]] = None) -> Tuple[int, int]:
+    """
+    Measures the bounding box of the lines of text (no margins applied here).
+
+    If the estimated widths of the lines are given (see `wrap_line()`),
+    only the lines that might be the widest are measured exactly.
+    """
+    # Only the lines whose estimate is close to the widest one can be the widest
+    candidates = lines
+    if estimates:
+        widest = max(estimates)
+        margin = _margin(font)
+        candidates = [line for line, estimate in zip(lines, estimates) if estimate >= widest - 2*margin]
+    width = max([text_width(font, line) for line in candidates])
+
+    # https://stackoverflow.com/questions/43060479/how-to-get-the-font-pixel-height-using-pils-imagefont-class
+    ascent, descent = font.getmetrics()
+    # The text has approximately a 3% interline space
+    height = math.ceil(len(lines) * ascent * 1.03) + descent
+    return width, height
+
+
+
+def _margin(font: Any) -> float:
+    """
+    How far from the real width the estimated one can be, in pixels.
+    """
+    return 2 + TEXT_LAYOUT_MARGIN * font.size
+
+
+
+def _fits(font: Any, estimate: float, max_width: int, margin: float, text: Callable[[], str]) -> bool:
+    """
+    Tells whether the text fits into `max_width` pixels from its estimated
+    width, measuring `text()` exactly only if the estimate is within
+    `margin` pixels from `max_width`.
+    """
+    if estimate <= max_width - margin:
+        return True
+    if estimate > max_width + margin:
+        return False
+    return text_width(font, text()) <= max_width
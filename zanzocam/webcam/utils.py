@@ -1,23 +1,45 @@
+from typing import Any, Callable, Optional
+
 import sys
 import json
+import random
+import socket
 import logging
 import datetime
+import threading
 import traceback
-from time import sleep
+from time import sleep, monotonic
 from pathlib import Path
 from functools import wraps
 
+from zanzocam.constants import (
+    REQUEST_TIMEOUT,
+    MIN_REQUEST_TIMEOUT,
+    RETRY_POLICIES,
+    RETRY_MAX_WAIT,
+    RETRY_JITTER,
+)
+
+
+# Monotonic time by which the current run should be over (see `set_run_deadline`)
+_run_deadline = None
+
 
 def retry(times: int, wait_for: float):
     """
     Makes the decorated function try to run without
     exceptions 'times' times.
     If an exception occurs, logs it and tries again
-    after `wait_for` seconds.
+    after `wait_for` seconds, doubling the wait at every
+    retry (see `backoff_delay`).
     Otherwise returns at the first successful attempt.
 
-    Returns None in case there is an exception at the 
-    last run as well.
+    Errors of a known class (see `classify_error`) follow
+    their policy in RETRY_POLICIES instead of `times` and
+    `wait_for`. No retry is done if the wait would go beyond
+    the run deadline (see `set_run_deadline`).
+
+    Raises the exception of the last attempt if none succeeds.
     """
     def retry_decorator(func):
         @wraps(func)
@@ -28,19 +50,157 @@ def retry(times: int, wait_for: float):
                     return func(*args, **kwargs)
 
                 except Exception as e:
-                    if loops >= times:
+                    error_class = classify_error(e)
+                    policy = RETRY_POLICIES.get(error_class, {"times": times, "wait_for": wait_for})
+                    if loops >= policy["times"]:
                         raise e
 
                     loops += 1
+                    delay = backoff_delay(loops, policy["wait_for"])
+                    remaining_time = time_left()
+                    if remaining_time is not None and delay >= remaining_time:
+                        log(f"Not retrying: the run must end within "
+                            f"{max(remaining_time, 0):.0f} sec.")
+                        raise e
+
                     log_error("An exception occurred!", e)
-                    log(f"Waiting for {wait_for} sec. "
-                        f"and retrying ({loops}/{times})")
-                    sleep(wait_for)
+                    log(f"Waiting for {delay:.1f} sec. "
+                        f"and retrying ({loops}/{policy['times']})" +
+                        (f" [{error_class} error]" if error_class else ""))
+                    sleep(delay)
 
         return retry_wrapper
     return retry_decorator
 
 
+def backoff_delay(attempt: int, wait_for: float) -> float:
+    """
+    Returns how long to wait before the given retry (starting from 1):
+    `wait_for` doubled at every retry up to RETRY_MAX_WAIT, randomized
+    by RETRY_JITTER.
+    """
+    delay = min(wait_for * 2 ** (attempt - 1), RETRY_MAX_WAIT)
+    return delay * random.uniform(1 - RETRY_JITTER, 1)
+
+
+def classify_error(exception: BaseException) -> Optional[str]:
+    """
+    Finds out the class of an error, looking at the exception and
+    the ones that caused it: "dns", "server", "client" or "camera".
+    Returns None if the error falls in none of them.
+    """
+    seen = set()
+    while exception is not None and id(exception) not in seen:
+        seen.add(id(exception))
+        error_name = type(exception).__name__
+        message = str(exception)
+
+        if isinstance(exception, socket.gaierror) or any(
+                dns_error in message for dns_error in [
+                    "Name or service not known",
+                    "Temporary failure in name resolution",
+                    "Failed to resolve"]):
+            return "dns"
+
+        status_code = getattr(exception, "status_code", None)
+        if status_code and 500 <= status_code < 600:
+            return "server"
+        if status_code and 400 <= status_code < 500:
+            return "client"
+
+        # ftplib and picamera are matched by name, not to import them here
+        if error_name == "error_temp":
+            return "server"
+        if error_name == "error_perm":
+            return "client"
+        if error_name.startswith("PiCamera"):
+            return "camera"
+
+        exception = exception.__cause__ or exception.__context__
+    return None
+
+
+def set_run_deadline(seconds: Optional[float]) -> None:
+    """
+    Sets how long the current run can last from now, in seconds.
+    Retries and network timeouts are shortened to respect it.
+    Pass None to remove the deadline.
+    """
+    global _run_deadline
+    _run_deadline = None if seconds is None else monotonic() + seconds
+
+
+def time_left(limit: Optional[float] = None) -> Optional[float]:
+    """
+    Returns the seconds left before the run deadline, at most `limit`.
+    If no deadline is set, returns `limit`.
+    """
+    if _run_deadline is None:
+        return limit
+    remaining_time = _run_deadline - monotonic()
+    if limit is None:
+        return remaining_time
+    return min(remaining_time, limit)
+
+
+def available_memory() -> Optional[int]:
+    """
+    Returns the memory available for new allocations without swapping,
+    in bytes (MemAvailable in /proc/meminfo), or None if it can't be read.
+    """
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    # The value is in kB
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    return None
+
+
+def request_timeout(timeout: float = REQUEST_TIMEOUT) -> float:
+    """
+    Returns the timeout to use for a network request: `timeout`, or less
+    if the run deadline is closer, but never less than MIN_REQUEST_TIMEOUT.
+    """
+    return max(time_left(timeout), MIN_REQUEST_TIMEOUT)
+
+
+class BackgroundTask:
+    """
+    Runs a function in a separate thread as soon as it's created.
+    Call `result()` to wait for the function to finish and get its
+    return value: exceptions raised by the function are re-raised there.
+    """
+    def __init__(self, func: Callable, *args, **kwargs):
+        self._result = None
+        self._exception = None
+        self._thread = threading.Thread(
+            target=self._run, args=(func, args, kwargs), daemon=True)
+        self._thread.start()
+
+    def _run(self, func: Callable, args, kwargs) -> None:
+        try:
+            self._result = func(*args, **kwargs)
+        except Exception as e:
+            self._exception = e
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        """
+        Waits for the function to return and returns its value.
+        Can be called multiple times.
+        Raises TimeoutError if the function is still running after
+        `timeout` seconds: it's left running in the background.
+        """
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError(f"the task did not finish within {timeout} seconds")
+        if self._exception:
+            raise self._exception
+        return self._result
+
+
 class AllStringEncoder(json.JSONEncoder):
     """
     To transform every value into a string